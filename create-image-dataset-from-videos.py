@@ -1,8 +1,16 @@
 import logging
 import os
 import argparse
-from src.video_labels import read_video_labels_df 
-from src.create_dataset import create_max_constriction_dataset, create_all_frames_dataset
+from src.create_dataset import create_max_constriction_dataset, create_all_frames_dataset, create_clips_dataset, LABEL_FRAME_SUFFIXES
+from src.dataset_sink import ZipSink
+from src.frame_sampling import FrameSampler
+from src.build_manifest import BuildManifest
+from src.image_tool import ImageEncoder
+from src.profiling import enable_profiling
+from src.dataset_stats import DatasetStats
+from src.video_probe import VideoProbe
+from src.video_decoder import VideoDecoder
+from src.frame_geometry import FrameGeometry, INTERPOLATIONS, RESIZE_MODES
 import re
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -11,26 +19,43 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 def create_dataset_dir(args):
     """
     Create a directory for the dataset based on the current run ID and dataset type.
+    In incremental mode, the latest directory of the same dataset type and frame size is reused instead.
     """
     dataset_type = args.dataset_type
     dataset_type = dataset_type.replace('_', '-')
 
     prev_run_dirs = []
     if os.path.isdir(args.output_dir):
+        # Dataset ZIPs count as previous runs too
         prev_run_dirs = [
             d 
             for d in os.listdir(args.output_dir) 
-            if os.path.isdir(os.path.join(args.output_dir, d))
+            if (os.path.isdir(os.path.join(args.output_dir, d)) or d.endswith('.zip'))
             and dataset_type in d
         ]
         prev_run_ids = [re.match(r'^\d+', d) for d in prev_run_dirs]
         prev_run_ids = [int(d.group(0)) for d in prev_run_ids if d is not None]
         cur_run_id = max(prev_run_ids, default=-1) + 1
 
+        if args.incremental:
+            suffix = f'-{dataset_type}-{args.frame_size[0]}'
+            reusable_dirs = sorted(
+                d for d in prev_run_dirs
+                if re.match(r'^\d+' + re.escape(suffix) + '$', d) and os.path.isdir(os.path.join(args.output_dir, d))
+            )
+            if reusable_dirs:
+                dataset_dir = os.path.join(args.output_dir, reusable_dirs[-1])
+                logging.info(f"Resuming the build in existing directory: {dataset_dir}")
+                return dataset_dir
+
     dataset_dir = f'{cur_run_id:05d}-{dataset_type}-{args.frame_size[0]}'
     dataset_dir = os.path.join(args.output_dir, dataset_dir)
 
-    if not os.path.exists(dataset_dir):
+    if args.output_format == 'zip':
+        # The images go straight into `<dataset_dir>.zip`, no directory is needed
+        if os.path.exists(f"{dataset_dir}.zip"):
+            logging.warning(f"File {dataset_dir}.zip already exists and will be overwritten.")
+    elif not os.path.exists(dataset_dir):
         os.makedirs(dataset_dir)
         logging.info(f"Created directory: {dataset_dir}")
     else:
@@ -40,21 +65,58 @@ def create_dataset_dir(args):
 
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(description="Process some integers.")
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Create an image or clip dataset from the videos.")
 
     parser.add_argument('--video-dir', type=str, default='data/videos/', help='Path to the video directory')
     parser.add_argument('--labels', type=str, default='data/rotulos/Frames e PAS.xlsx', help='Path to the labels file')
     parser.add_argument('--output-dir', type=str, default='data/images/', help='Path to the output directory for images')
-    parser.add_argument('--frame-size', type=tuple, default=(512, 512), help='Size of the output images (width, height)')
-    parser.add_argument('--dataset-type', type=str, default='max_constriction', choices=['max_constriction', 'all_frames'], help='Type of dataset to create: max_constriction or all_frames')
+    parser.add_argument('--frame-size', type=int, nargs=2, default=(512, 512), metavar=('WIDTH', 'HEIGHT'), help='Size of the output images')
+    parser.add_argument('--dataset-type', type=str, default='max_constriction', choices=['max_constriction', 'all_frames', 'clips'], help='Type of dataset to create: max_constriction, all_frames, or clips of frames around the labeled events')
+    parser.add_argument('--executor', type=str, default='thread', choices=['thread', 'process'], help='Execution backend for all_frames: one video per thread, or frame-range chunks on a process pool')
+    parser.add_argument('--workers', type=int, default=None, help='Number of parallel workers (defaults to the executor default)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Maximum number of frames per task with the process executor')
+    parser.add_argument('--pipeline-workers', type=int, default=0, help='Resize and encode the frames of each video on this many threads while it is decoded (all_frames only, 0 to process them serially)')
+    parser.add_argument('--queue-depth', type=int, default=32, help='Capacity of the queues between the decode, encode and write stages of --pipeline-workers')
+    parser.add_argument('--extra-frames', type=str, nargs='*', default=[], choices=['frame_repouso', 'pas_frame'], help='Other labeled frames to save alongside the max constriction frame')
+    parser.add_argument('--stride', type=int, default=1, help='Keep every Nth frame (all_frames only)')
+    parser.add_argument('--dedup-threshold', type=float, default=None, help='Drop frames whose mean absolute difference to the last kept frame, on a 16x16 grayscale thumbnail, is below this value (all_frames only)')
+    parser.add_argument('--focus-window', type=int, default=0, help='Sample every --focus-stride frame within this many frames of frame_max_constricao (all_frames only)')
+    parser.add_argument('--focus-stride', type=int, default=1, help='Stride used inside the focus window')
+    parser.add_argument('--clip-radius', type=int, default=8, help='Number of frames kept before and after every event frame (clips only)')
+    parser.add_argument('--clip-events', type=str, nargs='+', default=list(LABEL_FRAME_SUFFIXES), choices=list(LABEL_FRAME_SUFFIXES), help='Label columns of the event frames the clips are centered on (clips only)')
+    parser.add_argument('--clips-per-chunk', type=int, default=64, help='Number of clips per chunk file (clips only)')
+    parser.add_argument('--no-clip-compression', action='store_true', help='Write uncompressed .npy chunks that loaders can memory-map instead of compressed .npz ones (clips only)')
+    parser.add_argument('--crop', type=int, nargs=4, default=None, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'), help='Crop every frame to this box before resizing')
+    parser.add_argument('--auto-crop', action='store_true', help='Detect the region with anatomy of every video (skipping black borders and overlays) and crop to it')
+    parser.add_argument('--resize-mode', type=str, default='stretch', choices=RESIZE_MODES, help='Stretch the (cropped) frame to --frame-size, letterbox it, or crop its center to the output aspect ratio')
+    parser.add_argument('--interpolation', type=str, default='linear', choices=list(INTERPOLATIONS), help='Resize interpolation')
+    parser.add_argument('--grayscale', action='store_true', help='Convert frames to single-channel grayscale right after decoding and write L mode PNGs')
+    parser.add_argument('--decoder', type=str, default='opencv', choices=VideoDecoder.BACKENDS, help='Decoder backend: OpenCV, or the ffmpeg binary of imageio-ffmpeg, which decodes with several threads, straight to grayscale and scaled to --frame-size (all_frames only)')
+    parser.add_argument('--decoder-threads', type=int, default=0, help='Number of decoder threads of the ffmpeg backend (0 for the ffmpeg default)')
+    parser.add_argument('--encoder', type=str, default=None, choices=ImageEncoder.BACKENDS, help="Image encoder backend. If not set, PIL's default PNG settings are used")
+    parser.add_argument('--compression', type=int, default=None, help='PNG compression level for --encoder, from 0 (fastest) to 9 (smallest)')
+    parser.add_argument('--webp', action='store_true', help='Write lossless WebP instead of PNG (with --encoder opencv or pil)')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Read frames from the decoded frame cache in this directory (e.g. data/cache/frames/)')
+    parser.add_argument('--output-format', type=str, default='dir', choices=['dir', 'zip'], help='Write loose PNGs to a directory, or a StyleGAN-ready dataset ZIP')
+    parser.add_argument('--label-column', type=str, default=None, help='Label column (e.g. pas_score) stored as the image class in the ZIP dataset.json')
+    parser.add_argument('--incremental', '--resume', action='store_true', help='Reuse the latest dataset directory of this type and size, and only process new or changed videos')
+    parser.add_argument('--catalog', action='store_true', help='Record every written frame, with its labels, in a SQLite catalog next to the dataset')
+    parser.add_argument('--stats', action='store_true', help='Accumulate per-pixel mean/std, intensity histograms and per-frame brightness of the written images, and save them next to the dataset')
+    parser.add_argument('--no-probe', action='store_true', help='Do not probe the videos directory (frame counts, fps, resolution...) to validate the labels and schedule the longest videos first')
+    parser.add_argument('--no-verify-frames', action='store_true', help='Trust the frame count of the AVI index instead of counting the frames by decoding when probing')
+    parser.add_argument('--profile', action='store_true', help='Time the decode, resize, color, encode and write stages, and write a Chrome trace report next to the dataset')
     parser.add_argument('--dry-run', action='store_true', help='If set, only create the dataset directory without processing videos')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    args.frame_size = tuple(args.frame_size)
 
     # Validating the arguments
-    if args.dataset_type not in ['max_constriction', 'all_frames']:
-        parser.error("Invalid dataset type. Choose 'max_constriction' or 'all_frames'.")
+    if args.dataset_type not in ['max_constriction', 'all_frames', 'clips']:
+        parser.error("Invalid dataset type. Choose 'max_constriction', 'all_frames' or 'clips'.")
+
+    if args.dataset_type == 'clips' and (args.output_format != 'dir' or args.incremental or args.catalog):
+        parser.error("The clips dataset type only supports --output-format dir, without --incremental nor --catalog.")
 
     if not os.path.isdir(args.output_dir):
         os.makedirs(args.output_dir)
@@ -65,39 +127,191 @@ def parse_args():
 
     if not os.path.isfile(args.labels):
         parser.error(f"Labels file {args.labels} does not exist.")
+
+    if args.incremental and args.output_format != 'dir':
+        parser.error("--incremental only supports --output-format dir.")
+
+    if (args.compression is not None or args.webp) and args.encoder is None:
+        parser.error("--compression and --webp require --encoder.")
+
+    if args.stats and (args.incremental or args.dataset_type == 'clips'):
+        parser.error("--stats is not supported with --incremental nor with the clips dataset type.")
+
+    if args.crop is not None and args.auto_crop:
+        parser.error("--crop and --auto-crop are mutually exclusive.")
+
+    if args.encoder == 'pyspng' and args.webp:
+        parser.error("The pyspng encoder only writes PNG.")
         
     args.dataset_dir = create_dataset_dir(args)
 
     return args
 
-if __name__ == "__main__":
+def main(argv=None, prog=None):
     # Parse command line arguments
-    args = parse_args()
+    args = parse_args(argv, prog)
 
     if args.dry_run:
         logging.info("Dry run mode. Only creating the dataset directory.")
-        exit(0)
+        return
+
+    profiler = None
+    if args.profile:
+        profiler = enable_profiling()
+
+    sink = None
+    if args.output_format == 'zip':
+        sink = ZipSink(f"{args.dataset_dir}.zip")
+
+    encoder = None
+    if args.encoder is not None:
+        encoder = ImageEncoder(args.encoder, 'webp' if args.webp else 'png', args.compression)
+
+    stats = DatasetStats() if args.stats else None
+
+    probe = None
+    if not args.no_probe and args.dataset_type != 'clips':
+        # Only new or changed videos are probed, the rest comes from videos.probe.json
+        probe = VideoProbe(args.video_dir, workers=args.workers, verify=not args.no_verify_frames)
+
+    decoder = None
+    if args.decoder != 'opencv':
+        decoder = VideoDecoder(args.decoder, args.decoder_threads)
+
+    geometry = FrameGeometry(args.crop, args.auto_crop, args.resize_mode, args.interpolation)
+
+    manifest = None
+    if args.incremental:
+        # Outputs built with other settings are rebuilt
+        settings = {
+            'dataset_type': args.dataset_type,
+            'frame_size': list(args.frame_size),
+            'extra_frames': args.extra_frames,
+            'label_column': args.label_column,
+            'stride': args.stride,
+            'dedup_threshold': args.dedup_threshold,
+            'focus_window': args.focus_window,
+            'focus_stride': args.focus_stride,
+            'grayscale': args.grayscale,
+            'encoder': [args.encoder, args.webp, args.compression],
+        }
+        if args.decoder != 'opencv':
+            # The ffmpeg scaler does not give the same pixels as cv.resize
+            settings['decoder'] = args.decoder
+        if geometry.settings() != FrameGeometry().settings():
+            # Only recorded when set, so datasets built before it existed stay up to date
+            settings['geometry'] = geometry.settings()
+        manifest = BuildManifest(args.dataset_dir, settings)
+
+    df_frames_pas = None
+    if args.catalog or args.dataset_type in ('max_constriction', 'clips') or args.label_column is not None or args.focus_window > 0:
+        # Read the rotulos DataFrame. pandas and openpyxl are only loaded when labels are needed
+        from src.video_labels import read_video_labels_df
+        df_frames_pas = read_video_labels_df(args.labels)
+        logging.info("Labels dataframe loaded successfully.")
+
+    catalog = None
+    if args.catalog:
+        from src.frame_catalog import FrameCatalog, get_catalog_path
+        catalog_path = get_catalog_path(f"{args.dataset_dir}.zip" if args.output_format == 'zip' else args.dataset_dir)
+        catalog = FrameCatalog(catalog_path, df_frames_pas)
 
     # Create a dataset of images from the maximum constriction frames of videos
     if args.dataset_type == 'all_frames':
+        labels = None
+        focus_frames = None
+        if args.label_column is not None:
+            # From the columns, as iterrows would upcast video_id to float along with the other columns
+            df_labeled = df_frames_pas.dropna(subset=[args.label_column])
+            labels = dict(zip(df_labeled['video_id'].astype(str), df_labeled[args.label_column].astype(int).tolist()))
+        if args.focus_window > 0:
+            focus_frames = df_frames_pas.groupby(df_frames_pas['video_id'].astype(str))['frame_max_constricao'].apply(list).to_dict()
+
+        sampler = None
+        if args.stride > 1 or args.dedup_threshold is not None or args.focus_window > 0:
+            sampler = FrameSampler(
+                stride = args.stride,
+                dedup_threshold = args.dedup_threshold,
+                focus_window = args.focus_window,
+                focus_stride = args.focus_stride
+            )
+
         create_all_frames_dataset(
             videos_dir = args.video_dir,
             dataset_dir = args.dataset_dir,
-            frame_size = args.frame_size
+            frame_size = args.frame_size,
+            executor_type = args.executor,
+            workers = args.workers,
+            chunk_size = args.chunk_size,
+            sink = sink,
+            labels = labels,
+            sampler = sampler,
+            focus_frames = focus_frames,
+            cache_dir = args.cache_dir,
+            manifest = manifest,
+            grayscale = args.grayscale,
+            encoder = encoder,
+            catalog = catalog,
+            pipeline_workers = args.pipeline_workers,
+            queue_depth = args.queue_depth,
+            geometry = geometry,
+            stats = stats,
+            probe = probe,
+            decoder = decoder
         )
         logging.info("All frames dataset created successfully.")
+    elif args.dataset_type == 'clips':
+        # Create a dataset of clips around the labeled events of videos
+        create_clips_dataset(
+            df_labels = df_frames_pas,
+            video_dir = args.video_dir,
+            dataset_dir = args.dataset_dir,
+            frame_size = args.frame_size,
+            radius = args.clip_radius,
+            event_columns = args.clip_events,
+            label_column = args.label_column,
+            cache_dir = args.cache_dir,
+            grayscale = args.grayscale,
+            geometry = geometry,
+            workers = args.workers,
+            clips_per_chunk = args.clips_per_chunk,
+            compress = not args.no_clip_compression
+        )
+        logging.info("Clips dataset created successfully.")
     else:
-        # Read the rotulos DataFrame
-        df_frames_pas = read_video_labels_df(args.labels)
-        logging.info("Labels dataframe loaded successfully.")
-
         # Create a dataset of images from the maximum constriction frames of videos
         create_max_constriction_dataset(
             df_labels = df_frames_pas,
             video_dir = args.video_dir,
             dataset_dir = args.dataset_dir,
-            frame_size = args.frame_size
+            frame_size = args.frame_size,
+            extra_frame_columns = args.extra_frames,
+            sink = sink,
+            label_column = args.label_column,
+            cache_dir = args.cache_dir,
+            manifest = manifest,
+            grayscale = args.grayscale,
+            encoder = encoder,
+            catalog = catalog,
+            geometry = geometry,
+            stats = stats,
+            probe = probe
         )
-    logging.info("Max constriction dataset created successfully.")
-    
-    
\ No newline at end of file
+        logging.info("Max constriction dataset created successfully.")
+
+    if sink is not None:
+        sink.close()
+
+    if catalog is not None:
+        logging.info(f"Frame catalog written to {catalog.path}")
+        catalog.close()
+
+    if stats is not None:
+        stats.save(f"{args.dataset_dir}.stats.npz")
+
+    if profiler is not None:
+        profiler.log_breakdown()
+        profiler.save(f"{args.dataset_dir}.profile.json", metadata=vars(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import logging
+import os
+from src.training_video import create_training_video
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create a video and/or a GIF of the fakes*.png snapshots of training runs.")
+
+    parser.add_argument('--run-dirs', type=str, nargs='+', required=True, help='Training run directories, oldest first. Resumed runs are chained by their resume_pkl')
+    parser.add_argument('--output', type=str, default=None, help='Path of the MP4 video')
+    parser.add_argument('--gif', type=str, default=None, help='Path of the GIF')
+    parser.add_argument('--fps', type=int, default=3, help='Frames per second')
+    parser.add_argument('--scale', type=float, default=0.2, help='Output scale, relative to the snapshot grid, or to the tile with --tile')
+    parser.add_argument('--tile', type=int, nargs=2, default=None, metavar=('ROW', 'COL'), help='Follow a single tile of the grid instead of the whole grid')
+    parser.add_argument('--tile-size', type=int, default=None, help='Size of the grid tiles (defaults to the resolution in training_options.json)')
+    parser.add_argument('--grayscale', action='store_true', help='Read and write single-channel frames')
+    parser.add_argument('--gif-color', action='store_true', help='Write a color GIF with a fixed palette instead of a grayscale one')
+    parser.add_argument('--workers', type=int, default=4, help='Number of threads decoding snapshots')
+
+    args = parser.parse_args()
+
+    if args.output is None and args.gif is None:
+        parser.error("Pass --output and/or --gif.")
+
+    for run_dir in args.run_dirs:
+        if not os.path.isdir(run_dir):
+            parser.error(f"Run directory {run_dir} does not exist.")
+
+    for path in (args.output, args.gif):
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    create_training_video(
+        run_dirs = args.run_dirs,
+        video_path = args.output,
+        gif_path = args.gif,
+        fps = args.fps,
+        scale = args.scale,
+        tile = tuple(args.tile) if args.tile is not None else None,
+        tile_size = args.tile_size,
+        grayscale = args.grayscale,
+        workers = args.workers,
+        gif_color = args.gif_color
+    )
@@ -1,8 +1,17 @@
 from src.utils import get_video_path_from_id
-from src.video_tool import convert_avi_to_mp4
+from src.video_decoder import VideoDecoder
+from src.frame_cache import open_cached_capture
+from src.frame_buffer import PrefetchingFrameBuffer, PooledFrameBuffer
+from src.frame_geometry import FrameGeometry
+from src.video_index import get_video_index, seek_to_frame
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import math
+import os
+import time
 import argparse
 import cv2 as cv
+import numpy as np
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -97,7 +106,43 @@ def write_pause_info(frame, paused):
     y_pos = frame.shape[0] - 10
     return write_text(frame, text, (x_pos, y_pos))
 
-def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None, paused=False, show_info=True, autoclose=True):
+def write_cache_info(frame, hits, misses):
+    """
+    Overlays the frame cache hit and miss counts below the frame number.
+    
+    Parameters:
+        frame (ndarray): The current video frame.
+        hits (int): Number of frames served from the frame cache.
+        misses (int): Number of frames the player had to wait for.
+    
+    Returns:
+        The frame with the cache info overlay.
+    """
+    text = f"Cache: {hits} hits / {misses} misses"
+    x_pos = 10
+    y_pos = 110
+    return write_text(frame, text, (x_pos, y_pos))
+
+def write_export_info(frame, export_job):
+    """
+    Overlays the progress of the MP4 export below the cache info.
+    
+    Parameters:
+        frame (ndarray): The current video frame.
+        export_job (TranscodeJob): The running or finished export.
+    
+    Returns:
+        The frame with the export info overlay.
+    """
+    if export_job.done:
+        text = f"Export: {export_job.status}"
+    else:
+        text = f"Export: {export_job.progress:.0%}"
+    x_pos = 10
+    y_pos = 150
+    return write_text(frame, text, (x_pos, y_pos))
+
+def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None, paused=False, show_info=True, autoclose=True, cache_dir=None, decoder=None, max_frames=None):
     """
     Play a video from a specified start frame to an end frame.
     The video can be paused and navigated frame by frame using the arrow keys.
@@ -107,6 +152,7 @@ def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None
     Press 'left arrow' to go to the previous frame.
     Press 'i' to toggle the time and frame number displays.
     Press 'a' to toggle the autoclose behavior when the video finishes.
+    Press 'e' to export the video to MP4 in the background, next to it.
 
     Parameters:
         video_id (str): The ID of the video to play.
@@ -116,19 +162,35 @@ def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None
         paused (bool): Whether to start the video in a paused state.
         show_info (bool): Whether to overlay time and frame info on the video.
         autoclose (bool): Whether to automatically close the video window when finished.
+        cache_dir (str): If given, frames are read from the decoded frame cache in this directory.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`, e.g. the threaded ffmpeg one.
+        max_frames (int): If given, the player closes after showing this many frames (e.g. to time the first one).
 
     Returns:
         None
     """
-    video_path = get_video_path_from_id(video_id, video_dir)
-    cap = cv.VideoCapture(video_path)
+    try:
+        video_path = get_video_path_from_id(video_id, video_dir)
+    except FileNotFoundError as e:
+        logging.error(f"Error: {e}")
+        return
+
+    if cache_dir is not None:
+        cap = open_cached_capture(video_id, video_dir, cache_dir)
+    elif decoder is not None:
+        cap = decoder.open(video_path)
+    else:
+        cap = cv.VideoCapture(video_path)
 
-    if not cap.isOpened():
+    if cap is None or not cap.isOpened():
         logging.error("Error: Could not open video.")
         exit()
 
     fps = cap.get(cv.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+
+    # The seek index has the exact frame count and keyframes of the video
+    index = get_video_index(video_path) if cache_dir is None else None
+    total_frames = index['frame_count'] if index is not None else int(cap.get(cv.CAP_PROP_FRAME_COUNT))
 
     if end_frame is None or end_frame > total_frames:
         end_frame = total_frames
@@ -137,16 +199,35 @@ def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None
         logging.error("Error: start_frame must be less than end_frame.")
         exit()
 
+    # ffmpeg seeks exactly by itself
+    seek_index = decoder.seek_index(video_path) if decoder is not None and index is not None else index
+
     frame_idx = start_frame
-    cap.set(cv.CAP_PROP_POS_FRAMES, frame_idx)
+    seek_to_frame(cap, frame_idx, seek_index)
+
+    # Frames are decoded on a background thread while the current one is displayed
+    frame_buffer = PrefetchingFrameBuffer(cap, index=seek_index, start_frame=frame_idx)
+    raw_frame = None
+    shown_idx = None
 
     total_time = total_frames / fps
     total_minutes = int(total_time // 60)
     total_seconds = int(total_time % 60)
 
+    export_job = None
+    shown_frames = 0
+
+    frame_period = 1 / fps
+    next_deadline = time.perf_counter() + frame_period
+
     while True:
-        delay = int(1000 / fps) if not paused else 30
+        if paused:
+            delay = 30
+        else:
+            # Wait only for what is left of the frame period, so the video plays at its fps
+            delay = max(1, int((next_deadline - time.perf_counter()) * 1000))
         key = cv.waitKey(delay)
+        next_deadline = max(next_deadline + frame_period, time.perf_counter())
 
         if key == ord('q'):
             break
@@ -158,8 +239,12 @@ def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None
             autoclose = not autoclose
             print("Autoclose toggled", "ON" if autoclose else "OFF")
         elif key == ord('e'):
-            output_path = video_path.replace('.avi', '.mp4')
-            convert_avi_to_mp4(video_path, output_path)
+            # The export runs in an ffmpeg process, playback goes on
+            if export_job is None or export_job.done:
+                # Imported on demand, it is not needed to start playing
+                from src.transcode import TranscodeJob
+                export_job = TranscodeJob(video_path)
+                logging.info(f"Exporting {video_path} to {export_job.output_path}...")
         elif paused and (key == 3 or key == 2555904):  # Right Arrow
             if frame_idx < total_frames - 1:
                 frame_idx += 1
@@ -178,35 +263,292 @@ def play_video(video_id, video_dir='data/videos/', start_frame=0, end_frame=None
                 else: # Otherwise, remain on the last available frame.
                     paused = True
 
-        cap.set(cv.CAP_PROP_POS_FRAMES, frame_idx)
-        ret, frame = cap.read()
-        if not ret:
-            break
+        if frame_idx != shown_idx:
+            raw_frame = frame_buffer.get(frame_idx)
+            if raw_frame is None:
+                break
+            shown_idx = frame_idx
+
+        frame = raw_frame
         if show_info:
+            # Buffered frames are reused, draw on a copy
+            frame = raw_frame.copy()
             frame = write_frame_number(frame, frame_idx, total_frames-1)
             frame = write_time_info(frame, frame_idx, fps, total_minutes, total_seconds)
             frame = write_autoclose_info(frame, autoclose)
             frame = write_pause_info(frame, paused)
+            frame = write_cache_info(frame, frame_buffer.hits, frame_buffer.misses)
+            if export_job is not None:
+                frame = write_export_info(frame, export_job)
 
         cv.imshow("Video", frame)
+        shown_frames += 1
+        if max_frames is not None and shown_frames >= max_frames:
+            break
 
+    frame_buffer.close()
     cap.release()
     cv.destroyAllWindows()
 
-def parse_args():
-    parser = argparse.ArgumentParser(description="Play a video with frame navigation.")
-    parser.add_argument('-s', '--video_id', type=str, required=True, help='ID of the video to play')
+    if export_job is not None and not export_job.done:
+        logging.info("Waiting for the export to finish...")
+        export_job.wait()
+
+def get_tile_size(video_size, cell_size):
+    """
+    Get the size of a video letterboxed into a grid cell, keeping its aspect ratio.
+
+    Parameters:
+        video_size (tuple): The (width, height) of the video.
+        cell_size (tuple): The (width, height) of the cell.
+
+    Returns:
+        tuple: The (width, height) of the scaled video inside the cell.
+    """
+    scale = min(cell_size[0] / video_size[0], cell_size[1] / video_size[1])
+    return max(1, round(video_size[0] * scale)), max(1, round(video_size[1] * scale))
+
+def get_grid_source_path(source, video_dir):
+    """
+    Get the path of a source of the grid player: a video ID of `video_dir`, or a path to any video file (e.g. a generated MP4).
+    Returns None if the video does not exist.
+    """
+    if os.path.isfile(source):
+        return source
+    try:
+        return get_video_path_from_id(source, video_dir)
+    except FileNotFoundError as e:
+        logging.error(f"Error: {e}")
+        return None
+
+def open_grid_capture(video_path, decoder, cell_size):
+    """
+    Open a source of the grid player, scaled to its cell at decode time when the decoder can.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        decoder (VideoDecoder): The decoder, or None for `cv.VideoCapture`.
+        cell_size (tuple): The (width, height) of a grid cell.
+
+    Returns:
+        cv.VideoCapture | FFmpegCapture: The capture. Check `isOpened()`.
+    """
+    if decoder is None:
+        return cv.VideoCapture(video_path)
+    cap = decoder.open(video_path)
+    if cap.isOpened() and decoder.backend == 'ffmpeg':
+        # Let ffmpeg scale to the tile, so only small frames are piped and letterboxed
+        video_size = (int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)))
+        tile_size = get_tile_size(video_size, cell_size)
+        if tile_size != video_size:
+            cap.release()
+            cap = decoder.open(video_path, frame_size=tile_size, interpolation='area')
+    return cap
+
+def play_grid(sources, video_dir='data/videos/', start_frame=0, paused=False, show_info=True, autoclose=True, decoder=None, columns=None, grid_width=1600, workers=None):
+    """
+    Play several videos side by side in one window, on a shared clock.
+    The keys are the ones of `play_video`, except 'e' (export), and apply to all the tiles.
+
+    All the tiles follow one clock, in seconds, so the time and frame overlays
+    (drawn once, for the clock) line up for every tile, even when the videos
+    have different frame rates; a tile that is over holds its last frame. The
+    tiles are decoded by a shared thread pool (see `PooledFrameBuffer`) and
+    downscaled to their cell on the pool threads, or by ffmpeg itself with the
+    ffmpeg decoder. While playing, a tile whose frame is not decoded in time
+    keeps its previous frame instead of holding back the whole grid; when
+    paused or stepping, every tile is waited for.
+
+    Parameters:
+        sources (list): The video IDs, or paths to video files, to play.
+        video_dir (str): The directory where the videos are stored.
+        start_frame (int): Frame number, of the fastest video, to start playing from.
+        paused (bool): Whether to start in a paused state.
+        show_info (bool): Whether to overlay time, frame and tile info.
+        autoclose (bool): Whether to automatically close the window when the longest video finishes.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`.
+        columns (int): Number of columns of the grid. Defaults to a square grid.
+        grid_width (int): Width of the window, in pixels.
+        workers (int): Number of decoder threads shared by the tiles. Defaults to the number of CPUs.
+
+    Returns:
+        None
+    """
+    columns = columns or math.ceil(math.sqrt(len(sources)))
+    rows = math.ceil(len(sources) / columns)
+
+    video_paths = [path for path in (get_grid_source_path(str(source), video_dir) for source in sources) if path is not None]
+    if not video_paths:
+        logging.error("Error: None of the videos could be found.")
+        return
+
+    # Cells have the aspect ratio of the first video, the others are letterboxed
+    probe = cv.VideoCapture(video_paths[0])
+    aspect = probe.get(cv.CAP_PROP_FRAME_HEIGHT) / probe.get(cv.CAP_PROP_FRAME_WIDTH) if probe.isOpened() else 0.75
+    probe.release()
+    cell_size = (grid_width // columns, max(1, round(grid_width // columns * aspect)))
+    geometry = FrameGeometry(resize_mode='letterbox', interpolation='area')
+
+    def to_tile(frame):
+        if frame.ndim == 2:
+            frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+        return geometry.resize(frame, cell_size)
+
+    tiles = []
+    for video_path in video_paths:
+        cap = open_grid_capture(video_path, decoder, cell_size)
+        if not cap.isOpened():
+            logging.error(f"Error: Could not open video {video_path}.")
+            continue
+        # The seek index has the exact frame count and keyframes of the video
+        index = get_video_index(video_path)
+        total_frames = index['frame_count'] if index is not None else int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        tiles.append({
+            'name': os.path.splitext(os.path.basename(video_path))[0], 'cap': cap,
+            'seek_index': decoder.seek_index(video_path) if decoder is not None else index,
+            'fps': cap.get(cv.CAP_PROP_FPS) or 30.0, 'total_frames': max(total_frames, 1),
+            'frame_idx': None, 'frame': None,
+        })
+    if not tiles:
+        logging.error("Error: None of the videos could be opened.")
+        return
+
+    # The clock counts frames of the fastest video
+    fps = max(tile['fps'] for tile in tiles)
+    total_frames = max(math.ceil(tile['total_frames'] / tile['fps'] * fps) for tile in tiles)
+    frame_idx = min(start_frame, total_frames - 1)
+
+    def tile_frame(tile, clock_idx):
+        return min(int(clock_idx * tile['fps'] / fps), tile['total_frames'] - 1)
+
+    # One pool decodes all the tiles
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for tile in tiles:
+        seek_to_frame(tile['cap'], tile_frame(tile, frame_idx), tile['seek_index'])
+        tile['buffer'] = PooledFrameBuffer(
+            tile['cap'], executor, index=tile['seek_index'], start_frame=tile_frame(tile, frame_idx), transform=to_tile
+        )
+
+    total_time = total_frames / fps
+    total_minutes = int(total_time // 60)
+    total_seconds = int(total_time % 60)
+
+    canvas = np.zeros((rows * cell_size[1], columns * cell_size[0], 3), dtype=np.uint8)
+    late_frames = 0
+    stepped = True
+
+    frame_period = 1 / fps
+    next_deadline = time.perf_counter() + frame_period
+
+    while True:
+        if paused:
+            delay = 30
+        else:
+            # Wait only for what is left of the frame period, so the grid plays at the fps of the clock
+            delay = max(1, int((next_deadline - time.perf_counter()) * 1000))
+        key = cv.waitKey(delay)
+        next_deadline = max(next_deadline + frame_period, time.perf_counter())
+
+        if key == ord('q'):
+            break
+        elif key == ord(' '):
+            paused = not paused
+        elif key == ord('i'):
+            show_info = not show_info
+        elif key == ord('a'):
+            autoclose = not autoclose
+            print("Autoclose toggled", "ON" if autoclose else "OFF")
+        elif paused and (key == 3 or key == 2555904):  # Right Arrow
+            if frame_idx < total_frames - 1:
+                frame_idx += 1
+                stepped = True
+        elif paused and (key == 2 or key == 2424832):  # Left Arrow
+            if frame_idx > 0:
+                frame_idx -= 1
+                stepped = True
+
+        if not paused:
+            if frame_idx < total_frames - 1:
+                frame_idx += 1
+            elif autoclose:
+                break
+            else:
+                paused = True
+
+        for tile in tiles:
+            tile_idx = tile_frame(tile, frame_idx)
+            if tile_idx == tile['frame_idx']:
+                continue
+            # Never wait while playing, a late tile keeps its previous frame
+            frame = tile['buffer'].get(tile_idx, timeout=0.5 if paused or stepped or tile['frame'] is None else 0)
+            if frame is None:
+                late_frames += 1
+                continue
+            tile['frame'] = frame
+            tile['frame_idx'] = tile_idx
+        stepped = False
+
+        canvas[:] = 0
+        for i, tile in enumerate(tiles):
+            if tile['frame'] is None:
+                continue
+            x = (i % columns) * cell_size[0]
+            y = (i // columns) * cell_size[1]
+            canvas[y:y + cell_size[1], x:x + cell_size[0]] = tile['frame']
+            if show_info:
+                # Top right of the tile, clear of the shared overlays
+                label = f"{tile['name']}: {tile['frame_idx']}"
+                (text_width, _), _ = cv.getTextSize(label, cv.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+                write_text(canvas, label, (x + cell_size[0] - text_width - 10, y + 20), font_scale=0.5, thickness=1)
+
+        if show_info:
+            write_frame_number(canvas, frame_idx, total_frames-1)
+            write_time_info(canvas, frame_idx, fps, total_minutes, total_seconds)
+            write_autoclose_info(canvas, autoclose)
+            write_pause_info(canvas, paused)
+            write_cache_info(canvas, sum(tile['buffer'].hits for tile in tiles), late_frames)
+
+        cv.imshow("Grid", canvas)
+
+    for tile in tiles:
+        tile['buffer'].close()
+    executor.shutdown()
+    for tile in tiles:
+        tile['cap'].release()
+    cv.destroyAllWindows()
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Play a video with frame navigation.")
+    parser.add_argument('videos', type=str, nargs='*', help='IDs of the videos to play, like --video_id')
+    parser.add_argument('-s', '--video_id', type=str, nargs='+', default=[], help='ID of the video to play. With several IDs, or paths to video files, they are played side by side in a grid')
     parser.add_argument('--video_dir', type=str, default='data/videos/', help='Path to the video directory')
     parser.add_argument('-st','--start_frame', type=int, default=0, help='Frame number to start playing the video from')
-    parser.add_argument('-e','--end_frame', type=int, default=None, help='Frame number to stop playing the video at')
+    parser.add_argument('-e','--end_frame', type=int, default=None, help='Frame number to stop playing the video at (single video only)')
     parser.add_argument('--paused', action='store_true', default=False, help='Start the video in paused state')
     parser.add_argument('--show_info', action='store_true', default=True, help='Show time and frame number info')
     parser.add_argument('--no_autoclose', action='store_true', help='Disable auto-closing the video window when finished playing')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Read frames from the decoded frame cache in this directory (single video only)')
+    parser.add_argument('--decoder', type=str, default='opencv', choices=VideoDecoder.BACKENDS, help='Decoder backend: OpenCV, or the multi-threaded ffmpeg binary of imageio-ffmpeg')
+    parser.add_argument('--decoder_threads', type=int, default=0, help='Number of decoder threads of the ffmpeg backend (0 for the ffmpeg default)')
+    parser.add_argument('--max_frames', type=int, default=None, help='Close the player after showing this many frames (single video only)')
+    parser.add_argument('--columns', type=int, default=None, help='Number of columns of the grid (default: a square grid)')
+    parser.add_argument('--grid_width', type=int, default=1600, help='Width of the grid window, in pixels')
+    parser.add_argument('--workers', type=int, default=None, help='Number of decoder threads shared by the tiles of the grid (default: number of CPUs)')
     
-    return parser.parse_args()
-    
-if __name__ == "__main__":
-    args = parse_args()
+    args = parser.parse_args(argv)
+    args.video_id = args.videos + args.video_id
+    if not args.video_id:
+        parser.error("No video to play, give at least one video ID.")
+    if len(args.video_id) > 1:
+        # Options of play_video that play_grid does not have
+        single_video_options = {'--end_frame': args.end_frame, '--cache_dir': args.cache_dir, '--max_frames': args.max_frames}
+        given = [option for option, value in single_video_options.items() if value is not None]
+        if given:
+            parser.error(f"{', '.join(given)} can only be used with a single video.")
+    return args
+
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
     
     # Determine autoclose from the command line flag
     autoclose = not args.no_autoclose
@@ -218,15 +560,38 @@ if __name__ == "__main__":
     print("Press 'left arrow' to go to the previous frame.")
     print("Press 'i' to toggle the time and frame number displays.")
     print("Press 'a' to toggle the autoclose behavior.")
+    if len(args.video_id) == 1:
+        print("Press 'e' to export the video to MP4 in the background.")
     logging.info("Starting video playback...")
 
-    play_video(
-        video_id=args.video_id,
-        video_dir=args.video_dir,
-        start_frame=args.start_frame,
-        end_frame=args.end_frame,
-        paused=args.paused,
-        show_info=args.show_info,
-        autoclose=autoclose
-    )
-    logging.info("Video played successfully.")
\ No newline at end of file
+    decoder = VideoDecoder(args.decoder, args.decoder_threads) if args.decoder != 'opencv' else None
+    if len(args.video_id) > 1:
+        play_grid(
+            sources=args.video_id,
+            video_dir=args.video_dir,
+            start_frame=args.start_frame,
+            paused=args.paused,
+            show_info=args.show_info,
+            autoclose=autoclose,
+            decoder=decoder,
+            columns=args.columns,
+            grid_width=args.grid_width,
+            workers=args.workers
+        )
+    else:
+        play_video(
+            video_id=args.video_id[0],
+            video_dir=args.video_dir,
+            start_frame=args.start_frame,
+            end_frame=args.end_frame,
+            paused=args.paused,
+            show_info=args.show_info,
+            autoclose=autoclose,
+            cache_dir=args.cache_dir,
+            decoder=decoder,
+            max_frames=args.max_frames
+        )
+    logging.info("Video played successfully.")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
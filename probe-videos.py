@@ -0,0 +1,65 @@
+import argparse
+import logging
+import os
+from src.video_probe import VideoProbe, log_label_problems
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Probe the videos of a directory (frame count, fps, resolution, codec) and check the labels against them.")
+
+    parser.add_argument('--video-dir', type=str, default='data/videos/', help='Path to the video directory')
+    parser.add_argument('--labels', type=str, default=None, help='Labels file whose videos and labeled frames are checked against the probe')
+    parser.add_argument('--workers', type=int, default=None, help='Number of threads probing videos')
+    parser.add_argument('--no-verify-frames', action='store_true', help='Trust the frame count of the AVI index instead of counting the frames by decoding')
+    parser.add_argument('--extension', type=str, default='.avi', help='Extension of the videos')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.video_dir):
+        parser.error(f"Video directory {args.video_dir} does not exist.")
+    if args.labels is not None and not os.path.isfile(args.labels):
+        parser.error(f"Labels file {args.labels} does not exist.")
+
+    return args
+
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
+
+    # Only new or changed videos are probed, the rest comes from videos.probe.json
+    probe = VideoProbe(args.video_dir, workers=args.workers, verify=not args.no_verify_frames, extension=args.extension)
+
+    total_frames = 0
+    total_seconds = 0.0
+    unreadable = 0
+    for video_id in sorted(probe.videos):
+        entry = probe.videos[video_id]
+        if entry['error'] is not None:
+            unreadable += 1
+            logging.error(f"{video_id}: {entry['error']}")
+            continue
+        total_frames += entry['frame_count']
+        total_seconds += entry['frame_count'] / entry['fps'] if entry['fps'] else 0.0
+        logging.info(
+            f"{video_id}: {entry['frame_count']} frames, {entry['fps']:.2f} fps, "
+            f"{entry['width']}x{entry['height']}, {entry['codec']}"
+        )
+    logging.info(
+        f"{len(probe.videos)} videos, {unreadable} unreadable, {total_frames} frames "
+        f"({int(total_seconds // 60)}m {int(total_seconds % 60):02d}s)"
+    )
+
+    problems = []
+    if args.labels is not None:
+        # pandas and openpyxl are only loaded when the labels are checked
+        from src.video_labels import read_video_labels_df
+        problems = probe.validate_labels(read_video_labels_df(args.labels))
+        log_label_problems(problems)
+        logging.info(f"{len(problems)} label problems.")
+
+    if unreadable or problems:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+from src.benchmark import BENCHMARKS, BENCHMARK_PRESETS, DEFAULT_REGRESSION_THRESHOLD, run_benchmarks, save_results, load_results, compare_results, log_comparison
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark frame extraction on synthetic VFSS-like videos.")
+
+    parser.add_argument('--preset', type=str, default='quick', choices=list(BENCHMARK_PRESETS), help='Set of synthetic videos to generate')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts used for the all_frames dataset builder')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs of each case, the median is reported')
+    parser.add_argument('--only', type=str, nargs='+', default=None, choices=list(BENCHMARKS) + ['decoder_parity', 'startup'], help='Only run these benchmarks')
+    parser.add_argument('--work-dir', type=str, default=None, help='Scratch directory for the synthetic videos and outputs (defaults to a temporary directory)')
+    parser.add_argument('--output', type=str, default=None, help='Path of the results JSON (defaults to data/benchmarks/<timestamp>.json)')
+    parser.add_argument('--compare', type=str, default=None, help='Results JSON of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD, help='Relative drop in frames/s flagged as a regression')
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = os.path.join('data/benchmarks/', f"{time.strftime('%Y%m%d-%H%M%S')}-{args.preset}.json")
+    if args.compare is not None and not os.path.isfile(args.compare):
+        parser.error(f"Results file {args.compare} does not exist.")
+
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = run_benchmarks(args.work_dir or tmp_dir, args.preset, tuple(args.workers), args.repeat, args.only)
+    save_results(results, args.output)
+
+    failed = any(not parity['match'] for parity in results['decoder_parity'])
+    failed = failed or any(not startup['within_budget'] for startup in results['startup'])
+
+    if args.compare is not None:
+        regressions = log_comparison(compare_results(load_results(args.compare), results, args.threshold))
+        failed = failed or bool(regressions)
+
+    if failed:
+        exit(1)
@@ -36,8 +36,10 @@ ssh "$REMOTE_HOST" << 'EOF' || error_exit "SSH or setup failed"
 EOF
 
 log_step "[2/7] Copy data to remote..."
+# $DATASET_ZIP is written by create-image-dataset-from-videos.py --output-format zip
+# and is already in the layout expected by stylegan3/train.py
 rsync -avz \
-    "$LOCAL_REPO_PATH/$REPO_DATA_PATH/$TAR_FILE" \
+    "$LOCAL_REPO_PATH/$REPO_DATA_PATH/$DATASET_ZIP" \
     "$REMOTE_HOST:$REMOTE_WORKDIR/data-synthesis-vfss/$REPO_DATA_PATH/" \
     --progress || error_exit "Failed to copy data"
 
@@ -46,19 +48,10 @@ rsync -avz \
     "$REMOTE_HOST:$REMOTE_WORKDIR/data-synthesis-vfss/data/" \
     --progress || error_exit "Failed to copy model"
 
-log_step "[3/7] Prepare data on remote..."
-ssh "$REMOTE_HOST" << EOF || error_exit "Data extraction or dataset tool failed"
+log_step "[3/7] Check data on remote..."
+ssh "$REMOTE_HOST" << EOF || error_exit "Dataset ZIP not found on remote"
     set -e
-    
-    mkdir -p $REMOTE_WORKDIR/data-synthesis-vfss/data/images/00000-all-frames-512
-
-    tar \
-        -xzf $REMOTE_WORKDIR/data-synthesis-vfss/data/images/$TAR_FILE  \
-        -C $REMOTE_WORKDIR/data-synthesis-vfss/data/images/00000-all-frames-512
-
-    python $REMOTE_WORKDIR/stylegan3/dataset_tool.py \
-        --source=$REMOTE_REPO_PATH/data/images/00000-all-frames-512 \
-        --dest=$REMOTE_REPO_PATH/data/images/00000-all-frames-512.zip
+    test -f $REMOTE_WORKDIR/data-synthesis-vfss/$REPO_DATA_PATH/$DATASET_ZIP
 EOF
 
 log_step "[4/7] Train model..."
@@ -79,7 +72,7 @@ ssh "$REMOTE_HOST" << EOF || error_exit "Training failed"
     tmux send-keys -t \$SESSION_NAME "
         cd $REMOTE_WORKDIR &&
         python stylegan3/train.py \\
-        --data=data-synthesis-vfss/data/images/00000-all-frames-512.zip \\
+        --data=data-synthesis-vfss/$REPO_DATA_PATH/$DATASET_ZIP \\
         --outdir=data-synthesis-vfss/$REPO_MODEL_PATH \\
         --resume=data-synthesis-vfss/data/$MODEL_FILE \\
         --cfg=stylegan2 \\
@@ -0,0 +1,74 @@
+import argparse
+import logging
+import os
+import numpy as np
+from src.dataset_stats import DatasetStats
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def get_histogram_percentiles(histogram, percentiles=(1, 50, 99)):
+    """
+    Get the intensities below which the given percentages of the pixels of a 256-bin histogram are.
+    """
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] == 0:
+        return [None for _ in percentiles]
+    return [int(np.searchsorted(cumulative, cumulative[-1] * p / 100)) for p in percentiles]
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Show the dataset statistics saved by create-image-dataset-from-videos.py --stats.")
+
+    parser.add_argument('path', type=str, help='Path to the statistics file (<dataset>.stats.npz)')
+    parser.add_argument('--video', type=str, default=None, help='Also show the mean brightness of every frame of this video')
+    parser.add_argument('--save-images', type=str, default=None, help='Save the per-pixel mean and std images as PNGs in this directory')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.path):
+        parser.error(f"Statistics file {args.path} does not exist.")
+
+    return args
+
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
+
+    stats = DatasetStats.load(args.path)
+    logging.info(f"{stats.count} frames of {len(stats.histograms)} videos")
+    if stats.mean is not None:
+        # Variance of all the pixels: mean of the per-pixel variances plus variance of the per-pixel means
+        overall_std = np.sqrt((stats.m2 / max(stats.count, 1)).mean() + stats.mean.var())
+        logging.info(f"Frame shape {stats.mean.shape} ({stats.channel_order}), mean intensity {stats.mean.mean():.2f}, std {overall_std:.2f}")
+    p1, p50, p99 = get_histogram_percentiles(stats.histogram)
+    logging.info(f"Intensity percentiles: 1% {p1}, 50% {p50}, 99% {p99}")
+
+    for video_id in sorted(stats.histograms):
+        frames, brightness = stats.brightness_series(video_id)
+        if len(frames):
+            logging.info(
+                f"{video_id}: {len(frames)} frames, brightness {brightness.min():.1f} to {brightness.max():.1f} "
+                f"(darkest at frame {frames[brightness.argmin()]})"
+            )
+
+    if args.video is not None:
+        frames, brightness = stats.brightness_series(args.video)
+        if not len(frames):
+            logging.error(f"No frames of video {args.video} in {args.path}.")
+        for frame_number, value in zip(frames, brightness):
+            print(f"{frame_number}\t{value:.2f}")
+
+    if args.save_images is not None and stats.mean is not None:
+        # OpenCV is only loaded to save the images
+        import cv2 as cv
+        os.makedirs(args.save_images, exist_ok=True)
+        mean, std = stats.mean, stats.std
+        if stats.channel_order == 'RGB':
+            # OpenCV writes BGR
+            mean, std = mean[..., ::-1], std[..., ::-1]
+        cv.imwrite(os.path.join(args.save_images, 'mean.png'), np.clip(np.rint(mean), 0, 255).astype(np.uint8))
+        # Stretched to the full range, the std is small next to 255
+        cv.imwrite(os.path.join(args.save_images, 'std.png'), np.clip(np.rint(std * 255 / max(std.max(), 1e-6)), 0, 255).astype(np.uint8))
+        logging.info(f"Mean and std images saved to {args.save_images}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,572 @@
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import cv2 as cv
+import numpy as np
+import pandas as pd
+
+# Synthetic videos generated for each preset: (width, height, frames, fourcc)
+BENCHMARK_PRESETS = {
+    'quick': [
+        (256, 256, 90, 'MJPG'),
+        (512, 512, 150, 'MJPG'),
+        (512, 512, 150, 'XVID'),
+    ],
+    'full': [
+        (512, 512, 300, 'MJPG'),
+        (512, 512, 300, 'XVID'),
+        (720, 720, 600, 'MJPG'),
+        (720, 720, 600, 'XVID'),
+        (1024, 1024, 300, 'MJPG'),
+        (1024, 1024, 300, 'FFV1'),
+    ],
+}
+
+# Relative drop in frames/s above which a case is flagged as a regression
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+# Largest per-pixel difference allowed between the frames of the OpenCV and ffmpeg decoders, per pixel format.
+# OpenCV's gray goes through BGR and rounds twice, so it is 1 or 2 levels darker than ffmpeg's luma
+DECODER_PARITY_TOLERANCE = {'bgr24': 1, 'gray': 2}
+
+# Seeks checked by the decoder parity check: random targets per video, and the starts of chunks of
+# this many frames (as with `--executor process --chunk-size`), each followed by a few sequential reads
+PARITY_RANDOM_SEEKS = 8
+PARITY_CHUNK_SIZE = 30
+PARITY_FRAMES_PER_SEEK = 3
+
+# Budget, in seconds, for every command of vfss.py to import its modules and parse its arguments
+STARTUP_BUDGETS = {
+    'play': 0.5,
+    'extract': 1.0,
+    'transcode': 0.3,
+    'probe': 0.5,
+    'stats': 0.3,
+}
+
+# Budget, in seconds, for `vfss play <id>` to show the first frame of a video
+FIRST_FRAME_BUDGET = 1.0
+
+
+def generate_synthetic_videos(video_dir, specs, fps=30, seed=0):
+    """
+    Write deterministic VFSS-like grayscale AVIs, named 1.avi, 2.avi, ...
+
+    Every frame is a dark vertical gradient with a bright band (the spine), a
+    bolus that moves down the frame and some noise, so the codecs see the kind
+    of mostly static grayscale content of a real study. The videos are stored
+    as 3-channel gray, like the studies.
+
+    Parameters:
+        video_dir (str): Directory where the videos are written.
+        specs (list): (width, height, frames, fourcc) tuples, one per video.
+        fps (int): Frames per second of the videos.
+        seed (int): Seed of the noise.
+
+    Returns:
+        list: Dicts with the video ID, path, size and codec of every video that could be written.
+    """
+    os.makedirs(video_dir, exist_ok=True)
+    videos = []
+    for video_id, (width, height, frame_count, fourcc) in enumerate(specs, start=1):
+        video_path = os.path.join(video_dir, f"{video_id}.avi")
+        writer = cv.VideoWriter(video_path, cv.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        if not writer.isOpened():
+            logging.warning(f"Codec {fourcc} is not available, skipping the {width}x{height} video.")
+            continue
+
+        rng = np.random.default_rng(seed + video_id)
+        background = np.linspace(40, 90, height, dtype=np.float32)[:, None].repeat(width, axis=1)
+        background[:, int(width * 0.55):int(width * 0.7)] += 60
+        yy, xx = np.mgrid[0:height, 0:width]
+        for i in range(frame_count):
+            frame = background.copy()
+            center_y = height * (0.1 + 0.8 * i / max(frame_count - 1, 1))
+            bolus = ((xx - width * 0.45) / (width * 0.08)) ** 2 + ((yy - center_y) / (height * 0.12)) ** 2 < 1
+            frame[bolus] = 220
+            frame += rng.normal(0, 4, size=frame.shape)
+            gray = np.clip(frame, 0, 255).astype(np.uint8)
+            writer.write(cv.cvtColor(gray, cv.COLOR_GRAY2BGR))
+        writer.release()
+
+        videos.append({'video_id': video_id, 'path': video_path, 'width': width, 'height': height, 'frames': frame_count, 'codec': fourcc})
+    return videos
+
+
+def write_synthetic_labels(videos, labels_path, seed=0):
+    """
+    Write a labels sheet for the synthetic videos, with the columns of `Frames e PAS.xlsx`.
+
+    Parameters:
+        videos (list): Dicts returned by `generate_synthetic_videos`.
+        labels_path (str): Path of the Excel file.
+        seed (int): Seed of the labeled frames and PAS scores.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for video in videos:
+        frame_count = video['frames']
+        rows.append({
+            'Video': video['video_id'],
+            'Frame de máxima constrição faríngea': int(rng.integers(frame_count // 4, frame_count * 3 // 4)),
+            'Frame de repouso': int(rng.integers(0, frame_count // 4)),
+            'PAS frame': int(rng.integers(frame_count // 2, frame_count)),
+            'PAS': int(rng.integers(1, 9)),
+        })
+    pd.DataFrame(rows).to_excel(labels_path, index=False)
+
+
+def run_benchmarks(work_dir, preset='quick', workers=(1, 2, 4), repeat=3, only=None):
+    """
+    Generate the synthetic videos and time the extraction hot paths on them.
+
+    Every case runs in a fresh process, so its peak RSS is not inflated by the
+    previous ones. The seek indexes are built before timing.
+
+    Parameters:
+        work_dir (str): Scratch directory for the videos and the outputs.
+        preset (str): Key of `BENCHMARK_PRESETS`.
+        workers (tuple): Worker counts used for the dataset builders.
+        repeat (int): Number of timed runs of each case. The median is reported.
+        only (list): If given, only the benchmarks with these names are run.
+
+    Returns:
+        dict: The results, see `save_results`.
+    """
+    from .video_index import build_video_dir_index
+
+    video_dir = os.path.join(work_dir, 'videos', '')
+    labels_path = os.path.join(work_dir, 'labels.xlsx')
+    if os.path.isdir(video_dir):
+        shutil.rmtree(video_dir)
+    videos = generate_synthetic_videos(video_dir, BENCHMARK_PRESETS[preset])
+    write_synthetic_labels(videos, labels_path)
+    build_video_dir_index(video_dir)
+
+    cases = []
+    for video in videos:
+        params = {'video_id': video['video_id']}
+        cases += [('get_video_frame', params), ('get_all_frames', params), ('iter_frames', params), ('process_video', params), ('convert_avi_to_mp4', params), ('transcode_to_mp4', params)]
+        ffmpeg_params = dict(params, decoder='ffmpeg')
+        cases += [('get_video_frame', ffmpeg_params), ('iter_frames', ffmpeg_params), ('process_video', ffmpeg_params)]
+    for n in workers:
+        cases.append(('process_video', {'video_id': videos[-1]['video_id'], 'pipeline_workers': n}))
+    cases.append(('save_image', {'video_id': videos[-1]['video_id']}))
+    cases.append(('create_max_constriction_dataset', {}))
+    for executor_type in ('thread', 'process'):
+        for n in workers:
+            cases.append(('create_all_frames_dataset', {'executor': executor_type, 'workers': n}))
+    if only:
+        cases = [case for case in cases if case[0] in only]
+
+    context = {'video_dir': video_dir, 'labels_path': labels_path, 'videos': {v['video_id']: v for v in videos}}
+    results = []
+    for name, params in cases:
+        # A new process per case, so every case starts from the same state
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(_run_case, name, params, context, work_dir, repeat).result()
+        results.append(result)
+        logging.info(
+            f"{name} {params}: {result['seconds']:.3f}s, {result['frames_per_s']:.1f} frames/s, "
+            f"{result['mb_per_s']:.1f} MB/s, peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+
+    _add_speedups(results)
+
+    parity = []
+    if not only or 'decoder_parity' in only:
+        try:
+            parity = [check_decoder_parity(video) for video in videos]
+        except ImportError as e:
+            logging.warning(f"Skipping the decoder parity check: {e}")
+
+    startup = []
+    if not only or 'startup' in only:
+        startup = measure_startup(repeat=max(repeat, 5), video=videos[0])
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'preset': preset,
+        'repeat': repeat,
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'opencv': cv.__version__,
+            'cpus': os.cpu_count(),
+        },
+        'videos': videos,
+        'cases': results,
+        'decoder_parity': parity,
+        'startup': startup,
+    }
+
+
+def check_decoder_parity(video, tolerance=DECODER_PARITY_TOLERANCE, random_seeks=PARITY_RANDOM_SEEKS, chunk_size=PARITY_CHUNK_SIZE, seed=0):
+    """
+    Check that the ffmpeg decoder returns the same frames as OpenCV for a video.
+
+    Every frame is decoded by both, in BGR and in grayscale (OpenCV's conversion
+    against ffmpeg's direct gray output), and the frame counts and pixel values
+    are compared. The ffmpeg decoder is then seeked to random frames and to the
+    start of every chunk of `chunk_size` frames, and the frames read from there
+    are compared with the ones of the sequential OpenCV decode, so a seek that
+    lands on the wrong frame is caught.
+
+    Parameters:
+        video (dict): A video returned by `generate_synthetic_videos`.
+        tolerance (dict): Largest per-pixel difference for the frames to count as the same, per pixel format.
+        random_seeks (int): Number of random seek targets.
+        chunk_size (int): Chunk size whose chunk starts are seeked to.
+        seed (int): Seed of the random seek targets.
+
+    Returns:
+        dict: The frame counts, the max and mean absolute differences and the seek targets that
+            returned other frames, per pixel format, and whether the decoders match.
+    """
+    from .ffmpeg_capture import FFmpegCapture
+    rng = np.random.default_rng(seed)
+    frame_count = video['frames']
+    targets = sorted(set(rng.integers(1, frame_count, random_seeks).tolist()) | set(range(chunk_size, frame_count, chunk_size)))
+    # Frames of the sequential OpenCV decode that the seeks are compared with
+    kept = {n for target in targets for n in range(target, min(target + PARITY_FRAMES_PER_SEEK, frame_count))}
+
+    result = {'video_id': video['video_id'], 'codec': video['codec'], 'seek_targets': targets}
+    for pix_fmt in ('bgr24', 'gray'):
+        opencv_cap = cv.VideoCapture(video['path'])
+        ffmpeg_cap = FFmpegCapture(video['path'], pix_fmt)
+        opencv_frames, ffmpeg_frames, max_diff, total_diff = 0, 0, 0, 0.0
+        reference = {}
+        while True:
+            ret_opencv, opencv_frame = opencv_cap.read()
+            ret_ffmpeg, ffmpeg_frame = ffmpeg_cap.read()
+            if ret_opencv and pix_fmt == 'gray':
+                opencv_frame = cv.cvtColor(opencv_frame, cv.COLOR_BGR2GRAY)
+            if ret_opencv and opencv_frames in kept:
+                reference[opencv_frames] = opencv_frame
+            opencv_frames += ret_opencv
+            ffmpeg_frames += ret_ffmpeg
+            if not (ret_opencv and ret_ffmpeg):
+                # Count the frames left in the longer one
+                if ret_opencv:
+                    while opencv_cap.grab():
+                        opencv_frames += 1
+                elif ret_ffmpeg:
+                    while ffmpeg_cap.grab():
+                        ffmpeg_frames += 1
+                break
+            diff = cv.absdiff(opencv_frame, ffmpeg_frame)
+            max_diff = max(max_diff, int(diff.max()))
+            total_diff += float(diff.mean())
+        opencv_cap.release()
+        ffmpeg_cap.release()
+
+        # Every seek on a new capture, so ffmpeg is restarted at the target instead of reading on to it
+        seek_failures = []
+        for target in targets:
+            ffmpeg_cap = FFmpegCapture(video['path'], pix_fmt)
+            ffmpeg_cap.set(cv.CAP_PROP_POS_FRAMES, target)
+            for frame_number in range(target, min(target + PARITY_FRAMES_PER_SEEK, frame_count)):
+                ret_ffmpeg, ffmpeg_frame = ffmpeg_cap.read()
+                if frame_number not in reference:
+                    continue
+                if not ret_ffmpeg or int(cv.absdiff(reference[frame_number], ffmpeg_frame).max()) > tolerance[pix_fmt]:
+                    seek_failures.append(target)
+                    break
+            ffmpeg_cap.release()
+
+        result[pix_fmt] = {
+            'opencv_frames': opencv_frames,
+            'ffmpeg_frames': ffmpeg_frames,
+            'max_abs_diff': max_diff,
+            'mean_abs_diff': total_diff / max(min(opencv_frames, ffmpeg_frames), 1),
+            'seek_failures': seek_failures,
+        }
+
+    result['match'] = all(
+        result[pix_fmt]['opencv_frames'] == result[pix_fmt]['ffmpeg_frames']
+        and result[pix_fmt]['max_abs_diff'] <= tolerance[pix_fmt]
+        and not result[pix_fmt]['seek_failures']
+        for pix_fmt in ('bgr24', 'gray')
+    )
+    log = logging.info if result['match'] else logging.error
+    log(
+        f"Decoder parity of video {video['video_id']} ({video['codec']}): "
+        + ", ".join(
+            f"{f} {result[f]['opencv_frames']}/{result[f]['ffmpeg_frames']} frames, max diff {result[f]['max_abs_diff']}, "
+            f"{len(result[f]['seek_failures'])}/{len(targets)} seeks off"
+            for f in ('bgr24', 'gray')
+        )
+    )
+    return result
+
+
+def measure_startup(budgets=STARTUP_BUDGETS, repeat=5, video=None, first_frame_budget=FIRST_FRAME_BUDGET):
+    """
+    Time the startup of the commands of `vfss.py` against their budget.
+
+    Every run is a fresh interpreter running `vfss.py <command> --help`, which
+    imports the modules of the command and exits once its arguments are parsed,
+    so this is the delay before a command starts working, without the work itself.
+    With a `video`, the time until `vfss play` shows its first frame is timed
+    too, with the player closing right after it (`--max_frames 1`); it is
+    skipped when no window can be opened, e.g. on a headless machine.
+
+    Parameters:
+        budgets (dict): Budget in seconds of every command to time.
+        repeat (int): Number of runs of each command. The median is reported.
+        video (dict): A video returned by `generate_synthetic_videos`, to time the first frame of.
+        first_frame_budget (float): Budget in seconds of the first frame.
+
+    Returns:
+        list: The command, its median startup time in seconds, its budget and whether it is within it.
+    """
+    vfss_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vfss.py')
+    runs = [(command, [command, '--help'], budget) for command, budget in budgets.items()]
+    if video is not None:
+        play_args = ['play', str(video['video_id']), '--video_dir', os.path.dirname(video['path']), '--max_frames', '1']
+        runs.append(('play_first_frame', play_args, first_frame_budget))
+
+    results = []
+    for command, args, budget in runs:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, vfss_path, *args], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            times.append(time.perf_counter() - start)
+            if process.returncode != 0:
+                break
+        if process.returncode != 0:
+            if command == 'play_first_frame':
+                logging.warning(f"Skipping the first frame of vfss play, the player failed: {process.stderr.strip()[-500:]}")
+                continue
+            raise RuntimeError(f"vfss {command} failed: {process.stderr.strip()[-500:]}")
+        seconds = statistics.median(times)
+        result = {'command': command, 'seconds': seconds, 'budget': budget, 'within_budget': seconds <= budget}
+        log = logging.info if result['within_budget'] else logging.error
+        log(f"Startup of vfss {command}: {seconds:.3f}s (budget {budget:.1f}s)")
+        results.append(result)
+    return results
+
+
+def save_results(results, output_path):
+    """
+    Save benchmark results as JSON.
+    """
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Benchmark results saved to {output_path}")
+
+
+def load_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    """
+    Compare the frames/s of two benchmark runs, case by case.
+
+    Parameters:
+        baseline (dict): Results of the reference run.
+        current (dict): Results of the new run.
+        threshold (float): Relative drop in frames/s above which a case is a regression.
+
+    Returns:
+        list: Dicts with the name, params, both frames/s and the relative change of every case
+            present in both runs, regressions flagged with `regression`.
+    """
+    baseline_cases = {_case_key(case): case for case in baseline['cases']}
+    comparison = []
+    for case in current['cases']:
+        reference = baseline_cases.get(_case_key(case))
+        if reference is None or not reference['frames_per_s']:
+            continue
+        change = case['frames_per_s'] / reference['frames_per_s'] - 1
+        comparison.append({
+            'name': case['name'],
+            'params': case['params'],
+            'baseline_frames_per_s': reference['frames_per_s'],
+            'frames_per_s': case['frames_per_s'],
+            'change': change,
+            'regression': change < -threshold,
+        })
+    return comparison
+
+
+def log_comparison(comparison):
+    """
+    Log the output of `compare_results`, one line per case.
+
+    Returns:
+        int: The number of regressions.
+    """
+    for row in comparison:
+        flag = 'REGRESSION' if row['regression'] else 'ok'
+        logging.info(
+            f"{flag:>10} {row['name']} {row['params']}: {row['baseline_frames_per_s']:.1f} -> "
+            f"{row['frames_per_s']:.1f} frames/s ({row['change']:+.1%})"
+        )
+    regressions = sum(row['regression'] for row in comparison)
+    logging.info(f"{regressions} regressions in {len(comparison)} compared cases.")
+    return regressions
+
+
+def _case_key(case):
+    return case['name'], json.dumps(case['params'], sort_keys=True)
+
+
+def _add_speedups(results):
+    """
+    Add the speedup over one worker to the dataset builder cases.
+    """
+    single = {
+        case['params']['executor']: case['seconds']
+        for case in results
+        if case['name'] == 'create_all_frames_dataset' and case['params']['workers'] == 1
+    }
+    for case in results:
+        if case['name'] == 'create_all_frames_dataset' and case['params']['executor'] in single:
+            case['speedup'] = single[case['params']['executor']] / case['seconds']
+
+
+def _peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_case(name, params, context, work_dir, repeat):
+    """
+    Time a benchmark case. Runs in a fresh process.
+    """
+    logging.basicConfig(level=logging.WARNING)
+    output_dir = os.path.join(work_dir, 'outputs', name)
+    timings = []
+    for _ in range(repeat):
+        if os.path.isdir(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir)
+        start = time.perf_counter()
+        frames, num_bytes = BENCHMARKS[name](params, context, output_dir)
+        timings.append(time.perf_counter() - start)
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    seconds = statistics.median(timings)
+    return {
+        'name': name,
+        'params': params,
+        'seconds': seconds,
+        'timings': timings,
+        'frames': frames,
+        'bytes': num_bytes,
+        'frames_per_s': frames / seconds if seconds else 0.0,
+        'mb_per_s': num_bytes / 1024 ** 2 / seconds if seconds else 0.0,
+        'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+        'peak_children_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+# Every benchmark returns the number of frames and of decoded bytes it processed
+
+def _decoder(params):
+    from .video_decoder import VideoDecoder
+    return VideoDecoder(params['decoder']) if 'decoder' in params else None
+
+
+def _bench_get_video_frame(params, context, output_dir):
+    from .video_tool import get_video_frame
+    video = context['videos'][params['video_id']]
+    rng = np.random.default_rng(0)
+    frame_numbers = rng.integers(0, video['frames'], size=20)
+    num_bytes = 0
+    for frame_number in frame_numbers:
+        frame = get_video_frame(video['video_id'], int(frame_number), context['video_dir'], decoder=_decoder(params))
+        num_bytes += frame.nbytes
+    return len(frame_numbers), num_bytes
+
+
+def _bench_get_all_frames(params, context, output_dir):
+    from .video_tool import get_all_frames
+    frames = get_all_frames(params['video_id'], context['video_dir'])
+    return len(frames), sum(frame.nbytes for frame in frames)
+
+
+def _bench_iter_frames(params, context, output_dir):
+    from .video_tool import iter_frames
+    frames, num_bytes = 0, 0
+    for frame in iter_frames(params['video_id'], video_dir=context['video_dir'], decoder=_decoder(params)):
+        frames += 1
+        num_bytes += frame.nbytes
+    return frames, num_bytes
+
+
+def _bench_process_video(params, context, output_dir):
+    from .create_dataset import process_video
+    video = context['videos'][params['video_id']]
+    result = process_video(video['path'], output_dir, (video['width'], video['height']), pipeline_workers=params.get('pipeline_workers', 0), decoder=_decoder(params))
+    return result['kept'], result['kept'] * video['width'] * video['height'] * 3
+
+
+def _bench_save_image(params, context, output_dir):
+    from .image_tool import save_image
+    from .video_tool import get_video_frame
+    frame = get_video_frame(params['video_id'], 0, context['video_dir'])
+    count = 50
+    for i in range(count):
+        save_image(frame, os.path.join(output_dir, f"{i}.png"))
+    return count, count * frame.nbytes
+
+
+def _bench_convert_avi_to_mp4(params, context, output_dir):
+    from .video_tool import convert_avi_to_mp4
+    video = context['videos'][params['video_id']]
+    convert_avi_to_mp4(video['path'], os.path.join(output_dir, f"{video['video_id']}.mp4"))
+    return video['frames'], video['frames'] * video['width'] * video['height'] * 3
+
+
+def _bench_transcode_to_mp4(params, context, output_dir):
+    from .transcode import transcode_to_mp4
+    video = context['videos'][params['video_id']]
+    transcode_to_mp4(video['path'], os.path.join(output_dir, f"{video['video_id']}.mp4"), overwrite=True)
+    return video['frames'], video['frames'] * video['width'] * video['height'] * 3
+
+
+def _bench_create_max_constriction_dataset(params, context, output_dir):
+    from .create_dataset import create_max_constriction_dataset
+    from .video_labels import read_video_labels_df
+    df_labels = read_video_labels_df(context['labels_path'], cache_dir=None)
+    create_max_constriction_dataset(df_labels, context['video_dir'], output_dir, frame_size=(512, 512))
+    return len(df_labels), len(df_labels) * 512 * 512 * 3
+
+
+def _bench_create_all_frames_dataset(params, context, output_dir):
+    from .create_dataset import create_all_frames_dataset
+    create_all_frames_dataset(
+        context['video_dir'], output_dir, frame_size=(512, 512),
+        executor_type=params['executor'], workers=params['workers']
+    )
+    videos = context['videos'].values()
+    return sum(v['frames'] for v in videos), sum(v['frames'] * 512 * 512 * 3 for v in videos)
+
+
+BENCHMARKS = {
+    'get_video_frame': _bench_get_video_frame,
+    'get_all_frames': _bench_get_all_frames,
+    'iter_frames': _bench_iter_frames,
+    'process_video': _bench_process_video,
+    'save_image': _bench_save_image,
+    'convert_avi_to_mp4': _bench_convert_avi_to_mp4,
+    'transcode_to_mp4': _bench_transcode_to_mp4,
+    'create_max_constriction_dataset': _bench_create_max_constriction_dataset,
+    'create_all_frames_dataset': _bench_create_all_frames_dataset,
+}
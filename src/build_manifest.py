@@ -0,0 +1,179 @@
+import glob
+import json
+import logging
+import os
+import threading
+from .utils import hash_file
+
+
+class BuildManifest:
+    """
+    Record of what a dataset directory was built from, so a build can be resumed or updated.
+
+    For every video it stores the size, mtime and hash of the source, its label
+    row, the build settings (dataset type, frame size, sampling...) and the names
+    of the images written from it. A video is only recorded as done once all its
+    images are written; while it is built it is recorded as started, so a
+    crashed build resumes it only if its source, label row and settings did not
+    change, and otherwise deletes its partial images and redoes it. The
+    manifest is saved to `manifest.json` in the dataset directory after every
+    change, and is safe to update from several threads.
+
+    Parameters:
+        dataset_dir (str): The dataset directory.
+        settings (dict): The build settings. Videos built with other settings are out of date.
+    """
+    def __init__(self, dataset_dir, settings):
+        self.dataset_dir = dataset_dir
+        self.path = os.path.join(dataset_dir, 'manifest.json')
+        self.settings = json.loads(json.dumps(settings))
+        self.lock = threading.Lock()
+        self.videos = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.videos = json.load(f).get('videos', {})
+
+    def is_up_to_date(self, video_id, video_path, label_row=None):
+        """
+        Whether the outputs of a video were built from the current source, label row and settings.
+
+        The source is compared by size and mtime, and by hash only when those
+        changed, so touching a file does not trigger a rebuild.
+        """
+        entry = self.videos.get(str(video_id))
+        if entry is None or not entry.get('complete', True):
+            return False
+        if entry['settings'] != self.settings or entry['label_row'] != _to_json(label_row):
+            return False
+
+        stat = os.stat(video_path)
+        if entry['source_size'] == stat.st_size and entry['source_mtime'] == stat.st_mtime:
+            return True
+        if entry['source_size'] != stat.st_size or entry['source_hash'] != hash_file(video_path):
+            return False
+
+        # Same content with a new mtime, remember it to skip the hash next time
+        with self.lock:
+            entry['source_mtime'] = stat.st_mtime
+            self._save()
+        return True
+
+    def can_resume(self, video_id, video_path, label_row=None):
+        """
+        Whether a video was started, but not finished, with the current source, label row and settings,
+        so the images already written for it can be kept.
+        """
+        entry = self.videos.get(str(video_id))
+        if entry is None or entry.get('complete', True):
+            return False
+        stat = os.stat(video_path)
+        return (
+            entry['settings'] == self.settings and entry['label_row'] == _to_json(label_row)
+            and entry['source_size'] == stat.st_size and entry['source_mtime'] == stat.st_mtime
+        )
+
+    def mark_started(self, video_id, video_path, label_row=None):
+        """
+        Record that the outputs of a video are being written, see `can_resume`.
+        """
+        stat = os.stat(video_path)
+        entry = {
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'label_row': _to_json(label_row),
+            'settings': self.settings,
+            'outputs': [],
+            'complete': False,
+        }
+        with self.lock:
+            self.videos[str(video_id)] = entry
+            self._save()
+
+    def has_entry(self, video_id):
+        """
+        Whether a video has recorded outputs.
+        """
+        return str(video_id) in self.videos
+
+    def mark_done(self, video_id, video_path, outputs, label_row=None):
+        """
+        Record that all the outputs of a video were written.
+
+        Parameters:
+            video_id (str): The ID of the video.
+            video_path (str): Path to the source video.
+            outputs (list): Names of the images written from the video, relative to the dataset directory.
+            label_row (dict): The label row used to build the outputs.
+        """
+        stat = os.stat(video_path)
+        entry = {
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'source_hash': hash_file(video_path),
+            'label_row': _to_json(label_row),
+            'settings': self.settings,
+            'outputs': sorted(outputs),
+            'complete': True,
+        }
+        with self.lock:
+            self.videos[str(video_id)] = entry
+            self._save()
+
+    def forget(self, video_id, output_pattern=None):
+        """
+        Delete the recorded outputs of a video and remove it from the manifest.
+
+        Parameters:
+            video_id (str): The ID of the video.
+            output_pattern (str): Glob of the outputs of a video relative to the dataset directory, with
+                a `{video_id}` field, e.g. `{video_id}_frame_*`. The files it matches are deleted too,
+                as the outputs of an interrupted build are not recorded.
+
+        Returns:
+            int: Number of files deleted.
+        """
+        with self.lock:
+            entry = self.videos.pop(str(video_id), None)
+            self._save()
+
+        paths = {os.path.join(self.dataset_dir, name) for name in entry['outputs']} if entry is not None else set()
+        if output_pattern is not None:
+            paths.update(glob.glob(os.path.join(glob.escape(self.dataset_dir), output_pattern.format(video_id=glob.escape(str(video_id))))))
+        deleted = 0
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+                deleted += 1
+        return deleted
+
+    def prune(self, video_ids, output_pattern=None):
+        """
+        Delete the outputs of the recorded videos that are not in `video_ids`, e.g. because their source was removed.
+
+        Parameters:
+            video_ids (iterable): The IDs of the videos being built.
+            output_pattern (str): Glob of the outputs of a video, see `forget`.
+
+        Returns:
+            list: The IDs of the pruned videos.
+        """
+        video_ids = set(str(video_id) for video_id in video_ids)
+        removed = [video_id for video_id in list(self.videos) if video_id not in video_ids]
+        for video_id in removed:
+            deleted = self.forget(video_id, output_pattern)
+            logging.info(f"Pruned {deleted} images of removed video {video_id}.")
+        return removed
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'videos': self.videos}, f)
+        os.replace(tmp_path, self.path)
+
+
+def _to_json(value):
+    """
+    Round-trip a value through JSON, so it compares equal to what was loaded from the manifest.
+    """
+    return json.loads(json.dumps(value, default=str))
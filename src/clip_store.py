@@ -0,0 +1,131 @@
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+from .profiling import profile_stage
+
+# Name of the clip index inside a clips dataset directory
+CLIP_INDEX_NAME = 'clip_index.csv'
+
+CLIP_INDEX_COLUMNS = ['clip_id', 'video_id', 'event', 'center_frame', 'start_frame', 'pad_before', 'pad_after', 'label', 'chunk', 'chunk_offset']
+
+
+class ClipWriter:
+    """
+    Write fixed-length clips as chunked uint8 arrays, with a CSV clip index.
+
+    Clips are buffered and written `clips_per_chunk` at a time as one
+    `(clips, frames, height, width[, 3])` array per chunk file, so a dataset of
+    thousands of clips is a few dozen files instead of one image per frame.
+    Chunks are compressed `.npz` files, or with `compress=False` plain `.npy`
+    files that loaders can memory-map (see `ClipReader`). The index, written on
+    close, maps every clip to its chunk and offset. Writes are serialized with a
+    lock, so the writer can be shared by several threads.
+
+    Parameters:
+        dataset_dir (str): The dataset directory.
+        clips_per_chunk (int): Number of clips per chunk file.
+        compress (bool): Whether to write compressed `.npz` chunks instead of `.npy` ones.
+    """
+    def __init__(self, dataset_dir, clips_per_chunk=64, compress=True):
+        self.dataset_dir = dataset_dir
+        self.clips_per_chunk = clips_per_chunk
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.rows = []
+        self.chunks = 0
+        os.makedirs(dataset_dir, exist_ok=True)
+
+    def add(self, clip, video_id, event, center_frame, start_frame, pad_before=0, pad_after=0, label=None):
+        """
+        Add a clip.
+
+        Parameters:
+            clip (numpy.ndarray): The frames of the clip, as a uint8 `(frames, height, width[, 3])` array.
+            video_id (str): The ID of the video.
+            event (str): The label column the clip is centered on, e.g. `frame_max_constricao`.
+            center_frame (int): The frame the clip is centered on.
+            start_frame (int): The frame number of the first frame of the clip, before padding.
+            pad_before, pad_after (int): Number of frames repeated at the start and end of the clip
+                because the window went past the bounds of the video.
+            label (int): Optional label of the clip, e.g. its `pas_score`.
+        """
+        with self.lock:
+            if self.buffer and clip.shape != self.buffer[0].shape:
+                raise ValueError(f"Clip of video {video_id} has shape {clip.shape}, expected {self.buffer[0].shape}")
+            self.rows.append({
+                'clip_id': len(self.rows), 'video_id': str(video_id), 'event': event,
+                'center_frame': center_frame, 'start_frame': start_frame, 'pad_before': pad_before, 'pad_after': pad_after,
+                'label': label, 'chunk': self._chunk_name(self.chunks), 'chunk_offset': len(self.buffer),
+            })
+            self.buffer.append(clip)
+            if len(self.buffer) == self.clips_per_chunk:
+                self._flush()
+
+    def close(self):
+        """
+        Write the last chunk and the clip index.
+
+        Returns:
+            str: The path of the clip index.
+        """
+        with self.lock:
+            if self.buffer:
+                self._flush()
+            index_path = os.path.join(self.dataset_dir, CLIP_INDEX_NAME)
+            pd.DataFrame(self.rows, columns=CLIP_INDEX_COLUMNS).to_csv(index_path, index=False)
+        logging.info(f"Wrote {len(self.rows)} clips in {self.chunks} chunks to {self.dataset_dir}")
+        return index_path
+
+    def _chunk_name(self, chunk):
+        return f"clips_{chunk:05d}{'.npz' if self.compress else '.npy'}"
+
+    def _flush(self):
+        clips = np.stack(self.buffer)
+        path = os.path.join(self.dataset_dir, self._chunk_name(self.chunks))
+        with profile_stage('write', clips.nbytes):
+            if self.compress:
+                np.savez_compressed(path, clips=clips)
+            else:
+                np.save(path, clips)
+        self.buffer = []
+        self.chunks += 1
+
+
+class ClipReader:
+    """
+    Random access to the clips of a dataset written by `ClipWriter`.
+
+    `.npy` chunks are memory-mapped, so reading a clip only pages in its frames.
+    `.npz` chunks are decompressed whole, and the last one read is kept.
+
+    Parameters:
+        dataset_dir (str): The dataset directory.
+    """
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        self.index = pd.read_csv(os.path.join(dataset_dir, CLIP_INDEX_NAME), dtype={'video_id': str})
+        self.cached_name = None
+        self.cached_chunk = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, clip_id):
+        """
+        Get a clip, as a `(frames, height, width[, 3])` uint8 array.
+        """
+        row = self.index.iloc[clip_id]
+        return self._load_chunk(row['chunk'])[int(row['chunk_offset'])]
+
+    def _load_chunk(self, name):
+        path = os.path.join(self.dataset_dir, name)
+        if name.endswith('.npy'):
+            return np.load(path, mmap_mode='r')
+        if name != self.cached_name:
+            with np.load(path) as chunk:
+                self.cached_chunk = chunk['clips']
+            self.cached_name = name
+        return self.cached_chunk
@@ -1,115 +1,993 @@
 import os
-from .video_tool import get_video_frame
-from .image_tool import save_image
-from .utils import get_video_path_from_id
+import json
+import hashlib
+from .video_tool import get_video_frames
+from .image_tool import encode_image, to_grayscale
+from .dataset_sink import QueueSink
+from .dataset_stats import DatasetStats
+from .frame_pipeline import FramePipeline
+from .frame_geometry import FrameGeometry
+from .frame_cache import open_cached_capture, fill_cache, evict_cache, DEFAULT_MAX_CACHE_BYTES
+from .video_index import get_video_index, seek_to_frame
+from .utils import get_video_path_from_id, write_file_atomic
+from .video_probe import log_label_problems
+from .profiling import profile_stage, enable_profiling, get_profiler
 import cv2 as cv
+import numpy as np
 import logging
+import math
 from tqdm import tqdm  
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import threading
 
 
 # Logging configuration
 logging.getLogger()
 
-def create_max_constriction_dataset(df_labels, video_dir, dataset_dir, frame_size=(512, 512)):
+# Number of frames a worker process processes before reporting progress
+PROGRESS_BATCH = 32
+
+# Queue to the parent process, set in each worker of the process pool
+_worker_queue = None
+
+# Output name suffix for each label column that points to a frame number
+LABEL_FRAME_SUFFIXES = {
+    'frame_max_constricao': 'max_constriction',
+    'frame_repouso': 'repouso',
+    'pas_frame': 'pas_frame',
+}
+
+# Images of a video in an all frames dataset, as a `BuildManifest` output pattern
+ALL_FRAMES_OUTPUT_PATTERN = '{video_id}_frame_*'
+
+def create_max_constriction_dataset(df_labels, video_dir, dataset_dir, frame_size=(512, 512), extra_frame_columns=(), sink=None, label_column=None, cache_dir=None, manifest=None, grayscale=False, encoder=None, catalog=None, geometry=None, stats=None, probe=None):
     """
     Create a dataset of images from the maximum constriction frames of videos.
 
+    Every labeled frame of a video is read in a single decode pass, so the
+    extra label frames (e.g. `frame_repouso`, `pas_frame`) cost no extra seeks.
+
     Parameters:
         df_labels (pd.DataFrame): DataFrame containing video labels.
         video_dir (str): Directory where the videos are stored.
         dataset_dir (str): Directory where the images will be saved.
+        frame_size (tuple): Size of the output images (width, height).
+        extra_frame_columns (tuple): Other label columns whose frames are also saved,
+            as `{video_id}_{suffix}.png` (see `LABEL_FRAME_SUFFIXES`).
+        sink (DirectorySink | ZipSink): If given, the encoded images are written to this sink
+            instead of `dataset_dir`.
+        label_column (str): Label column (e.g. `pas_score`) whose value is passed to the sink as the image label.
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
+        manifest (BuildManifest): If given, the build is incremental: only videos whose source or
+            label rows changed are processed, and the images of videos no longer labeled, or whose
+            source is missing, are deleted.
+        grayscale (bool): Whether to convert the frames to single-channel grayscale right after
+            decoding and save `L` mode images.
+        encoder (ImageEncoder): If given, the encoder used for the images instead of PIL's default PNG.
+        catalog (FrameCatalog): If given, every written image is recorded in this frame catalog.
+        geometry (FrameGeometry): Crop and resize policy. If None, frames are stretched to `frame_size`.
+        stats (DatasetStats): If given, the statistics of every written image are added to it.
+        probe (VideoProbe): If given, the labeled frames are checked against the frame counts of the
+            videos up front, and missing or unreadable videos and out of range frames are skipped.
 
     Returns:
         None
     """
+    # pandas is only loaded by the datasets built from labels, it is most of the startup time of the others
+    import pandas as pd
+
+    extension = encoder.extension if encoder is not None else '.png'
+    geometry = geometry or FrameGeometry()
+
     # Ensure the output directory exists
-    os.makedirs(dataset_dir, exist_ok=True)
+    if sink is None:
+        os.makedirs(dataset_dir, exist_ok=True)
+
+    frame_columns = ['frame_max_constricao'] + [c for c in extra_frame_columns if c in df_labels.columns]
+    row_columns = ['video_id'] + frame_columns + ([label_column] if label_column is not None else [])
+
+    skipped_videos = 0
+
+    # Path of every video that can be built
+    invalid_frames = set()
+    if probe is not None:
+        problems = probe.validate_labels(df_labels, frame_columns)
+        log_label_problems(problems)
+        missing_videos = {video_id for video_id, column, _, _ in problems if column is None}
+        invalid_frames = {(video_id, column, frame_number) for video_id, column, frame_number, _ in problems if column is not None}
+        df_labels = df_labels[~df_labels['video_id'].astype(str).isin(missing_videos)]
+        video_paths = {video_id: probe.get_path(video_id) for video_id in df_labels['video_id'].unique()}
+    else:
+        video_paths = {}
+        for video_id in df_labels['video_id'].unique():
+            try:
+                video_paths[video_id] = get_video_path_from_id(video_id, video_dir)
+            except FileNotFoundError as e:
+                logging.error(f"Error: {e}")
+        df_labels = df_labels[df_labels['video_id'].isin(list(video_paths))]
+
+    # After the missing videos are dropped, so their images are deleted as a clean build would not have them
+    if manifest is not None:
+        manifest.prune(video_paths)
+    if catalog is not None:
+        catalog.prune(video_paths)
 
     rescaled_videos_id = []
-    for _, row in tqdm(df_labels.iterrows(), total=len(df_labels), desc="Creating max constriction dataset"):
-        video_id = row['video_id']
-        frame_number = row['frame_max_constricao']
-        
-        # Get the video path
+    for video_id, df_video in tqdm(df_labels.groupby('video_id', sort=False), total=df_labels['video_id'].nunique(), desc="Creating max constriction dataset"):
+        video_path = video_paths[video_id]
+
+        if manifest is not None:
+            # Through JSON, so NaN and numpy values compare equal to the recorded row
+            label_row = json.loads(df_video[row_columns].to_json(orient='records'))
+            if manifest.is_up_to_date(video_id, video_path, label_row):
+                skipped_videos += 1
+                continue
+            manifest.forget(video_id)
+
+        # Collect every labeled frame of this video
+        requests = []
+        for _, row in df_video.iterrows():
+            for column in frame_columns:
+                if pd.isna(row[column]) or (str(video_id), column, int(row[column])) in invalid_frames:
+                    continue
+                requests.append((column, int(row[column])))
+
+        # Get all the frames in one pass
+        with profile_stage('decode') as stage:
+            frames = get_video_frames(video_id, [frame_number for _, frame_number in requests], video_dir, cache_dir)
+            stage.nbytes = sum(frame.nbytes for frame in frames if frame is not None)
+
+        video_geometry = geometry.for_video(video_path)
+
+        label = None
+        if label_column is not None and not pd.isna(df_video[label_column].iloc[0]):
+            label = int(df_video[label_column].iloc[0])
+
+        outputs = []
+        catalog_rows = []
+        for (column, frame_number), frame in zip(requests, frames):
+            if frame is not None:
+                # Crop first, so the borders are never converted nor resized
+                frame = video_geometry.crop_frame(frame)
+                if grayscale:
+                    with profile_stage('grayscale', frame.nbytes):
+                        frame, lossless = to_grayscale(frame)
+                    if not lossless:
+                        logging.warning(f"Frame {frame_number} of video {video_id} is not gray, the grayscale conversion loses color information.")
+
+                # Resize the frame if necessary
+                if (frame.shape[1], frame.shape[0]) != frame_size:
+                    with profile_stage('resize', frame.nbytes):
+                        frame = video_geometry.resize(frame, frame_size)
+                    if column == 'frame_max_constricao':
+                        rescaled_videos_id.append(video_id)
+
+                if stats is not None:
+                    with profile_stage('stats', frame.nbytes):
+                        stats.add(frame, video_id, frame_number)
+
+                # Save the frame as an image
+                output_name = f"{video_id}_{LABEL_FRAME_SUFFIXES[column]}{extension}"
+                size, content_hash = write_frame(frame, output_name, dataset_dir, sink, label, encoder, describe=catalog is not None)
+                outputs.append(output_name)
+                catalog_rows.append((frame_number, output_name, size, content_hash))
+
+            else:
+                logging.error(f"Frame not found for video ID: {video_id} at frame number: {frame_number}")
+
+        if manifest is not None:
+            manifest.mark_done(video_id, video_path, outputs, label_row)
+        if catalog is not None:
+            catalog.add_frames(video_id, catalog_rows)
+
+    if manifest is not None:
+        logging.info(f"{skipped_videos} videos were up to date and skipped.")
+
+    logging.info(f"{len(rescaled_videos_id)} videos needed to be resized to {frame_size[0]}x{frame_size[1]}: {rescaled_videos_id}")
+
+def create_clips_dataset(df_labels, video_dir, dataset_dir, frame_size=(512, 512), radius=8, event_columns=tuple(LABEL_FRAME_SUFFIXES), label_column=None, cache_dir=None, grayscale=False, geometry=None, workers=None, clips_per_chunk=64, compress=True):
+    """
+    Create a dataset of clips of `2 * radius + 1` frames centered on the labeled events of videos.
+
+    All the clips of a video are extracted in a single sequential decode pass
+    (see `iter_video_clips`), and are stored as chunked uint8 arrays with a clip
+    index (see `ClipWriter`), so training loaders read a few chunk files instead
+    of one image per frame. Videos are written in `video_id` order, so the same
+    labels give the same clip ids and chunks on every run.
+
+    Parameters:
+        df_labels (pd.DataFrame): DataFrame containing video labels.
+        video_dir (str): Directory where the videos are stored.
+        dataset_dir (str): Directory where the chunks and the clip index are saved.
+        frame_size (tuple): Size of the output frames (width, height).
+        radius (int): Number of frames kept before and after every event frame.
+        event_columns (tuple): Label columns of the event frames the clips are centered on.
+        label_column (str): Label column (e.g. `pas_score`) stored as the label of the clips, taken from
+            the row of the event each clip is centered on.
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
+        grayscale (bool): Whether to store single-channel grayscale clips instead of RGB ones.
+        geometry (FrameGeometry): Crop and resize policy. If None, frames are stretched to `frame_size`.
+        workers (int): Number of videos processed concurrently. If None, uses the executor default.
+        clips_per_chunk (int): Number of clips per chunk file.
+        compress (bool): Whether to write compressed `.npz` chunks instead of memory-mappable `.npy` ones.
+
+    Returns:
+        None
+    """
+    import pandas as pd
+    from .clip_store import ClipWriter
+
+    geometry = geometry or FrameGeometry()
+    event_columns = [c for c in event_columns if c in df_labels.columns]
+    writer = ClipWriter(dataset_dir, clips_per_chunk, compress)
+
+    # Event windows of every video, in video_id order, with the label of the row each event comes from
+    videos = []
+    for video_id, df_video in df_labels.groupby('video_id', sort=True):
+        labels = {}
+        for _, row in df_video.iterrows():
+            label = None
+            if label_column is not None and not pd.isna(row[label_column]):
+                label = int(row[label_column])
+            for column in event_columns:
+                if not pd.isna(row[column]):
+                    labels.setdefault((column, int(row[column])), label)
+        if labels:
+            videos.append((str(video_id), labels))
+
+    def process(video_id, labels):
         video_path = get_video_path_from_id(video_id, video_dir)
-        
-        # Get the frame
-        frame = get_video_frame(video_id, frame_number, video_dir)
-        
+        events = sorted(labels, key=lambda event: event[1])
+        return [
+            (clip, labels[(clip['event'], clip['center_frame'])])
+            for clip in iter_video_clips(video_path, events, frame_size, radius, cache_dir, grayscale, geometry.for_video(video_path))
+        ]
+
+    # Videos are written in order, so clip ids and chunks do not depend on which video finishes first.
+    # At most two videos per worker are extracted ahead of the one being written.
+    max_workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    total_clips = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process, *video) for video in videos[:2 * max_workers]]
+        for i, video in enumerate(tqdm(videos, desc="Creating clips dataset")):
+            if i + 2 * max_workers < len(videos):
+                futures.append(executor.submit(process, *videos[i + 2 * max_workers]))
+            try:
+                clips = futures[i].result()
+            except Exception as e:
+                logging.error(f"Error processing video {video[0]}: {e}")
+                continue
+            finally:
+                futures[i] = None
+            for clip, label in clips:
+                writer.add(label=label, **clip)
+            total_clips += len(clips)
+
+    index_path = writer.close()
+    if cache_dir is not None:
+        evict_frame_cache(cache_dir)
+    logging.info(f"{total_clips} clips of {2 * radius + 1} frames from {len(videos)} videos, indexed in {index_path}")
+
+def iter_video_clips(video_path, events, frame_size=(512, 512), radius=8, cache_dir=None, grayscale=False, geometry=None):
+    """
+    Extract the clips centered on the event frames of a video in one sequential decode pass.
+
+    The video is decoded once, from the first frame of the first window to the
+    last frame of the last one. Frames outside of every window are grabbed but
+    never converted, and a frame is dropped as soon as no remaining window needs
+    it, so overlapping windows share their frames and memory stays bounded by
+    the windows in progress. Windows that go past the bounds of the video are
+    padded by repeating the first or last frame.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        events (list): (label column, frame number) tuples of the event frames.
+        frame_size (tuple): Size of the output frames (width, height).
+        radius (int): Number of frames kept before and after every event frame.
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
+        grayscale (bool): Whether to return single-channel grayscale clips instead of RGB ones.
+        geometry (FrameGeometry): Crop and resize policy for this video (see `FrameGeometry.for_video`).
+
+    Yields:
+        dict: The `clip` as a uint8 `(frames, height, width[, 3])` array, with the `video_id`, `event`,
+            `center_frame`, `start_frame`, `pad_before` and `pad_after` of the clip index.
+    """
+    video_id = os.path.splitext(os.path.basename(video_path))[0]
+    geometry = geometry or FrameGeometry()
+    index = get_video_index(video_path) if cache_dir is None else None
+
+    windows = [(column, center, center - radius, center + radius + 1) for column, center in events]
+    first = max(min(start for _, _, start, _ in windows), 0)
+    cap = open_video_at(video_path, first, cache_dir)
+    if cap is None:
+        logging.error(f"Error: Could not open video {video_path}.")
+        return
+    total_frames = index['frame_count'] if index is not None else int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+
+    # Windows are completed in the order of their last frame
+    pending = sorted(windows, key=lambda window: window[3])
+    last = max(stop for _, _, _, stop in windows)
+    if total_frames > 0:
+        last = min(last, total_frames)
+    needed = {frame_number for _, _, start, stop in windows for frame_number in range(max(start, 0), stop)}
+    frames = {}
+
+    def make_clip(column, center, start, stop, end):
+        # Frames from start to stop, read up to end (excluded), padded with the first and last frames
+        available = [frames[n] for n in range(max(start, 0), min(stop, end)) if n in frames]
+        if not available:
+            logging.error(f"Frame {center} ({column}) not found for video ID: {video_id}")
+            return None
+        pad_before = max(-start, 0)
+        pad_after = stop - start - pad_before - len(available)
+        clip = np.stack([available[0]] * pad_before + available + [available[-1]] * pad_after)
+        return {
+            'clip': clip, 'video_id': video_id, 'event': column, 'center_frame': center,
+            'start_frame': start, 'pad_before': pad_before, 'pad_after': pad_after,
+        }
+
+    frame_number = first
+    while frame_number < last and pending:
+        if frame_number in needed:
+            with profile_stage('decode') as stage:
+                ret, frame = cap.read()
+                stage.nbytes = frame.nbytes if ret else 0
+        else:
+            with profile_stage('grab'):
+                ret, frame = cap.grab(), None
+        if not ret:
+            break
+
         if frame is not None:
-            # Resize the frame if necessary
+            frame = geometry.crop_frame(frame)
+            if grayscale:
+                with profile_stage('grayscale', frame.nbytes):
+                    frame, _ = to_grayscale(frame)
+            elif frame.ndim == 3:
+                frame = cv.cvtColor(frame, cv.COLOR_BGR2RGB)
             if (frame.shape[1], frame.shape[0]) != frame_size:
-                frame = cv.resize(frame, frame_size)
-                rescaled_videos_id.append(row.video_id)
+                with profile_stage('resize', frame.nbytes):
+                    frame = geometry.resize(frame, frame_size)
+            frames[frame_number] = frame
+        frame_number += 1
 
-            # Save the frame as an image
-            output_path = os.path.join(dataset_dir, f"{video_id}_max_constriction.png")
-            save_image(frame, output_path)
+        while pending and pending[0][3] <= frame_number:
+            clip = make_clip(*pending.pop(0), frame_number)
+            if clip is not None:
+                yield clip
+        # Frames before every remaining window are no longer needed
+        first_needed = min((max(start, 0) for _, _, start, _ in pending), default=frame_number)
+        for n in [n for n in frames if n < first_needed]:
+            del frames[n]
 
-        else:
-            logging.error(f"Frame not found for video ID: {video_id} at frame number: {frame_number}")
+    cap.release()
+    # Windows past the end of the video (or of what could be decoded)
+    for window in pending:
+        clip = make_clip(*window, frame_number)
+        if clip is not None:
+            yield clip
 
-    logging.info(f"{len(rescaled_videos_id)} videos needed to be resized to {frame_size[0]}x{frame_size[1]}: {rescaled_videos_id}")
+def process_video(video_path, dataset_dir, frame_size=(512, 512), start_frame=0, end_frame=None, progress_queue=None, sink=None, label=None, sampler=None, cache_dir=None, skip_existing=False, grayscale=False, encoder=None, describe_outputs=False, pipeline_workers=0, queue_depth=32, geometry=None, collect_stats=False, decoder=None):
+    """
+    Save every frame of a video, or of a frame range of it, as an image.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        dataset_dir (str): Directory where the images will be saved.
+        frame_size (tuple): Size of the output images (width, height).
+        start_frame (int): First frame to process.
+        end_frame (int): Frame to stop at (exclusive). If None, processes until the end of the video.
+        progress_queue (multiprocessing.Queue): If given, progress is reported by putting frame
+            counts on this queue instead of showing a per-video progress bar.
+        sink (DirectorySink | ZipSink | QueueSink): If given, the encoded images are written to
+            this sink instead of `dataset_dir`.
+        label (int): Label of the video, passed to the sink with every frame.
+        sampler (FrameSampler): If given, only the frames it keeps are saved. It must be
+            a sampler for this video (see `FrameSampler.for_video`).
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
+        skip_existing (bool): Whether to skip encoding the frames whose image already exists in
+            `dataset_dir`, e.g. when resuming a build.
+        grayscale (bool): Whether to convert the frames to single-channel grayscale right after
+            decoding, so the rest of the pipeline handles a third of the bytes, and save `L` mode images.
+        encoder (ImageEncoder): If given, the encoder used for the images instead of PIL's default PNG.
+        describe_outputs (bool): Whether to also return the frame number, size and SHA-1 of every image,
+            for the frame catalog.
+        pipeline_workers (int): If positive, the frames are resized and encoded on this many threads
+            while this thread keeps decoding, and written by a writer thread (see `FramePipeline`).
+            Images are still written in frame order.
+        queue_depth (int): Capacity of the queues between the pipeline stages.
+        geometry (FrameGeometry): Crop and resize policy for this video (see `FrameGeometry.for_video`).
+            If None, frames are stretched to `frame_size`.
+        collect_stats (bool): Whether to accumulate the statistics of the written images (see `DatasetStats`),
+            on the writer thread with `pipeline_workers`.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`. The ffmpeg backend
+            decodes straight to grayscale with `grayscale`, and scales to `frame_size` when the geometry
+            neither crops nor keeps the aspect ratio.
 
-def process_video(video_path, dataset_dir, frame_size=(512, 512)):
+    Returns:
+        dict: The video ID, the number of frames kept and dropped, the names of the kept images,
+            with `describe_outputs` their (frame, name, size, hash) catalog rows, with
+            `pipeline_workers` the depths of the pipeline queues, and with `collect_stats` the statistics.
+    """
     videos_id = os.path.splitext(os.path.basename(video_path))[0]
-    cap = cv.VideoCapture(video_path)
-    if not cap.isOpened():
+    geometry = (geometry or FrameGeometry()).for_video(video_path)
+    # The decoder can only scale when the whole frame is stretched to the output size
+    decode_size = frame_size if geometry.crop is None and geometry.resize_mode == 'stretch' else None
+    cap = open_video_at(video_path, start_frame, cache_dir, decoder, grayscale, decode_size, geometry.interpolation)
+    if cap is None:
         logging.error(f"Error: Could not open video {video_path}.")
-        return 
+        return {'video_id': videos_id, 'kept': 0, 'dropped': 0, 'outputs': [], 'catalog': [], 'queue_depths': None, 'stats': None}
     
-    total_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
-    frame_count = 0
+    if end_frame is not None:
+        total_frames = end_frame
+    else:
+        index = get_video_index(video_path)
+        total_frames = index['frame_count'] if index is not None else int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    frame_count = start_frame
     
-    with tqdm(total=total_frames, desc=f"- Processing {videos_id}", leave=False) as pbar:
-        while True:
-            ret, frame = cap.read()
+    pbar = None
+    if progress_queue is None:
+        pbar = tqdm(total=total_frames - start_frame, desc=f"- Processing {videos_id}", leave=False)
+    pending = 0
+
+    outputs = []
+    catalog_rows = []
+    lossy_frames = 0
+    extension = encoder.extension if encoder is not None else '.png'
+    stats = DatasetStats() if collect_stats else None
+
+    def transform(item):
+        frame_idx, frame = item
+        # Resize the frame if necessary
+        if (frame.shape[1], frame.shape[0]) != frame_size:
+            with profile_stage('resize', frame.nbytes):
+                frame = geometry.resize(frame, frame_size)
+        output_name = f"{videos_id}_frame_{frame_idx}{extension}"
+        return frame_idx, output_name, encode_frame(frame, output_name, dataset_dir, sink, encoder, skip_existing), frame
+
+    def write(item):
+        frame_idx, output_name, data, frame = item
+        if stats is not None:
+            # On the writer thread, so the accumulator is never shared
+            with profile_stage('stats', frame.nbytes):
+                stats.add(frame, videos_id, frame_idx)
+        # Save the frame as an image
+        size, content_hash = write_encoded_frame(data, output_name, dataset_dir, sink, label, describe_outputs)
+        outputs.append(output_name)
+        if describe_outputs:
+            catalog_rows.append((frame_idx, output_name, size, content_hash))
+
+    pipeline = None
+    if pipeline_workers > 0:
+        pipeline = FramePipeline(transform, write, pipeline_workers, queue_depth)
+
+    try:
+        while end_frame is None or frame_count < end_frame:
+            if sampler is not None and not sampler.wants(frame_count):
+                # Skipped frames are grabbed but never converted to an array
+                with profile_stage('grab'):
+                    ret, frame = cap.grab(), None
+                if ret:
+                    sampler.skip()
+            else:
+                with profile_stage('decode') as stage:
+                    ret, frame = cap.read()
+                    stage.nbytes = frame.nbytes if ret else 0
             if not ret:
                 break
-            
-            # Resize the frame if necessary
-            if (frame.shape[1], frame.shape[0]) != frame_size:
-                frame = cv.resize(frame, frame_size)
 
-            # Save the frame as an image
-            output_path = os.path.join(dataset_dir, f"{videos_id}_frame_{frame_count}.png")
-            save_image(frame, output_path)
+            if frame is not None:
+                # Crop first, so the borders never go through the rest of the pipeline
+                frame = geometry.crop_frame(frame)
+
+            if frame is not None and grayscale:
+                with profile_stage('grayscale', frame.nbytes):
+                    frame, lossless = to_grayscale(frame)
+                lossy_frames += not lossless
+
+            if frame is not None and sampler is not None:
+                with profile_stage('dedup'):
+                    duplicate = sampler.is_duplicate(frame)
+                if duplicate:
+                    frame = None
+
+            if frame is not None:
+                if pipeline is not None:
+                    pipeline.put((frame_count, frame))
+                else:
+                    write(transform((frame_count, frame)))
             frame_count += 1
-            pbar.update(1)
+
+            if pbar is not None:
+                pbar.update(1)
+            else:
+                # Batch the updates to keep the inter-process traffic low
+                pending += 1
+                if pending == PROGRESS_BATCH:
+                    with profile_stage('queue_put'):
+                        progress_queue.put(pending)
+                    pending = 0
+    finally:
+        if pipeline is not None:
+            # Waits for the queued frames to be written
+            pipeline.close()
+
+    if pbar is not None:
+        pbar.close()
+    elif pending:
+        progress_queue.put(pending)
     
     cap.release()
+    if lossy_frames:
+        logging.warning(f"{lossy_frames} frames of video {videos_id} are not gray, the grayscale conversion loses color information.")
+    kept = len(outputs)
+    return {
+        'video_id': videos_id, 'kept': kept, 'dropped': frame_count - start_frame - kept, 'outputs': outputs, 'catalog': catalog_rows,
+        'queue_depths': pipeline.queue_depths() if pipeline is not None else None, 'stats': stats,
+    }
+
+def write_frame(frame, output_name, dataset_dir, sink=None, label=None, encoder=None, skip_existing=False, describe=False):
+    """
+    Encode a frame and write it to the sink, or to `dataset_dir`.
+
+    Parameters:
+        frame (numpy.ndarray): The frame, in BGR or single-channel grayscale.
+        output_name (str): Name of the image.
+        dataset_dir (str): Directory where the image is saved when there is no sink.
+        sink (DirectorySink | ZipSink | QueueSink): If given, the encoded image is written to this sink.
+        label (int): Label passed to the sink.
+        encoder (ImageEncoder): If given, the encoder used instead of PIL's default PNG.
+        skip_existing (bool): Whether to keep an image that already exists in `dataset_dir`.
+        describe (bool): Whether to compute the size and SHA-1 of the encoded image.
+
+    Returns:
+        tuple: The size and SHA-1 of the encoded image with `describe`, else (None, None).
+    """
+    data = encode_frame(frame, output_name, dataset_dir, sink, encoder, skip_existing)
+    return write_encoded_frame(data, output_name, dataset_dir, sink, label, describe)
 
-def create_all_frames_dataset(videos_dir, dataset_dir, frame_size=(512, 512)):
+def encode_frame(frame, output_name, dataset_dir, sink=None, encoder=None, skip_existing=False):
+    """
+    Encode a frame for `write_encoded_frame`, the first half of `write_frame`.
+
+    Returns:
+        bytes: The encoded image, or None if `skip_existing` is set and the image already exists in `dataset_dir`.
+    """
+    if sink is None and skip_existing and os.path.exists(os.path.join(dataset_dir, output_name)):
+        return None
+    return encode_image(frame, encoder=encoder)
+
+def write_encoded_frame(data, output_name, dataset_dir, sink=None, label=None, describe=False):
+    """
+    Write an image encoded by `encode_frame` to the sink, or to `dataset_dir`, the second half of `write_frame`.
+
+    Returns:
+        tuple: The size and SHA-1 of the image with `describe`, else (None, None).
+    """
+    output_path = os.path.join(dataset_dir, output_name)
+    if data is None:
+        # The existing image is kept
+        if not describe:
+            return None, None
+        with open(output_path, 'rb') as f:
+            data = f.read()
+    elif sink is not None:
+        sink.write(output_name, data, label)
+    else:
+        with profile_stage('write', len(data)):
+            # An interrupted build must not leave a truncated image that skip_existing keeps
+            write_file_atomic(output_path, data)
+
+    if not describe:
+        return None, None
+    return len(data), hashlib.sha1(data).hexdigest()
+
+def open_video_at(video_path, start_frame=0, cache_dir=None, decoder=None, grayscale=False, frame_size=None, interpolation='linear'):
+    """
+    Open a video positioned at the given frame.
+
+    The capture is seeked from the nearest keyframe of the video's seek index.
+    Without an index, OpenCV's seek is used, and if the capture does not end up
+    at `start_frame` the video is reopened and decoded forward instead.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        start_frame (int): Frame the next `read()` should return.
+        cache_dir (str): If given, the video is read through the decoded frame cache in this directory.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`.
+        grayscale, frame_size, interpolation: Output hints for the decoder (see `VideoDecoder.open`).
+
+    Returns:
+        cv.VideoCapture: The positioned capture, or None if the video could not be opened.
+    """
+    if cache_dir is not None:
+        video_id = os.path.splitext(os.path.basename(video_path))[0]
+        # Nothing is evicted while a build runs, other workers may have the entries mapped (see `evict_frame_cache`)
+        cap = open_cached_capture(video_id, os.path.join(os.path.dirname(video_path), ''), cache_dir, max_bytes=None)
+        if cap is not None:
+            cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+        return cap
+
+    if decoder is not None and decoder.backend != 'opencv':
+        cap = decoder.open(video_path, grayscale, frame_size, interpolation)
+        if not cap.isOpened():
+            return None
+        # Exact seek, see VideoDecoder.seek_index
+        if start_frame > 0:
+            cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+        return cap
+
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+    if start_frame <= 0:
+        return cap
+
+    index = get_video_index(video_path)
+    if index is not None:
+        seek_to_frame(cap, start_frame, index)
+        return cap
+
+    cap.set(cv.CAP_PROP_POS_FRAMES, start_frame)
+    if int(cap.get(cv.CAP_PROP_POS_FRAMES)) == start_frame:
+        return cap
+
+    cap.release()
+    cap = cv.VideoCapture(video_path)
+    for _ in range(start_frame):
+        if not cap.grab():
+            break
+    return cap
+
+def split_video_in_chunks(video_path, chunk_size, frame_count=None):
+    """
+    Split a video into frame ranges of at most `chunk_size` frames.
+
+    The frame count may be too low (e.g. the `CAP_PROP_FRAME_COUNT` fallback of a
+    bad header), so the last range has no end and is read to the end of the
+    video, like a whole video is by the thread executor.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        chunk_size (int): Maximum number of frames per range.
+        frame_count (int): Frame count of the video, e.g. from the video probe. If None, it is read
+            from the seek index.
+
+    Returns:
+        list: List of (start_frame, end_frame, expected_frames) tuples, end_frame is None for the last one.
+    """
+    index = get_video_index(video_path) if frame_count is None else None
+    if frame_count is not None:
+        total_frames = frame_count
+    elif index is not None:
+        total_frames = index['frame_count']
+    else:
+        cap = cv.VideoCapture(video_path)
+        total_frames = int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+    if total_frames <= 0:
+        # Unknown length, process the whole video in one go
+        return [(0, None, 0)]
+    starts = list(range(0, total_frames, chunk_size))
+    return [
+        (start, start + chunk_size if start != starts[-1] else None, min(chunk_size, total_frames - start))
+        for start in starts
+    ]
+
+def _drain_worker_queue(worker_queue, pbar, sink=None):
+    """
+    Consume the messages of the worker processes until a None is received.
+
+    Integers are frame counts forwarded to the parent progress bar, and
+    (name, data, label) tuples are encoded images appended to `sink`.
+    """
+    while True:
+        with profile_stage('queue_get'):
+            message = worker_queue.get()
+        if message is None:
+            break
+        if isinstance(message, int):
+            pbar.update(message)
+        else:
+            sink.write(*message)
+
+def _init_worker(worker_queue, profile=False):
+    """
+    Make the parent's queue available to the tasks of a worker process, and start profiling if the parent does.
+    """
+    global _worker_queue
+    _worker_queue = worker_queue
+    if profile:
+        enable_profiling()
+
+def _process_video_chunk(video_path, dataset_dir, frame_size, start_frame, end_frame, use_sink, video_kwargs):
+    """
+    Process a frame range of a video inside a worker process.
+    """
+    sink = QueueSink(_worker_queue) if use_sink else None
+    result = process_video(
+        video_path, dataset_dir, frame_size, start_frame, end_frame,
+        progress_queue=_worker_queue, sink=sink, **video_kwargs
+    )
+    profiler = get_profiler()
+    if profiler is not None:
+        # Sent back with the result, merged by the parent
+        result['profile'] = profiler.snapshot()
+    return result
+
+def log_sampling_summary(results):
+    """
+    Log how many frames each video kept and dropped, adding up the results of its chunks.
+
+    Parameters:
+        results (list): Dicts returned by `process_video`.
+    """
+    summary = {}
+    for result in results:
+        kept, dropped = summary.get(result['video_id'], (0, 0))
+        summary[result['video_id']] = (kept + result['kept'], dropped + result['dropped'])
+
+    for video_id, (kept, dropped) in sorted(summary.items()):
+        logging.info(f"Video {video_id}: kept {kept} frames, dropped {dropped}.")
+    total_kept = sum(kept for kept, _ in summary.values())
+    total_dropped = sum(dropped for _, dropped in summary.values())
+    logging.info(f"Kept {total_kept} frames and dropped {total_dropped} from {len(summary)} videos.")
+
+def log_queue_depths(results):
+    """
+    Log the mean and max depth of every pipeline queue over all the videos, to tune `queue_depth` and `pipeline_workers`.
+
+    A decoded queue that stays full means the transform workers are the bottleneck, an encoded
+    queue that stays full means the writer is, and queues that stay empty mean the decoder is.
+
+    Parameters:
+        results (list): Dicts returned by `process_video`.
+    """
+    depths = [result['queue_depths'] for result in results if result.get('queue_depths')]
+    if not depths:
+        return
+    for name in depths[0]:
+        mean = sum(d[name]['mean'] for d in depths) / len(depths)
+        peak = max(d[name]['max'] for d in depths)
+        logging.info(f"Pipeline {name} queue: mean depth {mean:.1f}, max {peak} of {depths[0][name]['capacity']}.")
+
+def create_all_frames_dataset(videos_dir, dataset_dir, frame_size=(512, 512), executor_type='thread', workers=None, chunk_size=1000, sink=None, labels=None, sampler=None, focus_frames=None, cache_dir=None, manifest=None, grayscale=False, encoder=None, catalog=None, pipeline_workers=0, queue_depth=32, geometry=None, stats=None, probe=None, decoder=None):
     """
     Create a dataset of all frames from videos.
 
     Parameters:
         videos_dir (str): Directory where the videos are stored.
         dataset_dir (str): Directory where the images will be saved.
+        frame_size (tuple): Size of the output images (width, height).
+        executor_type (str): 'thread' to process one video per thread, or 'process' to split
+            the videos in frame ranges and process them on a pool of processes.
+        workers (int): Number of workers. If None, uses the executor default.
+        chunk_size (int): Maximum number of frames per task when using the process executor.
+        sink (DirectorySink | ZipSink): If given, the encoded images are written to this sink
+            instead of `dataset_dir`. With the process executor, only the parent process writes to it.
+        labels (dict): Optional mapping from video ID to the label passed to the sink with its frames.
+        sampler (FrameSampler): If given, the policy used to drop near-duplicate frames and subsample videos.
+        focus_frames (dict): Optional mapping from video ID to the frames the sampler samples
+            more densely around (e.g. `frame_max_constricao`).
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
+        manifest (BuildManifest): If given, the build is incremental: only new or changed videos are
+            processed, the images of a video interrupted with the same settings are not re-encoded, and
+            the images of removed videos are deleted.
+        grayscale (bool): Whether to convert the frames to single-channel grayscale right after
+            decoding and save `L` mode images.
+        encoder (ImageEncoder): If given, the encoder used for the images instead of PIL's default PNG.
+        catalog (FrameCatalog): If given, every written image is recorded in this frame catalog.
+        pipeline_workers (int): If positive, every video (or chunk) is decoded on its own thread while
+            this many threads resize and encode its frames (see `process_video`).
+        queue_depth (int): Capacity of the queues between the pipeline stages.
+        geometry (FrameGeometry): Crop and resize policy. With `auto_crop`, the crop box of every
+            video is detected (or read from its cache) before the videos are dispatched.
+        stats (DatasetStats): If given, the statistics of every written image are merged into it,
+            from the accumulator of every video or chunk.
+        probe (VideoProbe): If given, unreadable videos are skipped up front, the focus frames are checked
+            against the frame counts, the longest videos are processed first and the progress is in frames.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture` (see `process_video`).
 
     Returns:
         None
     """
-    os.makedirs(dataset_dir, exist_ok=True)
-    video_files = [f for f in os.listdir(videos_dir) if f.endswith('.avi')]
-    video_paths = [os.path.join(videos_dir, f) for f in video_files]
+    if sink is None:
+        os.makedirs(dataset_dir, exist_ok=True)
+    labels_requested = labels is not None
+    labels = labels or {}
+    focus_frames = focus_frames or {}
 
-    overall_progress = tqdm(total=len(video_paths), desc="Processing videos", position=0)
+    frame_counts = None
+    if probe is not None:
+        for video_id, entry in probe.videos.items():
+            if entry['error'] is not None:
+                logging.error(f"Video {video_id}: {entry['error']}, skipping it.")
+        for video_id, frame_numbers in focus_frames.items():
+            frame_count = probe.frame_count(video_id)
+            out_of_range = [int(f) for f in frame_numbers if not math.isnan(f) and not 0 <= f < frame_count]
+            if out_of_range and probe.get(video_id) is not None:
+                logging.warning(f"Video {video_id}: frame_max_constricao {out_of_range} out of range, the video has {frame_count} frames.")
+        # Longest videos first, so a long one does not start last and leave the other workers idle
+        video_paths = [probe.get_path(video_id) for video_id in probe.readable_ids()]
+        frame_counts = {probe.get_path(video_id): probe.frame_count(video_id) for video_id in probe.readable_ids()}
+    else:
+        video_files = [f for f in os.listdir(videos_dir) if f.endswith('.avi')]
+        video_paths = [os.path.join(videos_dir, f) for f in video_files]
+    video_ids = {video_path: os.path.splitext(os.path.basename(video_path))[0] for video_path in video_paths}
+    if labels_requested and video_ids and not any(video_id in labels for video_id in video_ids.values()):
+        logging.warning(f"None of the {len(video_ids)} videos has a label, the dataset is written without labels.")
 
-    with ThreadPoolExecutor() as executor:
-        # Use ThreadPoolExecutor to process videos concurrently
-        # For each video file, submit a task to process it. 
-        futures = []
-        for idx, video_path in enumerate(video_paths):
-            futures.append(executor.submit(process_video, video_path, dataset_dir, frame_size))
+    # What each video's outputs depend on, besides the source file and the settings
+    label_rows = {
+        video_path: {'label': labels.get(video_id), 'focus_frames': focus_frames.get(video_id, [])}
+        for video_path, video_id in video_ids.items()
+    }
 
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                logging.error(f"Error processing video: {e}")
-            finally:
-                overall_progress.update(1)
-        
+    if catalog is not None:
+        catalog.prune(video_ids.values())
+    resumed = set()
+    if manifest is not None:
+        manifest.prune(video_ids.values(), ALL_FRAMES_OUTPUT_PATTERN)
+        up_to_date = [p for p in video_paths if manifest.is_up_to_date(video_ids[p], p, label_rows[p])]
+        video_paths = [p for p in video_paths if p not in up_to_date]
+        for video_path in video_paths:
+            video_id = video_ids[video_path]
+            if manifest.can_resume(video_id, video_path, label_rows[video_path]):
+                # Interrupted with the same settings, the images it already wrote are kept
+                resumed.add(video_path)
+                continue
+            # Outputs of a previous version of the video, or of an interrupted build with other settings
+            manifest.forget(video_id, ALL_FRAMES_OUTPUT_PATTERN)
+            manifest.mark_started(video_id, video_path, label_rows[video_path])
+        logging.info(f"{len(up_to_date)} videos are up to date, processing {len(video_paths)} new or changed videos ({len(resumed)} resumed).")
+
+    video_kwargs = {
+        video_path: {
+            'label': labels.get(video_id),
+            'sampler': sampler.for_video(focus_frames.get(video_id, ())) if sampler is not None else None,
+            'cache_dir': cache_dir,
+            'skip_existing': video_path in resumed,
+            'grayscale': grayscale,
+            'encoder': encoder,
+            'describe_outputs': catalog is not None,
+            'pipeline_workers': pipeline_workers,
+            'queue_depth': queue_depth,
+            'geometry': geometry.for_video(video_path) if geometry is not None else None,
+            'collect_stats': stats is not None,
+            'decoder': decoder,
+        }
+        for video_path, video_id in video_ids.items()
+        if video_path in video_paths
+    }
+
+    def on_video_done(video_path, video_results):
+        if manifest is not None:
+            outputs = [name for result in video_results for name in result['outputs']]
+            manifest.mark_done(video_ids[video_path], video_path, outputs, label_rows[video_path])
+        if catalog is not None:
+            catalog.add_frames(video_ids[video_path], [row for result in video_results for row in result['catalog']])
+
+    results = []
+    if executor_type == 'process':
+        if cache_dir is not None:
+            # Once per video, the chunks of a cold video would all decode it at the same time
+            failed = fill_cache(video_paths, cache_dir, workers)
+            if failed:
+                logging.error(f"{failed} videos could not be decoded into the frame cache.")
+        results = _create_all_frames_dataset_processes(video_paths, dataset_dir, frame_size, workers, chunk_size, sink, video_kwargs, on_video_done, stats, frame_counts)
+    else:
+        if frame_counts is not None:
+            overall_progress = tqdm(total=sum(frame_counts[p] for p in video_paths), desc="Processing videos", unit="frame", position=0)
+        else:
+            overall_progress = tqdm(total=len(video_paths), desc="Processing videos", position=0)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Use ThreadPoolExecutor to process videos concurrently
+            # For each video file, submit a task to process it. 
+            futures = {}
+            for idx, video_path in enumerate(video_paths):
+                future = executor.submit(process_video, video_path, dataset_dir, frame_size, sink=sink, **video_kwargs[video_path])
+                futures[future] = video_path
+
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                    if stats is not None:
+                        stats.merge(result.pop('stats'))
+                    results.append(result)
+                    on_video_done(futures[future], [result])
+                except Exception as e:
+                    logging.error(f"Error processing video: {e}")
+                finally:
+                    overall_progress.update(frame_counts[futures[future]] if frame_counts is not None else 1)
+        overall_progress.close()
+
+    if cache_dir is not None:
+        evict_frame_cache(cache_dir)
+
+    log_sampling_summary(results)
+    if pipeline_workers > 0:
+        log_queue_depths(results)
     logging.info(f"All frames from videos in {videos_dir} have been saved to {dataset_dir}.")
+
+def evict_frame_cache(cache_dir, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Bring the frame cache back under its size limit once a build is done.
+
+    Builds open the cache without evicting (see `open_video_at`), because an
+    entry evicted by one worker may still be mapped by another.
+    """
+    freed = evict_cache(cache_dir, max_bytes)
+    if freed:
+        logging.info(f"Freed {freed / 1024 ** 3:.1f} GB of the frame cache.")
+
+def _create_all_frames_dataset_processes(video_paths, dataset_dir, frame_size, workers, chunk_size, sink, video_kwargs, on_video_done, stats=None, frame_counts=None):
+    """
+    Process the videos in frame range chunks on a process pool, reporting frame progress to a single bar.
+
+    `on_video_done(video_path, results)` is called with the results of all the chunks of a video, once they all succeeded.
+    The statistics of every chunk are merged into `stats` as soon as it is done, so only one accumulator is kept.
+    `frame_counts` maps video paths to their probed frame count, used instead of the seek index to split them.
+
+    Returns:
+        list: The results of `process_video` for every chunk.
+    """
+    tasks = []
+    for video_path in video_paths:
+        frame_count = frame_counts.get(video_path) if frame_counts is not None else None
+        for start_frame, end_frame, expected_frames in split_video_in_chunks(video_path, chunk_size, frame_count):
+            tasks.append((video_path, start_frame, end_frame, expected_frames))
+
+    # Longest chunks first, so the pool does not wait on a big one at the end
+    tasks.sort(key=lambda t: t[3], reverse=True)
+    total_frames = sum(expected_frames for _, _, _, expected_frames in tasks)
+
+    # Chunks left and results so far of every video, failed videos are removed
+    pending_chunks = {}
+    for video_path, _, _, _ in tasks:
+        pending_chunks[video_path] = pending_chunks.get(video_path, 0) + 1
+    video_results = {video_path: [] for video_path in pending_chunks}
+
+    # Workers send progress and encoded images back on this queue
+    worker_queue = multiprocessing.Queue(maxsize=1024)
+    overall_progress = tqdm(total=total_frames, desc="Processing frames", unit="frame", position=0)
+    drain_thread = threading.Thread(target=_drain_worker_queue, args=(worker_queue, overall_progress, sink), daemon=True)
+    drain_thread.start()
+
+    results = []
+    try:
+        profiler = get_profiler()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(worker_queue, profiler is not None)) as executor:
+            futures = {
+                executor.submit(
+                    _process_video_chunk, video_path, dataset_dir, frame_size, start_frame, end_frame,
+                    sink is not None, video_kwargs[video_path]
+                ): video_path
+                for video_path, start_frame, end_frame, _ in tasks
+            }
+
+            for future in as_completed(futures):
+                video_path = futures[future]
+                try:
+                    result = future.result()
+                    if profiler is not None:
+                        profiler.merge(result.pop('profile', None))
+                    if stats is not None:
+                        stats.merge(result.pop('stats'))
+                    results.append(result)
+                    if video_path in video_results:
+                        video_results[video_path].append(result)
+                        pending_chunks[video_path] -= 1
+                        if pending_chunks[video_path] == 0:
+                            on_video_done(video_path, video_results.pop(video_path))
+                except Exception as e:
+                    logging.error(f"Error processing video {video_path}: {e}")
+                    video_results.pop(video_path, None)
+    finally:
+        worker_queue.put(None)
+        drain_thread.join()
+        overall_progress.close()
+
+    return results
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import threading
+import zipfile
+from .profiling import profile_stage
+from .utils import write_file_atomic
+
+
+class DirectorySink:
+    """
+    Write encoded images as loose files in a directory.
+    """
+    def __init__(self, dataset_dir):
+        self.dataset_dir = dataset_dir
+        os.makedirs(dataset_dir, exist_ok=True)
+
+    def write(self, name, data, label=None):
+        """
+        Write the encoded image `data` as `name` inside the dataset directory. Labels are ignored.
+        """
+        with profile_stage('write', len(data)):
+            write_file_atomic(os.path.join(self.dataset_dir, name), data)
+
+    def close(self):
+        pass
+
+
+class ZipSink:
+    """
+    Write encoded images straight into a StyleGAN-compatible dataset ZIP.
+
+    The archive follows the layout of `stylegan3/dataset_tool.py`: images are
+    stored uncompressed as `NNNNN/imgNNNNNNNN.<ext>` and a `dataset.json` with the
+    labels is written on close. The original name of every image is kept in the
+    `sources` entry of `dataset.json`. Writes are serialized with a lock, so the
+    sink can be shared by several threads.
+    """
+    def __init__(self, zip_path, compression=zipfile.ZIP_STORED):
+        self.zip_path = zip_path
+        self.zip = zipfile.ZipFile(zip_path, mode='w', compression=compression)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.labels = []
+        self.sources = {}
+
+    def write(self, name, data, label=None):
+        """
+        Append the encoded image `data` to the archive.
+
+        Parameters:
+            name (str): Original name of the image, e.g. `{video_id}_frame_{n}.png`.
+            data (bytes): The encoded image.
+            label (int): Optional class label of the image.
+        """
+        ext = os.path.splitext(name)[1]
+        with profile_stage('sink_wait'):
+            self.lock.acquire()
+        try:
+            idx_str = f'{self.count:08d}'
+            archive_name = f'{idx_str[:5]}/img{idx_str}{ext}'
+            with profile_stage('write', len(data)):
+                self.zip.writestr(archive_name, data)
+            self.labels.append([archive_name, None if label is None else int(label)])
+            self.sources[archive_name] = name
+            self.count += 1
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """
+        Write `dataset.json` and close the archive.
+        """
+        with self.lock:
+            labels = self.labels
+            if all(label is None for _, label in labels):
+                labels = None
+            elif any(label is None for _, label in labels):
+                missing = sum(label is None for _, label in labels)
+                logging.warning(f"{missing} images in {self.zip_path} have no label. Writing the dataset without labels.")
+                labels = None
+
+            metadata = {'labels': labels, 'sources': self.sources}
+            self.zip.writestr('dataset.json', json.dumps(metadata))
+            self.zip.close()
+        logging.info(f"Wrote {self.count} images to {self.zip_path}")
+
+
+class QueueSink:
+    """
+    Forward encoded images to a queue, so a single writer in the parent process can append them.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, name, data, label=None):
+        # Memoryviews returned by the encoders cannot be pickled
+        data = bytes(data)
+        with profile_stage('queue_put', len(data)):
+            self.queue.put((name, data, label))
+
+    def close(self):
+        pass
@@ -0,0 +1,161 @@
+import logging
+import numpy as np
+
+
+class DatasetStats:
+    """
+    Streaming statistics of the frames written to a dataset, accumulated while they are in memory.
+
+    It holds the per-pixel mean and variance of the frames, a 256-bin intensity
+    histogram per video (the global one is their sum) and the mean brightness
+    of every frame, by video and frame number, which shows when the contrast
+    arrives. The per-pixel moments are updated with Welford's algorithm in
+    float64, so they stay accurate over hundreds of thousands of frames. Color
+    frames are accumulated in RGB order, the order of the dataset images, and
+    the file records it as `channel_order`.
+
+    Accumulators are mergeable (Chan et al.'s pairwise update), so every worker,
+    process or shard keeps its own and they are combined with `merge`, in any order.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self.histograms = {}
+        self.brightness = {}
+
+    def add(self, frame, video_id, frame_number):
+        """
+        Add a uint8 frame, in BGR (as decoded by OpenCV) or single-channel grayscale.
+        """
+        video_id = str(video_id)
+        if frame.ndim == 3:
+            # Same channel order as the images of the dataset
+            frame = frame[..., ::-1]
+        if video_id not in self.histograms:
+            self.histograms[video_id] = np.zeros(256, dtype=np.int64)
+            self.brightness[video_id] = {}
+        self.histograms[video_id] += np.bincount(frame.ravel(), minlength=256)[:256]
+        self.brightness[video_id][int(frame_number)] = float(frame.mean())
+
+        if self.mean is None:
+            self.mean = np.zeros(frame.shape, dtype=np.float64)
+            self.m2 = np.zeros(frame.shape, dtype=np.float64)
+        elif frame.shape != self.mean.shape:
+            raise ValueError(f"Frame {frame_number} of video {video_id} has shape {frame.shape}, expected {self.mean.shape}")
+
+        self.count += 1
+        delta = frame - self.mean
+        self.mean += delta / self.count
+        # M2 += (x - old mean) * (x - new mean)
+        delta *= frame - self.mean
+        self.m2 += delta
+
+    def merge(self, other):
+        """
+        Add the statistics of another accumulator, e.g. the one of a worker, to this one.
+        """
+        if other is None or other.count == 0:
+            return self
+        for video_id, histogram in other.histograms.items():
+            if video_id in self.histograms:
+                self.histograms[video_id] += histogram
+                self.brightness[video_id].update(other.brightness[video_id])
+            else:
+                self.histograms[video_id] = histogram.copy()
+                self.brightness[video_id] = dict(other.brightness[video_id])
+
+        if other.mean is not None:
+            if self.mean is None:
+                self.mean = other.mean.copy()
+                self.m2 = other.m2.copy()
+            elif other.mean.shape != self.mean.shape:
+                raise ValueError(f"Cannot merge statistics of frames of shape {other.mean.shape} into {self.mean.shape}")
+            else:
+                total = self.count + other.count
+                delta = other.mean - self.mean
+                self.mean += delta * (other.count / total)
+                self.m2 += other.m2 + delta ** 2 * (self.count * other.count / total)
+        self.count += other.count
+        return self
+
+    @property
+    def std(self):
+        """
+        The per-pixel standard deviation of the frames.
+        """
+        if self.mean is None or self.count == 0:
+            return None
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def channel_order(self):
+        """
+        The channel order of `mean` and `std`: 'RGB', or 'gray' for single-channel frames.
+        """
+        if self.mean is None:
+            return None
+        return 'RGB' if self.mean.ndim == 3 else 'gray'
+
+    @property
+    def histogram(self):
+        """
+        The intensity histogram of all the frames.
+        """
+        return sum(self.histograms.values(), np.zeros(256, dtype=np.int64))
+
+    def brightness_series(self, video_id):
+        """
+        Get the mean brightness of the frames of a video.
+
+        Returns:
+            tuple: The frame numbers and their mean brightness, as numpy arrays sorted by frame.
+        """
+        series = self.brightness.get(str(video_id), {})
+        frames = np.array(sorted(series), dtype=np.int64)
+        return frames, np.array([series[f] for f in frames], dtype=np.float64)
+
+    def save(self, path):
+        """
+        Save the statistics to an `.npz` file, which `load` reads back (e.g. to merge shards).
+        """
+        video_ids = sorted(self.histograms)
+        series = [self.brightness_series(video_id) for video_id in video_ids]
+        arrays = {
+            'count': np.array(self.count),
+            'video_ids': np.array(video_ids, dtype=str),
+            'histograms': np.stack([self.histograms[v] for v in video_ids]) if video_ids else np.zeros((0, 256), dtype=np.int64),
+            'histogram': self.histogram,
+            # Series of all the videos, concatenated
+            'brightness_lengths': np.array([len(frames) for frames, _ in series], dtype=np.int64),
+            'brightness_frames': np.concatenate([frames for frames, _ in series]) if series else np.zeros(0, dtype=np.int64),
+            'brightness_values': np.concatenate([values for _, values in series]) if series else np.zeros(0),
+        }
+        if self.mean is not None:
+            arrays.update({'mean': self.mean, 'm2': self.m2, 'std': self.std, 'channel_order': np.array(self.channel_order)})
+        np.savez(path, **arrays)
+        logging.info(f"Dataset statistics of {self.count} frames saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load statistics saved with `save`.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            stats = cls()
+            stats.count = int(data['count'])
+            if 'mean' in data:
+                stats.mean = data['mean']
+                stats.m2 = data['m2']
+                if stats.mean.ndim == 3 and 'channel_order' not in data:
+                    # Saved before the moments were accumulated in RGB order
+                    stats.mean = stats.mean[..., ::-1].copy()
+                    stats.m2 = stats.m2[..., ::-1].copy()
+            offsets = np.cumsum(np.concatenate([[0], data['brightness_lengths']]))
+            for i, video_id in enumerate(data['video_ids']):
+                video_id = str(video_id)
+                stats.histograms[video_id] = data['histograms'][i]
+                frames = data['brightness_frames'][offsets[i]:offsets[i + 1]]
+                values = data['brightness_values'][offsets[i]:offsets[i + 1]]
+                stats.brightness[video_id] = dict(zip(frames.tolist(), values.tolist()))
+        return stats
@@ -0,0 +1,167 @@
+import logging
+import cv2 as cv
+import numpy as np
+from .video_index import get_video_index
+
+# ffmpeg scaler for each FrameGeometry interpolation
+SCALE_FLAGS = {
+    'nearest': 'neighbor',
+    'linear': 'bilinear',
+    'cubic': 'bicubic',
+    'area': 'area',
+    'lanczos': 'lanczos',
+}
+
+PIX_FMTS = ('bgr24', 'rgb24', 'gray')
+
+# Number of frames ffmpeg seeks before the target, the frames in between are decoded and dropped
+SEEK_MARGIN = 2
+
+
+class FFmpegCapture:
+    """
+    A `cv.VideoCapture` look-alike that decodes with the ffmpeg binary of `imageio-ffmpeg`.
+
+    ffmpeg decodes with codec-level threads (`threads`, 0 lets ffmpeg choose),
+    converts to the requested pixel format and can scale the frames to
+    `frame_size` itself, so the frames arrive in their final format and size
+    and no conversion or resize is left to do in Python. Frames are piped as raw
+    bytes and returned as read-only arrays.
+
+    Only the calls used in this repo are supported, like `CachedCapture`:
+    `isOpened`, `read`, `grab`, `retrieve`, `set`/`get` of the frame position and
+    `get` of the frame count, fps and size. Seeking restarts ffmpeg at the
+    keyframe before the target, unless the target is a few frames ahead, and
+    ffmpeg drops the frames whose index, computed from their timestamp, is
+    before the target, so rounding of the seek time never shifts the frames.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        pix_fmt (str): Output pixel format, one of `PIX_FMTS`. 'bgr24' gives the same frames as OpenCV.
+        frame_size (tuple): If given, frames are scaled to this (width, height) by ffmpeg.
+        threads (int): Number of decoder threads, 0 for ffmpeg's default.
+        interpolation (str): Scaler used with `frame_size`, a key of `SCALE_FLAGS`.
+    """
+    def __init__(self, video_path, pix_fmt='bgr24', frame_size=None, threads=0, interpolation='linear'):
+        if pix_fmt not in PIX_FMTS:
+            raise ValueError(f"Unknown pixel format {pix_fmt}, expected one of {PIX_FMTS}")
+        self.video_path = video_path
+        self.pix_fmt = pix_fmt
+        self.frame_size = tuple(frame_size) if frame_size is not None else None
+        self.threads = threads
+        self.interpolation = interpolation
+        self.reader = None
+        self.buffer = None
+        self.pos = 0
+        self.fps = None
+        self.size = None
+        self.duration = None
+
+        index = get_video_index(video_path)
+        self.frame_count = index['frame_count'] if index is not None else None
+        self.opened = self._start(0)
+
+    def _start(self, frame_number):
+        # Optional dependency, only needed for the ffmpeg decoder
+        import imageio_ffmpeg
+
+        self._stop()
+        input_params = ['-threads', str(self.threads)]
+        filters = []
+        if frame_number > 0:
+            # Seek before the target, to the previous keyframe, and keep the frames from the target on.
+            # Timestamps start at the seek time, so the target is frame `skip` from it.
+            seek_frame = max(frame_number - SEEK_MARGIN, 0)
+            skip = frame_number - seek_frame
+            input_params += ['-noaccurate_seek', '-ss', f"{seek_frame / self.fps:.6f}"]
+            filters.append(f"select=gte(floor(t*{self.fps}+0.5)\\,{skip})")
+        if self.frame_size is not None:
+            width, height = self.frame_size
+            filters.append(f"scale={width}:{height}:flags={SCALE_FLAGS[self.interpolation]}")
+        # Passthrough, so the dropped frames are not replaced by duplicates
+        output_params = ['-vsync', 'passthrough']
+        if filters:
+            output_params += ['-vf', ','.join(filters)]
+
+        try:
+            # Without bits_per_pixel, imageio-ffmpeg assumes 24 bits and would return 3 gray frames per chunk
+            self.reader = imageio_ffmpeg.read_frames(
+                self.video_path, pix_fmt=self.pix_fmt, bits_per_pixel=8 if self.pix_fmt == 'gray' else 24,
+                input_params=input_params, output_params=output_params
+            )
+            meta = next(self.reader)
+        except (OSError, RuntimeError, StopIteration) as e:
+            logging.error(f"Error: Could not open video {self.video_path} with ffmpeg: {e}")
+            self.reader = None
+            return False
+
+        self.fps = meta['fps']
+        self.size = meta['size']
+        self.duration = meta.get('duration')
+        self.buffer = None
+        self.pos = frame_number
+        return True
+
+    def _stop(self):
+        if self.reader is not None:
+            # Closing the generator terminates ffmpeg
+            self.reader.close()
+            self.reader = None
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if self.reader is None:
+            return False
+        try:
+            self.buffer = next(self.reader)
+        except StopIteration:
+            self.buffer = None
+            self._stop()
+            return False
+        self.pos += 1
+        return True
+
+    def retrieve(self):
+        if self.buffer is None:
+            return False, None
+        width, height = self.size
+        shape = (height, width) if self.pix_fmt == 'gray' else (height, width, 3)
+        return True, np.frombuffer(self.buffer, dtype=np.uint8).reshape(shape)
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop, value):
+        if prop != cv.CAP_PROP_POS_FRAMES or not self.opened:
+            return False
+        frame_number = max(int(value), 0)
+        if self.reader is not None and 0 <= frame_number - self.pos <= 16:
+            # Cheaper to read on than to restart ffmpeg
+            while self.pos < frame_number:
+                if not self.grab():
+                    return False
+            return True
+        return self._start(frame_number)
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return float(self.pos)
+        if prop == cv.CAP_PROP_FRAME_COUNT:
+            if self.frame_count is not None:
+                return float(self.frame_count)
+            return float(round(self.duration * self.fps)) if self.duration and self.fps else 0.0
+        if prop == cv.CAP_PROP_FPS:
+            return self.fps or 0.0
+        if prop == cv.CAP_PROP_FRAME_WIDTH:
+            return float(self.size[0]) if self.size else 0.0
+        if prop == cv.CAP_PROP_FRAME_HEIGHT:
+            return float(self.size[1]) if self.size else 0.0
+        return 0.0
+
+    def release(self):
+        self._stop()
+        self.opened = False
@@ -0,0 +1,260 @@
+import threading
+import cv2 as cv
+from .video_index import seek_to_frame
+
+
+class PrefetchingFrameBuffer:
+    """
+    Ring buffer of decoded frames around a playhead, filled by a background decoder thread.
+
+    The decoder reads forward from the playhead up to `ahead` frames, and the
+    last `behind` frames are kept so stepping backwards does not need a seek.
+    The capture is only seeked when a requested frame is outside of that
+    window, from its nearest keyframe if a seek index is given. Only the decoder
+    thread touches the capture.
+
+    Parameters:
+        cap (cv.VideoCapture): An opened capture, positioned at the first frame to buffer.
+        ahead (int): Number of frames decoded ahead of the playhead.
+        behind (int): Number of frames kept behind the playhead.
+        index (dict): The seek index of the video (see `get_video_index`).
+        start_frame (int): The frame the capture is positioned at. If None, it is read from the capture.
+    """
+    def __init__(self, cap, ahead=64, behind=128, index=None, start_frame=None):
+        self.cap = cap
+        self.index = index
+        self.ahead = ahead
+        self.behind = behind
+
+        self.frames = {}
+        self.playhead = start_frame if start_frame is not None else int(cap.get(cv.CAP_PROP_POS_FRAMES))
+        self.next_pos = self.playhead
+        self.seek_to = None
+        self.eof = False
+        self.stopped = False
+        self.hits = 0
+        self.misses = 0
+
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.thread.start()
+
+    def get(self, frame_idx):
+        """
+        Get a frame, waiting for the decoder if it is not buffered yet.
+
+        Parameters:
+            frame_idx (int): The frame number.
+
+        Returns:
+            frame (numpy.ndarray): The frame, shared with the buffer (copy it before drawing on it),
+                or None past the end of the video.
+        """
+        with self.cond:
+            self.playhead = frame_idx
+            self._trim()
+            self.cond.notify_all()
+
+            if frame_idx in self.frames:
+                self.hits += 1
+                return self.frames[frame_idx]
+
+            self.misses += 1
+            if self.eof and frame_idx >= self.next_pos:
+                return None
+            if not self.next_pos <= frame_idx < self.next_pos + self.ahead:
+                # Real jump, the decoder would not reach this frame soon
+                self.seek_to = frame_idx
+                self.eof = False
+                self.cond.notify_all()
+
+            while frame_idx not in self.frames:
+                if self.eof and self.seek_to is None and frame_idx >= self.next_pos:
+                    return None
+                self.cond.wait()
+            return self.frames[frame_idx]
+
+    def close(self):
+        """
+        Stop the decoder thread. The capture is not released.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.thread.join()
+
+    def _trim(self):
+        low = self.playhead - self.behind
+        high = self.playhead + self.ahead
+        for idx in [idx for idx in self.frames if idx < low or idx > high]:
+            del self.frames[idx]
+
+    def _decode_loop(self):
+        while True:
+            with self.cond:
+                while not self.stopped and self.seek_to is None and (self.eof or self.next_pos > self.playhead + self.ahead):
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                seek = self.seek_to is not None
+                target = self.seek_to if seek else self.next_pos
+                self.seek_to = None
+
+            # Decode outside of the lock, so the player keeps displaying meanwhile
+            if seek:
+                seek_to_frame(self.cap, target, self.index)
+            ret, frame = self.cap.read()
+
+            with self.cond:
+                if self.seek_to is not None:
+                    # A newer seek arrived while decoding, this frame is not needed
+                    continue
+                if ret:
+                    self.frames[target] = frame
+                    self.next_pos = target + 1
+                else:
+                    self.eof = True
+                    self.next_pos = target
+                self._trim()
+                self.cond.notify_all()
+
+
+class PooledFrameBuffer:
+    """
+    Frame buffer like `PrefetchingFrameBuffer`, filled by tasks on a shared thread pool instead of a thread of its own.
+
+    Several buffers, e.g. the tiles of the grid player, share one pool, so N
+    videos are decoded by a fixed number of threads instead of N threads
+    competing for the cores. A buffer has at most one decode task in flight; it
+    decodes up to `batch` frames ahead of the playhead and then resubmits
+    itself, so the buffers take turns on the pool and a capture is only used by
+    one thread at a time. Every frame goes through `transform` (e.g. a downscale
+    to the tile size) on the pool thread, so only small frames reach the player.
+
+    Unlike `PrefetchingFrameBuffer.get`, `get` does not wait by default: a frame
+    that is not decoded yet is returned as None, so the player keeps its clock.
+
+    Parameters:
+        cap (cv.VideoCapture): An opened capture, positioned at `start_frame`.
+        executor (ThreadPoolExecutor): The shared pool.
+        index (dict): The seek index of the video (see `get_video_index`).
+        start_frame (int): The frame the capture is positioned at.
+        ahead (int): Number of frames decoded ahead of the playhead.
+        behind (int): Number of frames kept behind the playhead.
+        transform (callable): Function applied to every decoded frame.
+        batch (int): Number of frames decoded by a task before it yields the pool to the other buffers.
+    """
+    def __init__(self, cap, executor, index=None, start_frame=0, ahead=32, behind=64, transform=None, batch=4):
+        self.cap = cap
+        self.executor = executor
+        self.index = index
+        self.ahead = ahead
+        self.behind = behind
+        self.transform = transform
+        self.batch = batch
+
+        self.frames = {}
+        self.playhead = start_frame
+        self.next_pos = start_frame
+        self.seek_to = None
+        self.eof = False
+        self.stopped = False
+        self.in_flight = False
+        self.hits = 0
+        self.misses = 0
+
+        self.cond = threading.Condition()
+        with self.cond:
+            self._schedule()
+
+    def get(self, frame_idx, timeout=0):
+        """
+        Get a frame, moving the playhead to it.
+
+        Parameters:
+            frame_idx (int): The frame number.
+            timeout (float): How long to wait for a frame that is not decoded yet, in seconds.
+
+        Returns:
+            frame (numpy.ndarray): The transformed frame, shared with the buffer, or None if it is
+                not decoded yet or past the end of the video.
+        """
+        with self.cond:
+            self.playhead = frame_idx
+            self._trim()
+            if frame_idx in self.frames:
+                self.hits += 1
+                return self.frames[frame_idx]
+
+            self.misses += 1
+            if not (self.eof and frame_idx >= self.next_pos) and not self.next_pos <= frame_idx < self.next_pos + self.ahead:
+                # Real jump, the decoder would not reach this frame soon
+                self.seek_to = frame_idx
+                self.eof = False
+            self._schedule()
+
+            if timeout:
+                self.cond.wait_for(
+                    lambda: frame_idx in self.frames or (self.eof and self.seek_to is None and frame_idx >= self.next_pos),
+                    timeout
+                )
+            return self.frames.get(frame_idx)
+
+    def close(self):
+        """
+        Stop decoding, waiting for the task in flight. The capture is not released.
+        """
+        with self.cond:
+            self.stopped = True
+            self.cond.wait_for(lambda: not self.in_flight)
+
+    def _trim(self):
+        low = self.playhead - self.behind
+        high = self.playhead + self.ahead
+        for idx in [idx for idx in self.frames if idx < low or idx > high]:
+            del self.frames[idx]
+
+    def _needs_decoding(self):
+        return self.seek_to is not None or not (self.eof or self.next_pos > self.playhead + self.ahead)
+
+    def _schedule(self):
+        # Called with the lock held
+        if not self.stopped and not self.in_flight and self._needs_decoding():
+            self.in_flight = True
+            self.executor.submit(self._decode_batch)
+
+    def _decode_batch(self):
+        try:
+            for _ in range(self.batch):
+                with self.cond:
+                    if self.stopped or not self._needs_decoding():
+                        break
+                    seek = self.seek_to is not None
+                    target = self.seek_to if seek else self.next_pos
+                    self.seek_to = None
+
+                # Decode outside of the lock, so the player keeps reading the buffer meanwhile
+                if seek:
+                    seek_to_frame(self.cap, target, self.index)
+                ret, frame = self.cap.read()
+                if ret and self.transform is not None:
+                    frame = self.transform(frame)
+
+                with self.cond:
+                    if self.seek_to is not None:
+                        # A newer seek arrived while decoding, this frame is not needed
+                        continue
+                    if ret:
+                        self.frames[target] = frame
+                        self.next_pos = target + 1
+                    else:
+                        self.eof = True
+                        self.next_pos = target
+                    self._trim()
+                    self.cond.notify_all()
+        finally:
+            with self.cond:
+                self.in_flight = False
+                # Back to the end of the pool queue, after the other buffers
+                self._schedule()
+                self.cond.notify_all()
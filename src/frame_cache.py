@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+from .utils import get_video_path_from_id
+
+# Default location and size limit of the decoded frame cache
+DEFAULT_CACHE_DIR = 'data/cache/frames/'
+DEFAULT_MAX_CACHE_BYTES = 50 * 1024 ** 3
+
+
+def get_cached_frames(video_id, video_dir='data/videos/', cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Get all the decoded frames of a video as a read-only memory-mapped array.
+
+    The first call decodes the video into `{cache_dir}/{video_id}.raw`, a raw
+    uint8 array of shape (frames, height, width, channels), described by the
+    metadata file `{cache_dir}/{video_id}.json`. Later calls map that file, so
+    reading a frame is a pointer offset instead of a codec seek. The cache entry
+    is rebuilt when the size or mtime of the source video changes, and the least
+    recently used entries are evicted to keep the cache under `max_bytes`.
+
+    Parameters:
+        video_id (str): The ID of the video.
+        video_dir (str): The directory where the videos are stored.
+        cache_dir (str): The directory where the decoded frames are cached.
+        max_bytes (int): Maximum total size of the cache. If None, nothing is evicted.
+
+    Returns:
+        frames (numpy.memmap): The frames, indexed by frame number. None if the video could not be decoded.
+    """
+    video_path = get_video_path_from_id(video_id, video_dir)
+    raw_path, metadata_path = _cache_paths(video_id, cache_dir)
+
+    metadata = _read_metadata(metadata_path)
+    if metadata is None or not _is_fresh(metadata, video_path) or not os.path.exists(raw_path):
+        metadata = _decode_to_cache(video_path, raw_path, metadata_path)
+        if metadata is None:
+            return None
+        if max_bytes is not None:
+            evict_cache(cache_dir, max_bytes, keep=(str(video_id),))
+
+    # The metadata file mtime tracks the last access, for the LRU eviction
+    os.utime(metadata_path)
+
+    if metadata['frame_count'] == 0:
+        return np.empty(metadata['shape'], dtype=np.uint8)
+    return np.memmap(raw_path, dtype=np.uint8, mode='r', shape=tuple(metadata['shape']))
+
+
+def fill_cache(video_paths, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """
+    Decode the videos missing from the cache, one video per thread, without evicting anything.
+
+    The process executor of the dataset builder fills the cache before it
+    dispatches the chunks of the videos, so its workers do not all decode the
+    same cold video at once.
+
+    Parameters:
+        video_paths (list): Paths to the video files.
+        cache_dir (str): The directory where the decoded frames are cached.
+        workers (int): Number of videos decoded at once. OpenCV releases the GIL while decoding.
+
+    Returns:
+        int: Number of videos that could not be decoded.
+    """
+    def fill(video_path):
+        video_id = os.path.splitext(os.path.basename(video_path))[0]
+        return get_cached_frames(video_id, os.path.join(os.path.dirname(video_path), ''), cache_dir, max_bytes=None) is not None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(not filled for filled in executor.map(fill, video_paths))
+
+
+def get_cached_metadata(video_id, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Get the cache metadata of a video (shape, fps, source size and mtime), or None if it is not cached.
+    """
+    return _read_metadata(_cache_paths(video_id, cache_dir)[1])
+
+
+def evict_cache(cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_BYTES, keep=()):
+    """
+    Delete the least recently used cache entries until the cache is under `max_bytes`.
+
+    Parameters:
+        cache_dir (str): The directory where the decoded frames are cached.
+        max_bytes (int): Maximum total size of the cache.
+        keep (tuple): Video IDs that must not be evicted.
+
+    Returns:
+        int: Number of bytes freed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.json'):
+            continue
+        video_id = filename[:-len('.json')]
+        raw_path, metadata_path = _cache_paths(video_id, cache_dir)
+        size = os.path.getsize(raw_path) if os.path.exists(raw_path) else 0
+        entries.append((os.path.getmtime(metadata_path), video_id, size, raw_path, metadata_path))
+
+    total = sum(entry[2] for entry in entries)
+    freed = 0
+    for _, video_id, size, raw_path, metadata_path in sorted(entries):
+        if total - freed <= max_bytes:
+            break
+        if video_id in keep:
+            continue
+        # Remove the metadata first, so a half deleted entry is never considered valid
+        os.remove(metadata_path)
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        freed += size
+        logging.info(f"Evicted video {video_id} from the frame cache ({size / 1024 ** 2:.1f} MB).")
+    return freed
+
+
+def _cache_paths(video_id, cache_dir):
+    return os.path.join(cache_dir, f"{video_id}.raw"), os.path.join(cache_dir, f"{video_id}.json")
+
+
+def _read_metadata(metadata_path):
+    try:
+        with open(metadata_path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _is_fresh(metadata, video_path):
+    stat = os.stat(video_path)
+    return metadata['source_size'] == stat.st_size and metadata['source_mtime'] == stat.st_mtime
+
+
+def _decode_to_cache(video_path, raw_path, metadata_path):
+    """
+    Decode a video into a raw frame file and write its metadata. The metadata is written last, so it marks a complete entry.
+    """
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error(f"Error: Could not open video {video_path}.")
+        return None
+
+    os.makedirs(os.path.dirname(raw_path) or '.', exist_ok=True)
+    stat = os.stat(video_path)
+    fps = cap.get(cv.CAP_PROP_FPS)
+
+    # Write to a temporary file, so concurrent builders never see a partial file
+    tmp_path = f"{raw_path}.{os.getpid()}.tmp"
+    frame_count = 0
+    frame_shape = None
+    with open(tmp_path, 'wb') as f:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_shape = frame.shape
+            f.write(np.ascontiguousarray(frame).data)
+            frame_count += 1
+    cap.release()
+
+    if frame_shape is None:
+        frame_shape = (0, 0, 3)
+    os.replace(tmp_path, raw_path)
+
+    metadata = {
+        'source_path': video_path,
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'fps': fps,
+        'frame_count': frame_count,
+        'shape': [frame_count, *frame_shape],
+        'dtype': 'uint8',
+    }
+    tmp_metadata_path = f"{metadata_path}.{os.getpid()}.tmp"
+    with open(tmp_metadata_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp_metadata_path, metadata_path)
+
+    logging.info(f"Cached {frame_count} frames of {video_path} in {raw_path}.")
+    return metadata
+
+
+class CachedCapture:
+    """
+    A `cv.VideoCapture` look-alike that reads frames from the frame cache.
+
+    Only the calls used in this repo are supported: `isOpened`, `read`, `grab`,
+    `retrieve`, `set`/`get` of the frame position and `get` of the frame count,
+    fps and size. Frames are read-only views of the memory-mapped cache.
+    """
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+        self.pos = 0
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        if self.pos >= len(self.frames):
+            return False
+        self.pos += 1
+        return True
+
+    def retrieve(self):
+        if self.pos == 0:
+            return False, None
+        return True, self.frames[self.pos - 1]
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def set(self, prop, value):
+        if prop != cv.CAP_PROP_POS_FRAMES:
+            return False
+        self.pos = min(max(int(value), 0), len(self.frames))
+        return True
+
+    def get(self, prop):
+        if prop == cv.CAP_PROP_POS_FRAMES:
+            return float(self.pos)
+        if prop == cv.CAP_PROP_FRAME_COUNT:
+            return float(len(self.frames))
+        if prop == cv.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv.CAP_PROP_FRAME_WIDTH:
+            return float(self.frames.shape[2])
+        if prop == cv.CAP_PROP_FRAME_HEIGHT:
+            return float(self.frames.shape[1])
+        return 0.0
+
+    def release(self):
+        pass
+
+
+def open_cached_capture(video_id, video_dir='data/videos/', cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+    """
+    Open a video through the frame cache, decoding it first if needed.
+
+    Returns:
+        CachedCapture: The capture, or None if the video could not be decoded.
+    """
+    frames = get_cached_frames(video_id, video_dir, cache_dir, max_bytes)
+    if frames is None:
+        return None
+    metadata = get_cached_metadata(video_id, cache_dir)
+    return CachedCapture(frames, metadata['fps'])
@@ -0,0 +1,164 @@
+import logging
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+# Label columns joined to every frame of a video
+CATALOG_LABEL_COLUMNS = ['pas_score', 'frame_max_constricao', 'frame_repouso', 'pas_frame']
+
+
+class FrameCatalog:
+    """
+    SQLite catalog of the frames written by a dataset build, one row per frame.
+
+    Every row holds the video ID, frame number, output path (relative to the
+    dataset directory, or the original name for ZIP datasets, see the `sources`
+    entry of `dataset.json`), size and SHA-1 of the encoded image, the label
+    columns of the video and the distance to `frame_max_constricao`. Rows are
+    indexed by (video_id, frame), so filtering, splits and per-video stats no
+    longer need to list and parse the dataset directory.
+
+    Parameters:
+        path (str): Path to the SQLite file, e.g. `<dataset_dir>/catalog.sqlite`.
+        df_labels (pd.DataFrame): Optional labels (see `read_video_labels_df`) joined to the frames.
+    """
+    def __init__(self, path, df_labels=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.video_labels = {}
+        if df_labels is not None:
+            columns = [c for c in CATALOG_LABEL_COLUMNS if c in df_labels.columns]
+            for video_id, row in df_labels.groupby('video_id').first()[columns].iterrows():
+                self.video_labels[str(video_id)] = {c: (None if pd.isna(row[c]) else float(row[c])) for c in columns}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS frames (
+                video_id TEXT NOT NULL,
+                frame INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER,
+                hash TEXT,
+                pas_score REAL,
+                frame_max_constricao INTEGER,
+                frame_repouso INTEGER,
+                pas_frame INTEGER,
+                distance_to_max_constricao INTEGER,
+                PRIMARY KEY (video_id, frame, path)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS frames_video_frame ON frames (video_id, frame)")
+        self.conn.commit()
+
+    def add_frames(self, video_id, frames):
+        """
+        Replace the catalog rows of a video.
+
+        Parameters:
+            video_id (str): The ID of the video.
+            frames (list): (frame, path, size, hash) tuples, one per written image.
+        """
+        video_id = str(video_id)
+        labels = self.video_labels.get(video_id, {})
+        max_constricao = labels.get('frame_max_constricao')
+        rows = [
+            (
+                video_id, frame, path, size, content_hash,
+                labels.get('pas_score'),
+                _to_int(max_constricao),
+                _to_int(labels.get('frame_repouso')),
+                _to_int(labels.get('pas_frame')),
+                frame - int(max_constricao) if max_constricao is not None else None,
+            )
+            for frame, path, size, content_hash in frames
+        ]
+        with self.lock:
+            self.conn.execute("DELETE FROM frames WHERE video_id = ?", (video_id,))
+            self.conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def prune(self, video_ids):
+        """
+        Delete the rows of the videos that are not in `video_ids`.
+        """
+        video_ids = set(str(video_id) for video_id in video_ids)
+        with self.lock:
+            cataloged = [row[0] for row in self.conn.execute("SELECT DISTINCT video_id FROM frames")]
+            removed = [video_id for video_id in cataloged if video_id not in video_ids]
+            self.conn.executemany("DELETE FROM frames WHERE video_id = ?", [(v,) for v in removed])
+            self.conn.commit()
+        return removed
+
+    def query(self, where=None, params=()):
+        """
+        Get the catalog rows as a DataFrame, optionally filtered by an SQL `where` clause.
+
+        Example:
+            catalog.query("video_id = ? AND abs(distance_to_max_constricao) <= ?", ('12', 5))
+        """
+        sql = "SELECT * FROM frames"
+        if where is not None:
+            sql += f" WHERE {where}"
+        sql += " ORDER BY video_id, frame"
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+    def video_stats(self):
+        """
+        Get per-video stats: number of frames, first and last frame, total bytes and labels.
+        """
+        sql = """
+            SELECT video_id, COUNT(*) AS frames, MIN(frame) AS first_frame, MAX(frame) AS last_frame,
+                SUM(size) AS bytes, MAX(pas_score) AS pas_score, MAX(frame_max_constricao) AS frame_max_constricao
+            FROM frames GROUP BY video_id ORDER BY video_id
+        """
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn)
+
+    def stratified_split(self, by='pas_score', test_size=0.2, seed=0):
+        """
+        Split the frames in train and test sets by video, stratified by a label column.
+
+        Whole videos go to one side, so frames of the same study never end up in both sets.
+
+        Parameters:
+            by (str): Label column to stratify on.
+            test_size (float): Fraction of the videos of each stratum in the test set.
+            seed (int): Seed of the shuffle.
+
+        Returns:
+            tuple: The train and test frames, as DataFrames.
+        """
+        frames = self.query()
+        videos = frames.groupby('video_id')[by].first().fillna(-1)
+        rng = np.random.default_rng(seed)
+
+        test_videos = set()
+        for _, stratum in videos.groupby(videos):
+            video_ids = stratum.index.to_numpy()
+            rng.shuffle(video_ids)
+            n_test = int(round(len(video_ids) * test_size))
+            test_videos.update(video_ids[:n_test])
+
+        is_test = frames['video_id'].isin(test_videos)
+        logging.info(f"Split {len(videos)} videos in {len(videos) - len(test_videos)} train and {len(test_videos)} test videos.")
+        return frames[~is_test].reset_index(drop=True), frames[is_test].reset_index(drop=True)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_catalog_path(dataset_dir):
+    """
+    Get the path of the frame catalog of a dataset: inside the dataset directory, or next to the ZIP.
+    """
+    if dataset_dir.endswith('.zip'):
+        return f"{os.path.splitext(dataset_dir)[0]}.catalog.sqlite"
+    return os.path.join(dataset_dir, 'catalog.sqlite')
+
+
+def _to_int(value):
+    return None if value is None else int(value)
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import cv2 as cv
+import numpy as np
+from .video_index import get_video_index, seek_to_frame
+
+# OpenCV interpolation flag for each --interpolation choice
+INTERPOLATIONS = {
+    'nearest': cv.INTER_NEAREST,
+    'linear': cv.INTER_LINEAR,
+    'cubic': cv.INTER_CUBIC,
+    'area': cv.INTER_AREA,
+    'lanczos': cv.INTER_LANCZOS4,
+}
+
+RESIZE_MODES = ('stretch', 'letterbox', 'center_crop')
+
+
+class FrameGeometry:
+    """
+    Crop and resize policy applied to the frames of a dataset.
+
+    Frames are first cropped to a region of interest, either a fixed
+    `(x, y, width, height)` box or one detected per video (see
+    `detect_crop_box`), right after decoding, so the black borders and scanner
+    overlays never go through the rest of the pipeline. Cropping is a view, it
+    copies nothing. The crop is then resized to the output size by stretching
+    it (the historical behaviour), by letterboxing it into black bars, or by
+    cropping its center to the output aspect ratio.
+
+    A geometry with `auto_crop` holds the crop box of one video; use `for_video` to get one for a video.
+
+    Parameters:
+        crop (tuple): Fixed (x, y, width, height) crop box, in source pixels.
+        auto_crop (bool): Whether to detect the crop box of every video. Ignored if `crop` is given.
+        resize_mode (str): One of `RESIZE_MODES`.
+        interpolation (str): Key of `INTERPOLATIONS`.
+    """
+    def __init__(self, crop=None, auto_crop=False, resize_mode='stretch', interpolation='linear'):
+        if resize_mode not in RESIZE_MODES:
+            raise ValueError(f"Unknown resize mode {resize_mode}, expected one of {RESIZE_MODES}")
+        self.crop = tuple(int(v) for v in crop) if crop is not None else None
+        self.auto_crop = auto_crop and crop is None
+        self.resize_mode = resize_mode
+        self.interpolation = interpolation
+        self.interpolation_flag = INTERPOLATIONS[interpolation]
+
+    def for_video(self, video_path):
+        """
+        Return a geometry with the same policy and the crop box of the given video, detecting it if needed.
+        """
+        if not self.auto_crop:
+            return self
+        return FrameGeometry(get_crop_box(video_path), False, self.resize_mode, self.interpolation)
+
+    def crop_frame(self, frame):
+        """
+        Crop a frame to the crop box, clipped to the frame. Returns a view.
+        """
+        if self.crop is None:
+            return frame
+        x, y, width, height = self.crop
+        return frame[max(y, 0):y + height, max(x, 0):x + width]
+
+    def resize(self, frame, frame_size):
+        """
+        Resize a (cropped) frame to `frame_size` (width, height) with the resize mode.
+        Frames that already have the output size are returned as they are.
+        """
+        width, height = frame_size
+        src_height, src_width = frame.shape[:2]
+        if (src_width, src_height) == (width, height):
+            return frame
+
+        if self.resize_mode == 'center_crop':
+            # Crop to the output aspect ratio first, so only the kept pixels are resized
+            scale = max(width / src_width, height / src_height)
+            crop_width = min(src_width, round(width / scale))
+            crop_height = min(src_height, round(height / scale))
+            x = (src_width - crop_width) // 2
+            y = (src_height - crop_height) // 2
+            return cv.resize(frame[y:y + crop_height, x:x + crop_width], frame_size, interpolation=self.interpolation_flag)
+
+        if self.resize_mode == 'letterbox':
+            scale = min(width / src_width, height / src_height)
+            new_width = max(1, min(width, round(src_width * scale)))
+            new_height = max(1, min(height, round(src_height * scale)))
+            resized = cv.resize(frame, (new_width, new_height), interpolation=self.interpolation_flag)
+            left = (width - new_width) // 2
+            top = (height - new_height) // 2
+            return cv.copyMakeBorder(
+                resized, top, height - new_height - top, left, width - new_width - left,
+                cv.BORDER_CONSTANT, value=0
+            )
+
+        return cv.resize(frame, frame_size, interpolation=self.interpolation_flag)
+
+    def settings(self):
+        """
+        The policy as a JSON-serializable dict, e.g. for the build manifest.
+        """
+        return {'crop': self.crop, 'auto_crop': self.auto_crop, 'resize_mode': self.resize_mode, 'interpolation': self.interpolation}
+
+
+def get_crop_path(video_path):
+    """
+    Get the path of the cached crop box of a video, e.g. `data/videos/1.crop.json`.
+    """
+    return f"{os.path.splitext(video_path)[0]}.crop.json"
+
+
+def get_crop_box(video_path, refresh=False):
+    """
+    Get the detected crop box of a video, detecting it if it is not cached or the video changed.
+
+    The box is cached next to the video, like the seek index, and is detected
+    again when the size or mtime of the video changes.
+
+    Returns:
+        tuple: The (x, y, width, height) crop box, or None if the video could not be read.
+    """
+    crop_path = get_crop_path(video_path)
+    stat = os.stat(video_path)
+
+    if not refresh and os.path.exists(crop_path):
+        try:
+            with open(crop_path, 'r') as f:
+                cached = json.load(f)
+            if cached['source_size'] == stat.st_size and cached['source_mtime'] == stat.st_mtime:
+                return tuple(cached['crop']) if cached['crop'] is not None else None
+        except (OSError, json.JSONDecodeError, KeyError):
+            pass
+
+    crop = detect_crop_box(video_path)
+    tmp_path = f"{crop_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'crop': crop, 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}, f)
+        os.replace(tmp_path, crop_path)
+    except OSError as e:
+        # e.g. a read-only videos directory, the detected box is still used
+        logging.warning(f"Could not cache the crop box of {video_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return crop
+
+
+def detect_crop_box(video_path, samples=8, black_threshold=16, noise_threshold=1.0, min_fraction=0.05, min_area=0.25):
+    """
+    Detect the region of a fluoroscopy video that holds the anatomy.
+
+    A few frames spread over the video are sampled. A pixel is part of the
+    image when it is not black on average and it changes between the samples:
+    fluoroscopy is noisy, while the black borders and the burned-in overlays
+    (text, scales, logos) are identical in every frame. The box is the range of
+    rows and columns where at least `min_fraction` of the pixels are image.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        samples (int): Number of frames sampled.
+        black_threshold (int): Mean gray level under which a pixel is border.
+        noise_threshold (float): Standard deviation over the samples under which a pixel is static.
+        min_fraction (float): Fraction of image pixels for a row or column to be kept.
+        min_area (float): If the detected box covers less than this fraction of the frame,
+            the detection is considered failed and the whole frame is used.
+
+    Returns:
+        tuple: The (x, y, width, height) crop box, or None if the video could not be read.
+    """
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error(f"Error: Could not open video {video_path}.")
+        return None
+
+    index = get_video_index(video_path)
+    frame_count = index['frame_count'] if index is not None else int(cap.get(cv.CAP_PROP_FRAME_COUNT))
+    gray_frames = []
+    for frame_number in np.linspace(0, max(frame_count - 1, 0), samples).astype(int):
+        seek_to_frame(cap, int(frame_number), index)
+        ret, frame = cap.read()
+        if ret:
+            gray_frames.append(cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame)
+    cap.release()
+    if not gray_frames:
+        return None
+
+    stack = np.stack(gray_frames).astype(np.float32)
+    height, width = stack.shape[1:]
+    full_frame = (0, 0, width, height)
+    if len(gray_frames) < 2:
+        return full_frame
+
+    image = (stack.mean(axis=0) > black_threshold) & (stack.std(axis=0) > noise_threshold)
+    rows = np.flatnonzero(image.mean(axis=1) >= min_fraction)
+    cols = np.flatnonzero(image.mean(axis=0) >= min_fraction)
+    if len(rows) == 0 or len(cols) == 0:
+        return full_frame
+
+    x, y = int(cols[0]), int(rows[0])
+    crop = (x, y, int(cols[-1]) + 1 - x, int(rows[-1]) + 1 - y)
+    if crop[2] * crop[3] < min_area * width * height:
+        logging.warning(f"Detected crop box {crop} of {video_path} is too small, using the whole frame.")
+        return full_frame
+    return crop
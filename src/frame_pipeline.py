@@ -0,0 +1,127 @@
+import queue
+import threading
+from .profiling import profile_stage
+
+
+class FramePipeline:
+    """
+    Pipeline that transforms items on a pool of threads and writes them, in order, on a writer thread.
+
+    The producer (e.g. the thread decoding a video) calls `put` for every item.
+    Items go through a bounded queue to `workers` threads running `transform`,
+    whose results go through a second bounded queue to a single writer thread
+    running `write`. The writer reorders the results, so `write` sees them in
+    the order they were put. At most `2 * queue_depth + workers` items are in
+    flight, counting the ones waiting to be reordered, so `put` blocks when the
+    downstream stages fall behind and memory stays capped.
+
+    OpenCV and the PNG encoders release the GIL, so the transform threads run
+    in parallel with the decoder and the writer.
+
+    Parameters:
+        transform (callable): Function applied to every item on the worker threads.
+        write (callable): Function called with every transformed item, in order, on the writer thread.
+        workers (int): Number of transform threads.
+        queue_depth (int): Capacity of each of the two queues.
+    """
+    def __init__(self, transform, write, workers=2, queue_depth=32):
+        self.transform = transform
+        self.write = write
+        self.queue_depth = queue_depth
+        self.inputs = queue.Queue(queue_depth)
+        self.outputs = queue.Queue(queue_depth)
+        self.in_flight = threading.BoundedSemaphore(2 * queue_depth + workers)
+        self.capacities = {'decoded': queue_depth, 'encoded': queue_depth, 'reorder': 2 * queue_depth + workers}
+        self.error = None
+        self.next_seq = 0
+
+        # (samples, sum, max) of the queue depths, sampled on every put
+        self.depth_stats = {'decoded': [0, 0, 0], 'encoded': [0, 0, 0], 'reorder': [0, 0, 0]}
+        self.stats_lock = threading.Lock()
+
+        self.workers = [threading.Thread(target=self._transform_loop, daemon=True) for _ in range(workers)]
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        for thread in self.workers + [self.writer]:
+            thread.start()
+
+    def put(self, item):
+        """
+        Queue an item, blocking while too many items are in flight.
+
+        Raises the error of a failed transform or write, if any.
+        """
+        if self.error is not None:
+            raise self.error
+        with profile_stage('pipeline_wait'):
+            self.in_flight.acquire()
+            self._sample('decoded', self.inputs.qsize())
+            self.inputs.put((self.next_seq, item))
+        self.next_seq += 1
+
+    def close(self):
+        """
+        Wait for every queued item to be written and stop the threads.
+
+        Raises the error of a failed transform or write, if any.
+        """
+        for _ in self.workers:
+            self.inputs.put(None)
+        for thread in self.workers:
+            thread.join()
+        self.outputs.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+
+    def queue_depths(self):
+        """
+        Get the capacity, mean and max depth of the decoded and encoded queues and of the reorder buffer.
+        """
+        with self.stats_lock:
+            return {
+                name: {'capacity': self.capacities[name], 'mean': total / samples if samples else 0.0, 'max': peak}
+                for name, (samples, total, peak) in self.depth_stats.items()
+            }
+
+    def _sample(self, name, depth):
+        with self.stats_lock:
+            stats = self.depth_stats[name]
+            stats[0] += 1
+            stats[1] += depth
+            stats[2] = max(stats[2], depth)
+
+    def _transform_loop(self):
+        while True:
+            entry = self.inputs.get()
+            if entry is None:
+                return
+            seq, item = entry
+            result = None
+            # After an error, items are only drained so the producer never blocks
+            if self.error is None:
+                try:
+                    result = self.transform(item)
+                except Exception as e:
+                    self.error = self.error or e
+            self._sample('encoded', self.outputs.qsize())
+            self.outputs.put((seq, result))
+
+    def _write_loop(self):
+        pending = {}
+        next_seq = 0
+        while True:
+            entry = self.outputs.get()
+            if entry is None:
+                return
+            seq, result = entry
+            pending[seq] = result
+            self._sample('reorder', len(pending))
+            while next_seq in pending:
+                result = pending.pop(next_seq)
+                if self.error is None:
+                    try:
+                        self.write(result)
+                    except Exception as e:
+                        self.error = e
+                next_seq += 1
+                self.in_flight.release()
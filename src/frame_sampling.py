@@ -0,0 +1,92 @@
+import cv2 as cv
+import numpy as np
+
+
+class FrameSampler:
+    """
+    Decide which frames of a video are kept in a dataset.
+
+    Frames are first selected by position: every `stride`-th frame, or every
+    `focus_stride`-th frame within `focus_window` frames of a focus frame (e.g.
+    `frame_max_constricao`). Selected frames are then compared with the last kept
+    frame using a small grayscale signature, and dropped when the mean absolute
+    difference is below `dedup_threshold`.
+
+    A sampler holds the state of one video; use `for_video` to get a fresh one.
+    """
+    def __init__(self, stride=1, dedup_threshold=None, signature_size=16, focus_frames=(), focus_window=0, focus_stride=1):
+        self.stride = max(1, stride)
+        self.dedup_threshold = dedup_threshold
+        self.signature_size = signature_size
+        self.focus_frames = sorted(int(f) for f in focus_frames)
+        self.focus_window = focus_window
+        self.focus_stride = max(1, focus_stride)
+
+        self.last_signature = None
+        self.kept = 0
+        self.dropped_stride = 0
+        self.dropped_duplicate = 0
+
+    def for_video(self, focus_frames=()):
+        """
+        Return a new sampler with the same policy and no state, for the given focus frames.
+        """
+        return FrameSampler(self.stride, self.dedup_threshold, self.signature_size, focus_frames, self.focus_window, self.focus_stride)
+
+    def in_focus(self, frame_idx):
+        """
+        Whether the frame is within `focus_window` frames of a focus frame.
+        """
+        return any(abs(frame_idx - f) <= self.focus_window for f in self.focus_frames)
+
+    def wants(self, frame_idx):
+        """
+        Whether the frame is selected by the stride policy. Frames that are not can be skipped without being decoded.
+        """
+        step = self.focus_stride if self.focus_frames and self.in_focus(frame_idx) else self.stride
+        return frame_idx % step == 0
+
+    def skip(self):
+        """
+        Record a frame dropped by the stride policy.
+        """
+        self.dropped_stride += 1
+
+    def is_duplicate(self, frame):
+        """
+        Whether the frame is a near duplicate of the last kept frame. Frames that are not become the new reference.
+        """
+        if self.dedup_threshold is None:
+            self.kept += 1
+            return False
+
+        signature = frame_signature(frame, self.signature_size)
+        if self.last_signature is not None:
+            difference = np.mean(np.abs(signature - self.last_signature))
+            if difference < self.dedup_threshold:
+                self.dropped_duplicate += 1
+                return True
+
+        self.last_signature = signature
+        self.kept += 1
+        return False
+
+    @property
+    def dropped(self):
+        return self.dropped_stride + self.dropped_duplicate
+
+
+def frame_signature(frame, size=16):
+    """
+    Compute a cheap signature of a frame: a `size`x`size` grayscale thumbnail.
+
+    Parameters:
+        frame (numpy.ndarray): The frame, in BGR or grayscale.
+        size (int): Side of the thumbnail.
+
+    Returns:
+        numpy.ndarray: The thumbnail as int16, so differences do not overflow.
+    """
+    if frame.ndim == 3:
+        frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return cv.resize(frame, (size, size), interpolation=cv.INTER_AREA).astype(np.int16)
@@ -1,26 +1,39 @@
+import io
+import os
 from PIL import Image
 import cv2 as cv
+import numpy as np
 import logging
-from .utils import get_video_path_from_id
+from .utils import get_video_path_from_id, write_file_atomic
+from .profiling import profile_stage
 
-def save_image(img, output_path, log=False):
+def save_image(img, output_path, log=False, encoder=None):
     """
     Save an image to the specified output path.
 
     Parameters:
-        img (numpy.ndarray): The image to save.
+        img (numpy.ndarray): The image to save, in BGR, or single-channel grayscale (saved as an `L` mode image).
         output_path (str): The path where the image will be saved.
         log (bool): Whether to log the saving action.
+        encoder (ImageEncoder): If given, the encoder used instead of PIL's default settings.
 
     Returns:
         None
     """
     if log:
         logging.info(f"Saving image to {output_path}")
-    
-    # Ensure the output directory exists
-    image = Image.fromarray(cv.cvtColor(img, cv.COLOR_BGR2RGB))
-    image.save(output_path)
+
+    if encoder is not None:
+        data = encode_image(img, encoder=encoder)
+    else:
+        # Encode in memory with the format PIL would pick from the extension, so encoding and writing are timed apart
+        format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+        if format is None:
+            raise ValueError(f"Unknown image extension: {output_path}")
+        data = encode_image(img, format)
+
+    with profile_stage('write', len(data)):
+        write_file_atomic(output_path, data)
     
 
 def get_video_frame(video_id, frame_number, video_dir='data/videos/'):
@@ -54,3 +67,131 @@ def get_video_frame(video_id, frame_number, video_dir='data/videos/'):
     else:
         print("Error: Could not read frame.")
         return None
+
+def encode_image(img, format='PNG', encoder=None):
+    """
+    Encode an image into bytes, the same way `save_image` writes it to disk.
+
+    Parameters:
+        img (numpy.ndarray): The image to encode, in BGR or single-channel grayscale.
+        format (str): The PIL image format.
+        encoder (ImageEncoder): If given, the encoder used instead of PIL's default settings.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    if encoder is not None:
+        with profile_stage('encode') as stage:
+            data = encoder.encode(img)
+            stage.nbytes = len(data)
+        return data
+
+    with profile_stage('color', img.nbytes):
+        image = to_pil_image(img)
+    with profile_stage('encode') as stage:
+        buffer = io.BytesIO()
+        image.save(buffer, format=format)
+        data = buffer.getvalue()
+        stage.nbytes = len(data)
+    return data
+
+def to_pil_image(img):
+    """
+    Convert a BGR or single-channel grayscale array to a PIL image (`RGB` or `L` mode).
+    """
+    if img.ndim == 2:
+        return Image.fromarray(img)
+    return Image.fromarray(cv.cvtColor(img, cv.COLOR_BGR2RGB))
+
+def to_grayscale(img):
+    """
+    Convert a BGR frame to a single-channel uint8 HxW array.
+
+    Parameters:
+        img (numpy.ndarray): The frame, in BGR. Single-channel frames are returned as they are.
+
+    Returns:
+        gray (numpy.ndarray): The grayscale frame.
+        lossless (bool): Whether the three channels were equal, i.e. the conversion lost no information.
+            For such frames the gray value is exactly the value of every channel.
+    """
+    if img.ndim == 2:
+        return img, True
+    lossless = bool(np.array_equal(img[..., 0], img[..., 1]) and np.array_equal(img[..., 1], img[..., 2]))
+    return cv.cvtColor(img, cv.COLOR_BGR2GRAY), lossless
+
+
+class ImageEncoder:
+    """
+    Encode frames to PNG or lossless WebP with a selectable backend.
+
+    Backends:
+        'opencv': `cv.imencode` on the BGR array directly, with no channel swap.
+        'pyspng': libspng through `pyspng`, usually the fastest PNG encoder.
+        'pil': PIL, as `save_image` does by default.
+
+    `encode` returns a bytes-like object (bytes, or a memoryview over the OpenCV
+    output buffer) that can be written to any sink without being copied.
+
+    Parameters:
+        backend (str): 'opencv', 'pyspng' or 'pil'.
+        format (str): 'png' or 'webp' (lossless). WebP is not supported by 'pyspng'.
+        compression (int): PNG compression level, 0 (fastest) to 9 (smallest). If None, uses the backend default.
+    """
+    BACKENDS = ('opencv', 'pyspng', 'pil')
+
+    def __init__(self, backend='opencv', format='png', compression=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown encoder backend: {backend}. Choose one of {self.BACKENDS}.")
+        if format not in ('png', 'webp'):
+            raise ValueError(f"Unknown image format: {format}. Choose 'png' or 'webp'.")
+        if backend == 'pyspng' and format != 'png':
+            raise ValueError("The pyspng backend only writes PNG.")
+        self.backend = backend
+        self.format = format
+        self.compression = compression
+
+    @property
+    def extension(self):
+        return f'.{self.format}'
+
+    def encode(self, img):
+        """
+        Encode a BGR or single-channel grayscale image.
+        """
+        if self.backend == 'opencv':
+            return self._encode_opencv(img)
+        if self.backend == 'pyspng':
+            return self._encode_pyspng(img)
+        return self._encode_pil(img)
+
+    def _encode_opencv(self, img):
+        if self.format == 'webp':
+            # A quality above 100 selects lossless WebP
+            params = [cv.IMWRITE_WEBP_QUALITY, 101]
+        else:
+            params = [cv.IMWRITE_PNG_COMPRESSION, self.compression] if self.compression is not None else []
+        ret, buffer = cv.imencode(self.extension, img, params)
+        if not ret:
+            raise ValueError(f"OpenCV could not encode the image as {self.format}.")
+        return buffer.reshape(-1).data
+
+    def _encode_pyspng(self, img):
+        # Optional dependency, only needed for this backend
+        import pyspng
+        if img.ndim == 3:
+            img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
+        if self.compression is not None:
+            return pyspng.encode(img, compress_level=self.compression)
+        return pyspng.encode(img)
+
+    def _encode_pil(self, img):
+        buffer = io.BytesIO()
+        image = to_pil_image(img)
+        if self.format == 'webp':
+            image.save(buffer, format='WEBP', lossless=True)
+        elif self.compression is not None:
+            image.save(buffer, format='PNG', compress_level=self.compression)
+        else:
+            image.save(buffer, format='PNG')
+        return buffer.getbuffer()
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Active profiler of this process, None when profiling is disabled
+_profiler = None
+
+
+class StageProfiler:
+    """
+    Accumulate the wall time, CPU time and bytes of the stages of a dataset build.
+
+    Stats are kept per worker (process and thread), and every stage run is also
+    recorded as a Chrome trace event, up to `max_events`, so the report can be
+    opened in `chrome://tracing` or Perfetto. Worker processes profile on their
+    own and send a snapshot back with their results, which the parent merges.
+
+    Parameters:
+        max_events (int): Maximum number of trace events kept. Stats are always accumulated.
+    """
+    def __init__(self, max_events=200000):
+        self.max_events = max_events
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.events = []
+        self.dropped_events = 0
+
+    def stage(self, name, nbytes=0):
+        """
+        Time a stage. Set `nbytes` on the returned object if the size is only known at the end.
+
+        Example:
+            with profiler.stage('encode') as stage:
+                data = encode_image(frame)
+                stage.nbytes = len(data)
+        """
+        return _Stage(self, name, nbytes)
+
+    def add(self, name, wall, cpu, nbytes=0, start=None):
+        """
+        Record a run of a stage that was timed elsewhere.
+
+        Parameters:
+            name (str): Name of the stage, e.g. 'decode'.
+            wall (float): Wall time, in seconds.
+            cpu (float): CPU time of the calling thread, in seconds.
+            nbytes (int): Number of bytes the stage produced or consumed.
+            start (float): Start time (`time.time()`) of the run, for the trace.
+        """
+        thread = threading.current_thread()
+        worker = f"{os.getpid()}/{thread.name}"
+        with self.lock:
+            stats = self.stats.setdefault(worker, {}).setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += wall
+            stats[2] += cpu
+            stats[3] += nbytes
+            if start is None:
+                return
+            if len(self.events) >= self.max_events:
+                self.dropped_events += 1
+                return
+            self.events.append({
+                'name': name, 'cat': 'stage', 'ph': 'X',
+                'ts': start * 1e6, 'dur': wall * 1e6,
+                'pid': os.getpid(), 'tid': thread.ident,
+                'args': {'bytes': nbytes},
+            })
+
+    def snapshot(self, reset=True):
+        """
+        Get the stats and events recorded so far, e.g. to send them from a worker process to the parent.
+        """
+        with self.lock:
+            snapshot = {'stats': self.stats, 'events': self.events, 'dropped_events': self.dropped_events}
+            if reset:
+                self.stats, self.events, self.dropped_events = {}, [], 0
+            return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add a snapshot of another profiler to this one.
+        """
+        if not snapshot:
+            return
+        with self.lock:
+            for worker, stages in snapshot['stats'].items():
+                for name, (count, wall, cpu, nbytes) in stages.items():
+                    stats = self.stats.setdefault(worker, {}).setdefault(name, [0, 0.0, 0.0, 0])
+                    stats[0] += count
+                    stats[1] += wall
+                    stats[2] += cpu
+                    stats[3] += nbytes
+            room = max(self.max_events - len(self.events), 0)
+            self.events += snapshot['events'][:room]
+            self.dropped_events += snapshot['dropped_events'] + max(len(snapshot['events']) - room, 0)
+
+    def stage_totals(self):
+        """
+        Get the stats of every stage summed over the workers.
+
+        Returns:
+            dict: Mapping from stage name to a dict with the count, wall and CPU seconds and bytes.
+        """
+        totals = {}
+        with self.lock:
+            for stages in self.stats.values():
+                for name, (count, wall, cpu, nbytes) in stages.items():
+                    total = totals.setdefault(name, {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'bytes': 0})
+                    total['count'] += count
+                    total['wall_s'] += wall
+                    total['cpu_s'] += cpu
+                    total['bytes'] += nbytes
+        return totals
+
+    def save(self, path, metadata=None):
+        """
+        Write the report: a Chrome trace JSON with the per-stage and per-worker stats as extra keys.
+        """
+        with self.lock:
+            workers = {
+                worker: {name: dict(zip(('count', 'wall_s', 'cpu_s', 'bytes'), stats)) for name, stats in stages.items()}
+                for worker, stages in self.stats.items()
+            }
+            events = list(self.events)
+            dropped_events = self.dropped_events
+        report = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'stages': self.stage_totals(),
+            'workers': workers,
+            'dropped_events': dropped_events,
+            'metadata': metadata or {},
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f)
+        logging.info(f"Profile written to {path} ({len(events)} trace events, {dropped_events} dropped)")
+
+    def log_breakdown(self):
+        """
+        Log the wall time, CPU time and throughput of every stage, slowest first.
+        """
+        totals = self.stage_totals()
+        all_wall = sum(total['wall_s'] for total in totals.values()) or 1.0
+        lines = [f"{'stage':<14}{'count':>10}{'wall s':>10}{'%':>7}{'cpu s':>10}{'MB':>10}{'ms/run':>9}"]
+        for name, total in sorted(totals.items(), key=lambda item: item[1]['wall_s'], reverse=True):
+            lines.append(
+                f"{name:<14}{total['count']:>10}{total['wall_s']:>10.2f}{100 * total['wall_s'] / all_wall:>7.1f}"
+                f"{total['cpu_s']:>10.2f}{total['bytes'] / 1024 ** 2:>10.1f}{1000 * total['wall_s'] / max(total['count'], 1):>9.2f}"
+            )
+        logging.info("Stage breakdown, summed over workers:\n" + "\n".join(lines))
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'nbytes', 'start', 'wall_start', 'cpu_start')
+
+    def __init__(self, profiler, name, nbytes):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.time()
+        self.cpu_start = time.thread_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        self.profiler.add(self.name, wall, cpu, self.nbytes, self.start)
+        return False
+
+
+class _NullStage:
+    """
+    Stage returned when profiling is disabled. Shared, and does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def profile_stage(name, nbytes=0):
+    """
+    Time a stage with the active profiler. When profiling is disabled this returns a shared no-op context.
+
+    Parameters:
+        name (str): Name of the stage, e.g. 'decode', 'resize', 'encode' or 'write'.
+        nbytes (int): Number of bytes of the stage, if known upfront.
+    """
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name, nbytes)
+
+
+def enable_profiling(max_events=200000):
+    """
+    Start profiling the stages of this process.
+
+    Returns:
+        StageProfiler: The active profiler.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = StageProfiler(max_events)
+    return _profiler
+
+
+def get_profiler():
+    """
+    Get the active profiler, or None if profiling is disabled.
+    """
+    return _profiler
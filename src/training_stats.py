@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from array import array
+import numpy as np
+import pandas as pd
+
+# Columns stored for every row, besides the metric means
+INDEX_COLUMNS = ('tick', 'kimg', 'timestamp')
+
+
+class StatsTail:
+    """
+    Incremental reader of a StyleGAN `stats.jsonl`.
+
+    Every `update` reads only the bytes appended since the previous one and
+    parses the complete lines, so reloading a run that has been training for
+    days costs as much as its last few ticks. Metric means are stored column by
+    column in compact typed arrays, NaN where a metric is missing.
+
+    With `cache_path`, the columns and the byte offset are saved to an `.npz`
+    after each update that read something, so a new session resumes from where
+    the previous one stopped.
+
+    Parameters:
+        path (str): Path to `stats.jsonl`.
+        cache_path (str): Optional path of the `.npz` cache, e.g. next to `stats.jsonl`.
+    """
+    def __init__(self, path, cache_path=None):
+        self.path = path
+        self.cache_path = cache_path
+        self._reset()
+        if cache_path is not None:
+            self._load_cache()
+
+    def _reset(self):
+        self.offset = 0
+        self.head = None
+        self.rows = 0
+        self.columns = {name: array('d') for name in INDEX_COLUMNS}
+
+    def update(self):
+        """
+        Parse the lines appended since the last update.
+
+        Returns:
+            int: The number of new rows.
+        """
+        if not os.path.exists(self.path):
+            return 0
+        size = os.path.getsize(self.path)
+        if size < self.offset or (self.head is not None and self._read_head() != self.head):
+            logging.warning(f"{self.path} was truncated or replaced, reading it again.")
+            self._reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+
+        # A partially written last line is left for the next update
+        end = data.rfind(b'\n') + 1
+        new_rows = 0
+        for line in data[:end].splitlines():
+            if self._append(line):
+                new_rows += 1
+        self.offset += end
+
+        if self.head is None and self.offset > 0:
+            self.head = self._read_head()
+        if new_rows and self.cache_path is not None:
+            self._save_cache()
+        return new_rows
+
+    def _append(self, line):
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            logging.warning(f"Skipping a malformed line of {self.path}: {e}")
+            return False
+        if not isinstance(entry, dict) or not isinstance(entry.get('Progress/tick'), dict):
+            return False
+
+        values = {
+            'tick': entry['Progress/tick'].get('mean'),
+            'kimg': entry.get('Progress/kimg', {}).get('mean'),
+            'timestamp': entry.get('timestamp'),
+        }
+        for metric, stats in entry.items():
+            if isinstance(stats, dict) and metric not in ('Progress/tick', 'Progress/kimg'):
+                values[metric] = stats.get('mean')
+
+        for name, value in values.items():
+            if name not in self.columns:
+                # New metric, missing from the previous rows
+                self.columns[name] = array('d', [np.nan]) * self.rows
+            self.columns[name].append(np.nan if value is None else float(value))
+        for name, column in self.columns.items():
+            if len(column) == self.rows:
+                column.append(np.nan)
+        self.rows += 1
+        return True
+
+    @property
+    def metrics(self):
+        """
+        The names of the metrics seen so far, e.g. 'Loss/G/loss'.
+        """
+        return [name for name in self.columns if name not in INDEX_COLUMNS]
+
+    def column(self, name):
+        """
+        Get a column as a numpy array.
+        """
+        if name not in self.columns:
+            return np.full(self.rows, np.nan)
+        # A copy, the array cannot grow while numpy holds its buffer
+        return np.array(self.columns[name], dtype=np.float64)
+
+    def _read_head(self):
+        # Hash of the first line, to notice a file replaced by another run
+        with open(self.path, 'rb') as f:
+            return hashlib.sha1(f.readline()).hexdigest()
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                meta = json.loads(str(cache['__meta__']))
+                columns = {name: array('d', cache[name].tolist()) for name in meta['columns']}
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Ignoring the unreadable stats cache {self.cache_path}: {e}")
+            return
+        self.offset = meta['offset']
+        self.head = meta['head']
+        self.rows = meta['rows']
+        self.columns = columns
+
+    def _save_cache(self):
+        meta = {'offset': self.offset, 'head': self.head, 'rows': self.rows, 'columns': list(self.columns)}
+        tmp_path = f"{self.cache_path}.tmp.npz"
+        np.savez(tmp_path, __meta__=json.dumps(meta), **{name: self.column(name) for name in self.columns})
+        os.replace(tmp_path, self.cache_path)
+
+
+class TrainingHistory:
+    """
+    Metrics of a training run chained with the runs it was resumed from.
+
+    The lineage is followed through `resume_pkl` in `training_options.json`:
+    the parent is the run directory, next to this one, that holds the resumed
+    snapshot. Each run's kimg is offset by the kimg of the snapshot it resumed
+    from (minus its own `resume_kimg`, if it already counted from there), and
+    the parent's rows from that snapshot on are dropped, since the resumed run
+    replaces them.
+
+    Parameters:
+        run_dir (str): Directory of the latest run, e.g. `data/training_runs/00005-stylegan2-...`.
+        cache (bool): Whether to keep a `stats.cache.npz` next to every `stats.jsonl`.
+    """
+    def __init__(self, run_dir, cache=True):
+        self.runs = resolve_lineage(run_dir)
+        self.tails = [
+            StatsTail(os.path.join(run['run_dir'], 'stats.jsonl'), os.path.join(run['run_dir'], 'stats.cache.npz') if cache else None)
+            for run in self.runs
+        ]
+        self.update()
+
+    def update(self):
+        """
+        Read the new lines of every run.
+
+        Returns:
+            int: The number of new rows.
+        """
+        return sum(tail.update() for tail in self.tails)
+
+    @property
+    def metrics(self):
+        return sorted(set(metric for tail in self.tails for metric in tail.metrics))
+
+    def series(self, metric):
+        """
+        Get a metric over the whole lineage.
+
+        Returns:
+            tuple: The absolute kimg and the metric means, as numpy arrays.
+        """
+        kimgs, values = [], []
+        for i, (run, tail) in enumerate(zip(self.runs, self.tails)):
+            kimg = tail.column('kimg') + run['kimg_offset']
+            keep = np.ones(len(kimg), dtype=bool)
+            if i + 1 < len(self.runs):
+                # From the snapshot the next run resumed from, its rows replace these
+                keep = kimg < self.runs[i + 1]['kimg_offset'] + self.runs[i + 1]['resume_kimg']
+            kimgs.append(kimg[keep])
+            values.append(tail.column(metric)[keep])
+        return np.concatenate(kimgs), np.concatenate(values)
+
+    def to_frame(self, metrics=None):
+        """
+        Get the metrics as a DataFrame indexed by absolute kimg, like a pivot of the old long format.
+        """
+        metrics = metrics or self.metrics
+        columns = {}
+        kimg = None
+        for metric in metrics:
+            kimg, columns[metric] = self.series(metric)
+        if kimg is None:
+            kimg = self.series('kimg')[0]
+        return pd.DataFrame(columns, index=pd.Index(kimg, name='kimg'))
+
+
+def resolve_lineage(run_dir):
+    """
+    Follow the `resume_pkl` of a run back to its first run.
+
+    Returns:
+        list: Dicts with the run directory, the kimg of the snapshot it resumed from (`resume_kimg`
+            as stored in the options), and the kimg offset of its rows, oldest run first.
+    """
+    lineage = []
+    seen = set()
+    run_dir = os.path.normpath(run_dir)
+    while run_dir is not None and run_dir not in seen:
+        seen.add(run_dir)
+        options = _read_training_options(run_dir)
+        parent_dir, snapshot_kimg = _resumed_snapshot(run_dir, options.get('resume_pkl'))
+        lineage.append({
+            'run_dir': run_dir,
+            'parent_dir': parent_dir,
+            'snapshot_kimg': snapshot_kimg,
+            'resume_kimg': options.get('resume_kimg') or 0,
+        })
+        run_dir = parent_dir
+
+    lineage.reverse()
+    offset = 0
+    for run in lineage:
+        if run['parent_dir'] is not None:
+            # This run counts from resume_kimg, the parent's snapshot is at snapshot_kimg on the parent's scale
+            offset = offset + run['snapshot_kimg'] - run['resume_kimg']
+        run['kimg_offset'] = offset
+    return lineage
+
+
+def _read_training_options(run_dir):
+    options_path = os.path.join(run_dir, 'training_options.json')
+    if not os.path.exists(options_path):
+        return {}
+    with open(options_path, 'r') as f:
+        return json.load(f)
+
+
+def _resumed_snapshot(run_dir, resume_pkl):
+    """
+    Find the run directory and kimg of the snapshot a run resumed from.
+
+    The pickle path is usually from the training server, so the parent is looked
+    up by its directory name next to `run_dir`.
+    """
+    if not resume_pkl:
+        return None, 0
+    match = re.search(r'network-snapshot-(\d+)\.pkl$', resume_pkl)
+    snapshot_kimg = int(match.group(1)) if match else 0
+    parent_name = os.path.basename(os.path.dirname(resume_pkl))
+    parent_dir = os.path.join(os.path.dirname(run_dir), parent_name)
+    if not parent_name or not os.path.isdir(parent_dir) or os.path.normpath(parent_dir) == run_dir:
+        logging.warning(f"Run {run_dir} resumed from {resume_pkl}, which is not in {os.path.dirname(run_dir)}.")
+        return None, 0
+    return os.path.normpath(parent_dir), snapshot_kimg
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+from .training_stats import resolve_lineage
+from .video_tool import save_frames_as_video
+
+# Snapshot grids written by StyleGAN every `--snap` ticks
+SNAPSHOT_PATTERN = re.compile(r'^fakes(\d{6})\.png$')
+
+# Reduction factors OpenCV can apply while reading an image
+READ_REDUCTIONS = {
+    1: (cv.IMREAD_COLOR, cv.IMREAD_GRAYSCALE),
+    2: (cv.IMREAD_REDUCED_COLOR_2, cv.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv.IMREAD_REDUCED_COLOR_4, cv.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv.IMREAD_REDUCED_COLOR_8, cv.IMREAD_REDUCED_GRAYSCALE_8),
+}
+
+
+def list_snapshots(run_dirs):
+    """
+    List the `fakesNNNNNN.png` snapshots of several runs in absolute kimg order.
+
+    The kimg of a resumed run is offset by the snapshot it resumed from (see
+    `resolve_lineage`). Runs without a `resume_pkl` are assumed to continue the
+    previous run of `run_dirs`, from its last snapshot. When two runs have a
+    snapshot at the same absolute kimg, the earlier run's is kept (a resumed
+    run's first snapshot is the network it resumed from).
+
+    Parameters:
+        run_dirs (list): Training run directories, oldest first.
+
+    Returns:
+        list: (absolute kimg, path) tuples.
+    """
+    snapshots = {}
+    last_kimg = 0
+    for i, run_dir in enumerate(run_dirs):
+        lineage = resolve_lineage(run_dir)
+        if lineage[-1]['parent_dir'] is not None:
+            offset = lineage[-1]['kimg_offset']
+        else:
+            offset = last_kimg if i > 0 else 0
+
+        for name in sorted(os.listdir(run_dir)):
+            match = SNAPSHOT_PATTERN.match(name)
+            if match is None:
+                continue
+            kimg = offset + int(match.group(1))
+            snapshots.setdefault(kimg, os.path.join(run_dir, name))
+            last_kimg = max(last_kimg, kimg)
+
+    return sorted(snapshots.items())
+
+
+def get_grid_resolution(run_dir):
+    """
+    Get the resolution of the tiles of the snapshot grids of a run, from its `training_options.json`.
+    """
+    options_path = os.path.join(run_dir, 'training_options.json')
+    if not os.path.exists(options_path):
+        return None
+    with open(options_path, 'r') as f:
+        options = json.load(f)
+    return options.get('training_set_kwargs', {}).get('resolution')
+
+
+def read_snapshot(path, scale=1.0, tile=None, tile_size=None, grayscale=False):
+    """
+    Read a snapshot grid, or one tile of it, downscaled.
+
+    The image is read with OpenCV's reduced decoding at the largest power of two
+    that keeps it at least at the target size, so the full resolution grid is
+    not kept around, and is then resized with area interpolation.
+
+    Parameters:
+        path (str): Path to the snapshot.
+        scale (float): Output scale, relative to the grid or to the tile.
+        tile (tuple): Optional (row, column) of the tile to crop.
+        tile_size (int): Size of the tiles in pixels, required with `tile`.
+        grayscale (bool): Whether to read the snapshot as single-channel grayscale.
+
+    Returns:
+        numpy.ndarray: The frame, or None if the image could not be read.
+    """
+    reduction = max(r for r in READ_REDUCTIONS if r == 1 or 1 / r >= scale)
+    img = cv.imread(path, READ_REDUCTIONS[reduction][grayscale])
+    if img is None:
+        logging.error(f"Error: Could not read snapshot {path}.")
+        return None
+
+    if tile is not None:
+        row, col = tile
+        size = tile_size // reduction
+        img = img[row * size:(row + 1) * size, col * size:(col + 1) * size]
+
+    remaining = scale * reduction
+    if remaining != 1:
+        img = cv.resize(img, None, fx=remaining, fy=remaining, interpolation=cv.INTER_AREA)
+    return img
+
+
+def iter_snapshot_frames(snapshots, scale=1.0, tile=None, tile_size=None, grayscale=False, workers=4):
+    """
+    Read snapshots on a thread pool and yield them in order.
+
+    At most `2 * workers` snapshots are read ahead, so memory does not depend on the number of snapshots.
+    Unreadable snapshots are skipped, and frames are resized to the size of the first one if needed.
+
+    Parameters:
+        snapshots (list): (kimg, path) tuples, see `list_snapshots`.
+        workers (int): Number of reader threads.
+        scale, tile, tile_size, grayscale: See `read_snapshot`.
+
+    Yields:
+        numpy.ndarray: The frames.
+    """
+    size = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        snapshots = iter(snapshots)
+        while True:
+            while len(pending) < 2 * workers:
+                snapshot = next(snapshots, None)
+                if snapshot is None:
+                    break
+                pending.append(executor.submit(read_snapshot, snapshot[1], scale, tile, tile_size, grayscale))
+            if not pending:
+                return
+
+            frame = pending.popleft().result()
+            if frame is None:
+                continue
+            if size is None:
+                size = (frame.shape[1], frame.shape[0])
+            elif (frame.shape[1], frame.shape[0]) != size:
+                frame = cv.resize(frame, size, interpolation=cv.INTER_AREA)
+            yield frame
+
+
+def write_gif_frames(frames, gif_path, fps=3, grayscale=True):
+    """
+    Pass frames through while writing them to a looping GIF with ffmpeg, one at a time.
+
+    Grayscale GIFs use ffmpeg's 256 gray levels, which is exact for gray frames; color
+    GIFs use the fixed `rgb8` palette, since an optimal palette needs every frame upfront.
+
+    Parameters:
+        frames (iterable): Frames, BGR or single-channel.
+        gif_path (str): Path of the GIF.
+        fps (int): Frames per second.
+        grayscale (bool): Whether to write a grayscale GIF.
+
+    Yields:
+        numpy.ndarray: The frames, unchanged.
+    """
+    # Optional dependency, only needed for GIFs
+    import imageio_ffmpeg
+
+    writer = None
+    count = 0
+    try:
+        for frame in frames:
+            if writer is None:
+                writer = imageio_ffmpeg.write_frames(
+                    gif_path, (frame.shape[1], frame.shape[0]), fps=fps, codec='gif', quality=None,
+                    pix_fmt_in='gray' if grayscale else 'rgb24', pix_fmt_out='gray' if grayscale else 'rgb8',
+                    macro_block_size=1, output_params=['-loop', '0'],
+                )
+                writer.send(None)
+            if grayscale:
+                data = frame if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+            else:
+                data = cv.cvtColor(frame, cv.COLOR_GRAY2RGB) if frame.ndim == 2 else cv.cvtColor(frame, cv.COLOR_BGR2RGB)
+            writer.send(np.ascontiguousarray(data))
+            count += 1
+            yield frame
+    finally:
+        if writer is not None:
+            writer.close()
+            logging.info(f"GIF saved as {gif_path} ({count} frames)")
+
+
+def create_training_video(run_dirs, video_path=None, gif_path=None, fps=3, scale=0.2, tile=None, tile_size=None, grayscale=False, workers=4, gif_color=False):
+    """
+    Create an MP4 and/or a GIF of the evolution of the snapshot grids of training runs, streaming the snapshots.
+
+    Parameters:
+        run_dirs (list): Training run directories, oldest first.
+        video_path (str): Path of the MP4, if any.
+        gif_path (str): Path of the GIF, if any.
+        fps (int): Frames per second.
+        scale (float): Output scale, relative to the grid or to the tile.
+        tile (tuple): Optional (row, column) of a single tile to follow.
+        tile_size (int): Size of the tiles. If None, it is read from the first run's `training_options.json`.
+        grayscale (bool): Whether to read and write single-channel frames.
+        workers (int): Number of reader threads.
+        gif_color (bool): Whether to write a color GIF instead of a grayscale one.
+
+    Returns:
+        int: The number of frames written.
+    """
+    snapshots = list_snapshots(run_dirs)
+    if not snapshots:
+        logging.error(f"No fakesNNNNNN.png snapshots in {run_dirs}.")
+        return 0
+    logging.info(f"Found {len(snapshots)} snapshots, from {snapshots[0][0]} to {snapshots[-1][0]} kimg.")
+
+    if tile is not None and tile_size is None:
+        tile_size = get_grid_resolution(run_dirs[0])
+        if tile_size is None:
+            raise ValueError("The tile size is not in training_options.json, pass it explicitly.")
+
+    frames = iter_snapshot_frames(snapshots, scale, tile, tile_size, grayscale, workers)
+    if gif_path is not None:
+        frames = write_gif_frames(frames, gif_path, fps, grayscale=not gif_color)
+    if video_path is not None:
+        return save_frames_as_video(frames, video_path, fps)
+    return sum(1 for _ in frames)
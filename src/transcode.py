@@ -0,0 +1,223 @@
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+# Video codecs that can be stream copied into an MP4 as they are
+MP4_COPY_CODECS = ('h264', 'hevc', 'mpeg4', 'av1')
+
+# Encoder settings when the codec has to be re-encoded
+ENCODE_PARAMS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p']
+
+VIDEO_STREAM_PATTERN = re.compile(r'Stream #\d+:\d+.*?: Video: (\w+)')
+DURATION_PATTERN = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def get_ffmpeg_exe():
+    """
+    Get the path of the ffmpeg binary shipped with imageio-ffmpeg.
+    """
+    # Optional dependency, only needed for transcoding
+    import imageio_ffmpeg
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def probe_video(input_path):
+    """
+    Get the video codec and the duration of a video from the header ffmpeg prints.
+
+    Returns:
+        dict: The `codec` (e.g. 'mjpeg', 'h264') and the `duration` in seconds, None when unknown.
+    """
+    result = subprocess.run(
+        [get_ffmpeg_exe(), '-hide_banner', '-i', input_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace'
+    )
+    codec = VIDEO_STREAM_PATTERN.search(result.stderr)
+    duration = DURATION_PATTERN.search(result.stderr)
+    return {
+        'codec': codec.group(1) if codec else None,
+        'duration': int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else None,
+    }
+
+
+def get_mp4_path(input_path, output_dir=None):
+    """
+    Get the path of the MP4 of a video, next to it or in `output_dir`.
+    """
+    name = f"{os.path.splitext(os.path.basename(input_path))[0]}.mp4"
+    return os.path.join(output_dir if output_dir is not None else os.path.dirname(input_path), name)
+
+
+def is_up_to_date(input_path, output_path):
+    """
+    Check whether an output exists and is newer than its input.
+    """
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def transcode_to_mp4(input_path, output_path=None, overwrite=False, progress=None):
+    """
+    Convert a video to MP4 with ffmpeg.
+
+    The video stream is copied as it is when its codec can be stored in an MP4
+    (see `MP4_COPY_CODECS`), which only remuxes the file, and is re-encoded to
+    H.264 otherwise (e.g. MJPEG or raw AVIs). Audio is dropped. The output is
+    written to a temporary file and renamed, so an interrupted conversion never
+    leaves a truncated MP4 that looks up to date.
+
+    Parameters:
+        input_path (str): Path to the input video, e.g. an AVI.
+        output_path (str): Path of the MP4. Defaults to the input path with an .mp4 extension.
+        overwrite (bool): Whether to convert even if the output is newer than the input.
+        progress (callable): Called with the converted fraction of the video, from 0 to 1.
+
+    Returns:
+        str: 'skipped', 'copied', 'encoded' or 'failed'.
+    """
+    output_path = output_path or get_mp4_path(input_path)
+    if not overwrite and is_up_to_date(input_path, output_path):
+        return 'skipped'
+
+    info = probe_video(input_path)
+    if info['codec'] is None:
+        logging.error(f"Error: Could not find a video stream in {input_path}.")
+        return 'failed'
+
+    copy = info['codec'] in MP4_COPY_CODECS
+    codec_params = ['-c:v', 'copy'] if copy else ENCODE_PARAMS
+    if copy and info['codec'] == 'mpeg4':
+        # DivX/Xvid AVIs pack B-frames in a way MP4 does not support
+        codec_params = codec_params + ['-bsf:v', 'mpeg4_unpack_bframes']
+
+    tmp_path = f"{output_path}.{os.getpid()}.tmp.mp4"
+    command = [
+        get_ffmpeg_exe(), '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+        '-i', input_path, '-map', '0:v:0', '-an', *codec_params, '-movflags', '+faststart',
+        '-progress', 'pipe:1', '-nostats', tmp_path,
+    ]
+    # Errors go to a file: a damaged video can print more than a pipe holds while we read the progress
+    with tempfile.TemporaryFile(mode='w+', errors='replace') as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, text=True, errors='replace')
+        for line in process.stdout:
+            # ffmpeg 4 reports out_time_ms in microseconds, like out_time_us
+            key, _, value = line.strip().partition('=')
+            if progress is not None and info['duration'] and key in ('out_time_us', 'out_time_ms') and value.isdigit():
+                progress(min(int(value) / 1e6 / info['duration'], 1.0))
+        process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+
+    if process.returncode != 0:
+        logging.error(f"Error during conversion of {input_path}: {stderr.strip()}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return 'failed'
+
+    os.replace(tmp_path, output_path)
+    if progress is not None:
+        progress(1.0)
+    logging.debug(f"Converted {input_path} to {output_path}")
+    return 'copied' if copy else 'encoded'
+
+
+def transcode_video_dir(video_dir='data/videos/', output_dir=None, workers=None, overwrite=False, extensions=('.avi',)):
+    """
+    Convert every video of a directory to MP4 across a pool of processes.
+
+    Every conversion runs its own ffmpeg process; the pool caps how many run at
+    once. Outputs newer than their input are skipped, so the conversion can be
+    interrupted and run again.
+
+    Parameters:
+        video_dir (str): The directory where the videos are stored.
+        output_dir (str): The directory of the MP4s. Defaults to `video_dir`.
+        workers (int): Number of concurrent conversions. Defaults to the number of CPUs.
+        overwrite (bool): Whether to convert videos whose MP4 is up to date.
+        extensions (tuple): Extensions of the videos to convert.
+
+    Returns:
+        dict: The number of videos per status ('skipped', 'copied', 'encoded', 'failed').
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    input_paths = sorted(
+        os.path.join(video_dir, name) for name in os.listdir(video_dir)
+        if os.path.splitext(name)[1].lower() in extensions
+    )
+    counts = {'skipped': 0, 'copied': 0, 'encoded': 0, 'failed': 0}
+
+    pending = []
+    for input_path in input_paths:
+        if not overwrite and is_up_to_date(input_path, get_mp4_path(input_path, output_dir)):
+            counts['skipped'] += 1
+        else:
+            pending.append(input_path)
+    if not pending:
+        logging.info(f"All {len(input_paths)} videos of {video_dir} are up to date.")
+        return counts
+
+    # Largest videos first, so a long one does not start last and leave the other workers idle
+    pending.sort(key=os.path.getsize, reverse=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(transcode_to_mp4, input_path, get_mp4_path(input_path, output_dir), True): input_path
+            for input_path in pending
+        }
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Converting videos"):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                logging.error(f"Error during conversion of {futures[future]}: {e}")
+                counts['failed'] += 1
+
+    logging.info(", ".join(f"{count} {status}" for status, count in counts.items()))
+    return counts
+
+
+class TranscodeJob:
+    """
+    Conversion of a video to MP4 running on a background thread.
+
+    The conversion itself runs in an ffmpeg process, so the thread only reads
+    its progress and the caller (e.g. the player loop) is never blocked.
+
+    Parameters:
+        input_path (str): Path to the input video.
+        output_path (str): Path of the MP4. Defaults to the input path with an .mp4 extension.
+        overwrite (bool): Whether to convert even if the output is up to date.
+    """
+    def __init__(self, input_path, output_path=None, overwrite=False):
+        self.input_path = input_path
+        self.output_path = output_path or get_mp4_path(input_path)
+        self.progress = 0.0
+        self.status = 'running'
+        self.thread = threading.Thread(target=self._run, args=(overwrite,), daemon=True)
+        self.thread.start()
+
+    @property
+    def done(self):
+        return self.status != 'running'
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return self.done
+
+    def _run(self, overwrite):
+        try:
+            self.status = transcode_to_mp4(self.input_path, self.output_path, overwrite, progress=self._set_progress)
+        except Exception as e:
+            logging.error(f"Error during conversion of {self.input_path}: {e}")
+            self.status = 'failed'
+        if self.status != 'failed':
+            self.progress = 1.0
+        logging.info(f"Export of {self.input_path} to {self.output_path}: {self.status}")
+
+    def _set_progress(self, fraction):
+        self.progress = fraction
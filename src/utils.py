@@ -1,4 +1,4 @@
-import logging
+import hashlib
 import os
 
 def get_video_path_from_id(video_id, video_dir='data/videos/'):
@@ -11,9 +11,47 @@ def get_video_path_from_id(video_id, video_dir='data/videos/'):
 
     Returns:
         str: The full path to the video file.
+
+    Raises:
+        FileNotFoundError: If the video file does not exist.
     """
-    video_path = f"{video_dir}{video_id}.avi"
+    video_path = os.path.join(video_dir, f"{video_id}.avi")
     if not os.path.exists(video_path):
-        logging.error(f"Error: Video file {video_path} does not exist.")
-        exit()
-    return video_path
\ No newline at end of file
+        raise FileNotFoundError(f"Video file {video_path} does not exist.")
+    return video_path
+
+def hash_file(path, block_size=1024 ** 2):
+    """
+    Compute the SHA-1 of a file.
+
+    Parameters:
+        path (str): Path to the file.
+        block_size (int): Number of bytes read at a time.
+
+    Returns:
+        str: The hex digest.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def write_file_atomic(path, data):
+    """
+    Write bytes to a file through a temporary file renamed into place, so an
+    interrupted write never leaves a truncated file that looks complete.
+
+    Parameters:
+        path (str): Path to the file.
+        data (bytes): The content of the file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
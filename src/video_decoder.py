@@ -0,0 +1,54 @@
+import cv2 as cv
+from .ffmpeg_capture import FFmpegCapture
+from .video_index import get_video_index
+
+
+class VideoDecoder:
+    """
+    Open videos with a selectable decoder backend.
+
+    Backends:
+        'opencv': `cv.VideoCapture`, single-threaded, BGR frames at the source size.
+        'ffmpeg': `FFmpegCapture`, the ffmpeg binary of `imageio-ffmpeg` with codec-level threads,
+            which can output grayscale frames and scale them to the output size while decoding.
+
+    Both return an object with the `cv.VideoCapture` calls used in this repo. The
+    grayscale and size requested in `open` are hints: the OpenCV backend ignores
+    them, so callers still convert and resize frames that do not match.
+
+    Parameters:
+        backend (str): 'opencv' or 'ffmpeg'.
+        threads (int): Number of decoder threads of the ffmpeg backend, 0 for ffmpeg's default.
+    """
+    BACKENDS = ('opencv', 'ffmpeg')
+
+    def __init__(self, backend='opencv', threads=0):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown decoder backend: {backend}. Choose one of {self.BACKENDS}.")
+        self.backend = backend
+        self.threads = threads
+
+    def open(self, video_path, grayscale=False, frame_size=None, interpolation='linear'):
+        """
+        Open a video.
+
+        Parameters:
+            video_path (str): Path to the video file.
+            grayscale (bool): Whether single-channel grayscale frames are wanted instead of BGR.
+            frame_size (tuple): If given, the (width, height) the frames are wanted at.
+            interpolation (str): Interpolation used to scale the frames to `frame_size`.
+
+        Returns:
+            cv.VideoCapture | FFmpegCapture: The capture. Check `isOpened()`.
+        """
+        if self.backend == 'ffmpeg':
+            return FFmpegCapture(video_path, 'gray' if grayscale else 'bgr24', frame_size, self.threads, interpolation)
+        return cv.VideoCapture(video_path)
+
+    def seek_index(self, video_path):
+        """
+        Get the seek index to position the captures of this decoder with (see `seek_to_frame`).
+
+        ffmpeg seeks exactly by itself, from the nearest keyframe, so its captures need no index.
+        """
+        return get_video_index(video_path) if self.backend == 'opencv' else None
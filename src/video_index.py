@@ -0,0 +1,254 @@
+import bisect
+import json
+import logging
+import os
+import struct
+import cv2 as cv
+
+# idx1 flag of the chunks that hold a keyframe
+AVIIF_KEYFRAME = 0x10
+
+# Indexes that could not be saved next to their video (e.g. read-only videos directory), by index path
+_unsaved_indexes = {}
+
+
+def get_index_path(video_path):
+    """
+    Get the path of the sidecar index of a video, e.g. `data/videos/1.index.json`.
+    """
+    return f"{os.path.splitext(video_path)[0]}.index.json"
+
+
+def get_video_index(video_path, rebuild=False):
+    """
+    Get the seek index of a video, building it if it is missing or out of date.
+
+    The index is stored next to the video and is rebuilt when the size or mtime
+    of the video changes. It holds the exact frame count, the keyframes and the
+    byte offset and size of every frame.
+
+    Parameters:
+        video_path (str): Path to the video file.
+        rebuild (bool): Whether to rebuild the index even if it is up to date.
+
+    Returns:
+        dict: The index, or None if the video could not be read.
+    """
+    index_path = get_index_path(video_path)
+    stat = os.stat(video_path)
+
+    if not rebuild and os.path.exists(index_path):
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index['source_size'] == stat.st_size and index['source_mtime'] == stat.st_mtime:
+                return index
+        except (OSError, json.JSONDecodeError, KeyError):
+            pass
+
+    unsaved = _unsaved_indexes.get(index_path)
+    if not rebuild and unsaved is not None and unsaved['source_size'] == stat.st_size and unsaved['source_mtime'] == stat.st_mtime:
+        return unsaved
+
+    index = build_video_index(video_path)
+    if index is None:
+        return None
+
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        # Kept in memory instead, so it is built once per process
+        logging.warning(f"Could not save the seek index of {video_path}, it will be rebuilt by the next run: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _unsaved_indexes[index_path] = index
+    return index
+
+
+def build_video_index(video_path):
+    """
+    Scan a video once and build its seek index.
+
+    AVI files are indexed from their `idx1` chunk, which gives the keyframe
+    flag, byte offset and size of every frame without decoding. Other files, or
+    AVIs without `idx1`, are decoded once to count their frames; their only
+    known keyframe is the first frame.
+
+    Parameters:
+        video_path (str): Path to the video file.
+
+    Returns:
+        dict: The index, or None if the video could not be read.
+    """
+    stat = os.stat(video_path)
+    index = None
+    if video_path.lower().endswith('.avi'):
+        try:
+            index = _read_avi_index(video_path)
+        except (OSError, struct.error, ValueError) as e:
+            logging.warning(f"Could not read the AVI index of {video_path}: {e}")
+
+    if index is None:
+        frame_count = _count_frames(video_path)
+        if frame_count is None:
+            return None
+        index = {'frame_count': frame_count, 'keyframes': [0] if frame_count else [], 'offsets': None, 'sizes': None}
+
+    index['source_size'] = stat.st_size
+    index['source_mtime'] = stat.st_mtime
+    return index
+
+
+def build_video_dir_index(video_dir='data/videos/', rebuild=False):
+    """
+    Build or refresh the seek index of every AVI in a directory.
+
+    Parameters:
+        video_dir (str): The directory where the videos are stored.
+        rebuild (bool): Whether to rebuild the indexes even if they are up to date.
+
+    Returns:
+        dict: Mapping from video path to its index.
+    """
+    # Imported here, the player uses this module and never draws a progress bar
+    from tqdm import tqdm
+
+    video_paths = [os.path.join(video_dir, f) for f in sorted(os.listdir(video_dir)) if f.endswith('.avi')]
+    return {
+        video_path: get_video_index(video_path, rebuild)
+        for video_path in tqdm(video_paths, desc="Indexing videos")
+    }
+
+
+def nearest_keyframe(index, frame_number):
+    """
+    Get the last keyframe at or before `frame_number`.
+    """
+    keyframes = index['keyframes']
+    pos = bisect.bisect_right(keyframes, frame_number) - 1
+    return keyframes[pos] if pos >= 0 else 0
+
+
+def seek_to_frame(cap, frame_number, index=None):
+    """
+    Position a capture so the next `read()` returns `frame_number`.
+
+    With an index, the capture is seeked to the nearest keyframe, where OpenCV
+    seeks are exact, and the remaining frames are grabbed without converting
+    them. Without an index, this falls back to OpenCV's frame seek.
+
+    Parameters:
+        cap (cv.VideoCapture): An opened capture.
+        frame_number (int): The frame to position the capture at.
+        index (dict): The seek index of the video.
+
+    Returns:
+        bool: Whether the capture could be positioned.
+    """
+    if index is None:
+        return cap.set(cv.CAP_PROP_POS_FRAMES, frame_number)
+
+    keyframe = nearest_keyframe(index, frame_number)
+    cap.set(cv.CAP_PROP_POS_FRAMES, keyframe)
+    for _ in range(frame_number - keyframe):
+        if not cap.grab():
+            return False
+    return True
+
+
+def _count_frames(video_path):
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        logging.error(f"Error: Could not open video {video_path}.")
+        return None
+    frame_count = 0
+    while cap.grab():
+        frame_count += 1
+    cap.release()
+    return frame_count
+
+
+def _read_avi_index(video_path):
+    """
+    Read the frame index of the first video stream of an AVI from its `idx1` chunk.
+
+    Returns:
+        dict: The frame count, keyframes, offsets and sizes, or None if the file has no `idx1` chunk.
+    """
+    with open(video_path, 'rb') as f:
+        riff, _, form = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or form != b'AVI ':
+            raise ValueError("not a RIFF AVI file")
+
+        video_stream = None
+        movi_pos = None
+        idx1 = None
+        file_size = os.fstat(f.fileno()).st_size
+
+        # Walk the top level chunks, descending only into the header list
+        pos = 12
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            ckid, size = struct.unpack('<4sI', f.read(8))
+            if ckid == b'LIST':
+                list_type = f.read(4)
+                if list_type == b'hdrl':
+                    video_stream = _find_video_stream(f, pos + 12, pos + 8 + size)
+                elif list_type == b'movi':
+                    movi_pos = pos + 8
+            elif ckid == b'idx1':
+                idx1 = f.read(size)
+            elif ckid == b'RIFF':
+                # OpenDML extension ('AVIX'), idx1 only covers the first part of the file
+                return None
+            pos += 8 + size + (size & 1)
+
+        if idx1 is None or movi_pos is None:
+            return None
+        if video_stream is None:
+            video_stream = 0
+
+        prefix = f'{video_stream:02d}'.encode()
+        entries = [struct.unpack_from('<4sIII', idx1, i) for i in range(0, len(idx1) - 15, 16)]
+        entries = [e for e in entries if e[0][:2] == prefix and e[0][2:] in (b'dc', b'db')]
+        if not entries:
+            return None
+
+        # Offsets are relative to the 'movi' list, except in some writers that use absolute offsets
+        base = movi_pos
+        f.seek(movi_pos + entries[0][2])
+        if f.read(4) != entries[0][0]:
+            base = 0
+
+    keyframes = [i for i, e in enumerate(entries) if e[1] & AVIIF_KEYFRAME]
+    if not keyframes or keyframes[0] != 0:
+        keyframes.insert(0, 0)
+    return {
+        'frame_count': len(entries),
+        'keyframes': keyframes,
+        'offsets': [base + e[2] + 8 for e in entries],
+        'sizes': [e[3] for e in entries],
+    }
+
+
+def _find_video_stream(f, start, end):
+    """
+    Find the number of the first video stream in the `hdrl` list.
+    """
+    stream_number = 0
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        ckid, size = struct.unpack('<4sI', f.read(8))
+        if ckid == b'LIST' and f.read(4) == b'strl':
+            # The stream header is the first chunk of the list
+            f.seek(pos + 12)
+            strh_id, _ = struct.unpack('<4sI', f.read(8))
+            if strh_id == b'strh' and f.read(4) == b'vids':
+                return stream_number
+            stream_number += 1
+        pos += 8 + size + (size & 1)
+    return None
@@ -1,4 +1,13 @@
+import logging
+import os
 import pandas as pd
+from .utils import hash_file
+
+# Default location of the parsed labels cache
+DEFAULT_LABELS_CACHE_DIR = 'data/cache/labels/'
+
+# Part of the labels cache key, bump it whenever the parsing below changes (renames, dtypes...)
+LABELS_PARSER_VERSION = 2
 
 def normalize_columns_names(columns):
     """
@@ -14,9 +23,31 @@ def normalize_columns_names(columns):
     )
     return columns
 
-def read_video_labels_df(path):
+def read_video_labels_df(path, cache_dir=DEFAULT_LABELS_CACHE_DIR):
     """
     Read the rotulos DataFrame from an Excel file and normalize its column names.
+
+    The parsed DataFrame is cached in `cache_dir`, keyed by the hash of the Excel
+    file and `LABELS_PARSER_VERSION`, so the spreadsheet is only parsed again
+    when it or the parsing changes. Pass `cache_dir=None` to always parse it.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, f"labels-v{LABELS_PARSER_VERSION}-{hash_file(path)}.pkl")
+        if os.path.exists(cache_path):
+            return pd.read_pickle(cache_path)
+
+    df = _parse_video_labels_df(path)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        df.to_pickle(cache_path)
+        logging.info(f"Cached the parsed labels of {path} in {cache_path}")
+    return df
+
+def _parse_video_labels_df(path):
+    """
+    Parse the rotulos Excel file with openpyxl.
     """
     # df_frames_pas = pd.read_excel('../data/rotulos/Frames e PAS.xlsx')
     df = pd.read_excel(path)
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+from tqdm import tqdm
+from .video_index import get_video_index
+
+# Name of the probe cache inside the videos directory
+PROBE_FILE_NAME = 'videos.probe.json'
+
+
+def probe_video(video_path, verify=True):
+    """
+    Read the metadata of a video.
+
+    The frame count in the header (`CAP_PROP_FRAME_COUNT`) is often wrong for
+    these AVIs, so with `verify` the frames are counted by decoding the whole
+    video; otherwise the count of the seek index is used (see `get_video_index`).
+
+    Parameters:
+        video_path (str): Path to the video file.
+        verify (bool): Whether to count the frames by decoding the video.
+
+    Returns:
+        dict: The frame count, header and index frame counts, fps, width, height, codec (FourCC),
+            file size and mtime, whether the count was verified, and an `error` if the video
+            could not be read.
+    """
+    stat = os.stat(video_path)
+    entry = {
+        'size': stat.st_size, 'mtime': stat.st_mtime, 'frame_count': 0, 'header_frame_count': None,
+        'index_frame_count': None, 'fps': None, 'width': None, 'height': None, 'codec': None,
+        'verified': verify, 'error': None,
+    }
+
+    cap = cv.VideoCapture(video_path)
+    if not cap.isOpened():
+        entry['error'] = 'could not open the video'
+        return entry
+    fourcc = int(cap.get(cv.CAP_PROP_FOURCC))
+    entry.update({
+        'header_frame_count': int(cap.get(cv.CAP_PROP_FRAME_COUNT)),
+        'fps': cap.get(cv.CAP_PROP_FPS),
+        'width': int(cap.get(cv.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)),
+        'codec': ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ') or None,
+    })
+
+    index = get_video_index(video_path)
+    if index is not None:
+        entry['index_frame_count'] = index['frame_count']
+
+    if verify:
+        frame_count = 0
+        while cap.grab():
+            frame_count += 1
+        entry['frame_count'] = frame_count
+    else:
+        entry['frame_count'] = entry['index_frame_count'] if index is not None else entry['header_frame_count']
+    cap.release()
+
+    if entry['frame_count'] == 0:
+        entry['error'] = 'no frame could be decoded'
+    elif verify and entry['index_frame_count'] not in (None, entry['frame_count']):
+        logging.warning(f"{video_path} has {entry['frame_count']} decodable frames, but its index lists {entry['index_frame_count']}.")
+    return entry
+
+
+class VideoProbe:
+    """
+    Cached metadata of every video of a directory, probed in parallel and refreshed incrementally.
+
+    The metadata (see `probe_video`) is stored in `videos.probe.json` inside the
+    directory. `refresh` only probes the videos that are new, or whose size or
+    mtime changed, and drops the ones that were removed, so after the first scan
+    it costs a `stat` per video. Lookups then need no filesystem access.
+
+    Parameters:
+        video_dir (str): The directory where the videos are stored.
+        workers (int): Number of threads probing videos. OpenCV releases the GIL while decoding.
+        verify (bool): Whether to count the frames by decoding every video.
+        extension (str): Extension of the videos.
+    """
+    def __init__(self, video_dir='data/videos/', workers=None, verify=True, extension='.avi'):
+        self.video_dir = video_dir
+        self.path = os.path.join(video_dir, PROBE_FILE_NAME)
+        self.workers = workers
+        self.verify = verify
+        self.extension = extension
+        self.videos = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.videos = json.load(f).get('videos', {})
+            except (OSError, json.JSONDecodeError) as e:
+                logging.warning(f"Ignoring the unreadable video probe {self.path}: {e}")
+        self.refresh()
+
+    def refresh(self):
+        """
+        Probe the new and changed videos of the directory and forget the removed ones.
+
+        Returns:
+            int: The number of videos probed.
+        """
+        stats = {
+            os.path.splitext(name)[0]: os.stat(os.path.join(self.video_dir, name))
+            for name in os.listdir(self.video_dir)
+            if name.endswith(self.extension)
+        }
+        removed = [video_id for video_id in self.videos if video_id not in stats]
+        for video_id in removed:
+            del self.videos[video_id]
+
+        stale = []
+        for video_id, stat in stats.items():
+            entry = self.videos.get(video_id)
+            if (entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime
+                    or (self.verify and not entry['verified'])):
+                stale.append(video_id)
+
+        if stale:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                entries = executor.map(lambda video_id: probe_video(self.get_path(video_id), self.verify), stale)
+                for video_id, entry in tqdm(zip(stale, entries), total=len(stale), desc="Probing videos"):
+                    self.videos[video_id] = entry
+        if stale or removed:
+            self._save()
+        return len(stale)
+
+    def get_path(self, video_id):
+        return os.path.join(self.video_dir, f"{video_id}{self.extension}")
+
+    def get(self, video_id):
+        """
+        Get the metadata of a video, or None if it is not in the directory.
+        """
+        return self.videos.get(str(video_id))
+
+    def frame_count(self, video_id):
+        """
+        Get the frame count of a video, 0 if it is missing or unreadable.
+        """
+        entry = self.get(video_id)
+        return entry['frame_count'] if entry is not None else 0
+
+    def readable_ids(self):
+        """
+        Get the IDs of the videos that could be read, longest first.
+        """
+        video_ids = [video_id for video_id, entry in self.videos.items() if entry['error'] is None]
+        return sorted(video_ids, key=lambda video_id: self.videos[video_id]['frame_count'], reverse=True)
+
+    def validate_labels(self, df_labels, frame_columns=('frame_max_constricao',)):
+        """
+        Check that the videos of the labels exist and that their labeled frames are in range.
+
+        Parameters:
+            df_labels (pd.DataFrame): DataFrame containing video labels.
+            frame_columns (tuple): Label columns that point to a frame number.
+
+        Returns:
+            list: (video_id, column, frame, problem) tuples, with None column and frame for missing
+                or unreadable videos.
+        """
+        problems = []
+        for video_id, df_video in df_labels.groupby(df_labels['video_id'].astype(str), sort=False):
+            entry = self.get(video_id)
+            if entry is None:
+                problems.append((video_id, None, None, 'video file not found'))
+                continue
+            if entry['error'] is not None:
+                problems.append((video_id, None, None, entry['error']))
+                continue
+            for column in frame_columns:
+                if column not in df_video.columns:
+                    continue
+                for frame_number in df_video[column].dropna():
+                    if not 0 <= int(frame_number) < entry['frame_count']:
+                        problems.append((video_id, column, int(frame_number), f"out of range, the video has {entry['frame_count']} frames"))
+        return problems
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'videos': self.videos}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # e.g. a read-only videos directory, the probe is still used for this run
+            logging.warning(f"Could not save the video probe {self.path}, the videos will be probed again next run: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def log_label_problems(problems):
+    """
+    Log the problems found by `VideoProbe.validate_labels`.
+    """
+    for video_id, column, frame_number, problem in problems:
+        if column is None:
+            logging.error(f"Video {video_id}: {problem}.")
+        else:
+            logging.error(f"Video {video_id}: {column} = {frame_number} is {problem}.")
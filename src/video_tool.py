@@ -1,10 +1,15 @@
 from .utils import get_video_path_from_id
+from .frame_cache import get_cached_frames
+from .image_tool import to_grayscale
+from .video_index import get_video_index, nearest_keyframe, seek_to_frame
+# Re-exported for the callers that import it from here
+from .video_decoder import VideoDecoder
 import cv2 as cv
-from PIL import Image
+import numpy as np
 import logging
 from tqdm import tqdm
 
-def get_video_frame(video_id, frame_number, video_dir='data/videos/'):
+def get_video_frame(video_id, frame_number, video_dir='data/videos/', cache_dir=None, decoder=None):
     """
     Get a specific frame from a video.
 
@@ -12,82 +17,249 @@ def get_video_frame(video_id, frame_number, video_dir='data/videos/'):
         video_id (str): The ID of the video.
         frame_number (int): Frame number to extract.
         video_dir (str): The directory where the videos are stored.
+        cache_dir (str): If given, the frame is read from the decoded frame cache in this directory.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`.
 
     Returns:
         frame (numpy.ndarray): The extracted frame as a numpy array.
     """
+    if cache_dir is not None:
+        frames = get_cached_frames(video_id, video_dir, cache_dir)
+        if frames is None or not 0 <= frame_number < len(frames):
+            print("Error: Could not read frame.")
+            return None
+        return frames[frame_number]
+
     # Get the video path
     video_path = get_video_path_from_id(video_id, video_dir)
     
     # Load the video
-    cap = cv.VideoCapture(video_path)
+    cap = decoder.open(video_path) if decoder is not None else cv.VideoCapture(video_path)
     
     if not cap.isOpened():
         print("Error: Could not open video.")
         return None
 
-    # Set the frame position
-    cap.set(cv.CAP_PROP_POS_FRAMES, frame_number)
+    # Set the frame position, from the nearest keyframe of the seek index
+    seek_to_frame(cap, frame_number, decoder.seek_index(video_path) if decoder is not None else get_video_index(video_path))
 
     ret, frame = cap.read()
+    cap.release()
     if ret:
         return frame
     else:
         print("Error: Could not read frame.")
         return None
-    
-def get_all_frames(video_id, video_dir='data/videos/'):
+
+def get_video_frames(video_id, frame_numbers, video_dir='data/videos/', cache_dir=None):
     """
-    Get all frames from a video.
+    Get several frames from a video in a single forward decode pass.
+
+    The requested frame numbers are sorted and the video is decoded forward
+    once, using `grab()` to skip frames and `retrieve()` only for the requested
+    ones. With a seek index, the capture jumps to the nearest keyframe of a
+    target whenever that is ahead of the current position.
 
     Parameters:
         video_id (str): The ID of the video.
+        frame_numbers (list): Frame numbers to extract. Duplicates are allowed.
         video_dir (str): The directory where the videos are stored.
+        cache_dir (str): If given, the frames are read from the decoded frame cache in this directory.
 
     Returns:
-        frames (list): A list of frames as numpy arrays.
+        frames (list): The extracted frames, in the same order as `frame_numbers`.
+            Frames that could not be read are returned as None.
     """
+    frame_numbers = [int(n) for n in frame_numbers]
+    if not frame_numbers:
+        return []
+
+    if cache_dir is not None:
+        frames = get_cached_frames(video_id, video_dir, cache_dir)
+        if frames is None:
+            return [None] * len(frame_numbers)
+        return [frames[n] if 0 <= n < len(frames) else None for n in frame_numbers]
+
     # Get the video path
     video_path = get_video_path_from_id(video_id, video_dir)
-    
+
     # Load the video
     cap = cv.VideoCapture(video_path)
-    
+
     if not cap.isOpened():
-        print("Error: Could not open video.")
-        return None
+        logging.error(f"Error: Could not open video {video_path}.")
+        return [None] * len(frame_numbers)
 
-    frames = []
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    index = get_video_index(video_path)
+    targets = sorted(set(n for n in frame_numbers if n >= 0))
+    decoded = {}
+    frame_idx = 0
+    for target in targets:
+        if index is not None and nearest_keyframe(index, target) > frame_idx:
+            frame_idx = nearest_keyframe(index, target)
+            cap.set(cv.CAP_PROP_POS_FRAMES, frame_idx)
+
+        # Skip frames without decoding them into a numpy array
+        while frame_idx < target:
+            if not cap.grab():
+                break
+            frame_idx += 1
+        if frame_idx < target or not cap.grab():
             break
-        frames.append(frame)
-    
+        ret, frame = cap.retrieve()
+        if ret:
+            decoded[target] = frame
+        frame_idx += 1
+
+    cap.release()
+
+    missing = [n for n in frame_numbers if n not in decoded]
+    if missing:
+        logging.error(f"Error: Could not read frames {missing} from video {video_path}.")
+
+    return [decoded.get(n) for n in frame_numbers]
+
+def iter_frames(video_id, start=0, stop=None, step=1, video_dir='data/videos/', cache_dir=None, grayscale=False, batch_size=None, decoder=None):
+    """
+    Iterate over the frames of a video without keeping them in memory.
+
+    Frames are decoded as they are consumed, so memory use does not depend on
+    the length of the video. The capture is positioned at `start` from the
+    nearest keyframe of the seek index, and the frames between two yielded ones
+    are grabbed without converting them to arrays.
+
+    Parameters:
+        video_id (str): The ID of the video.
+        start (int): First frame.
+        stop (int): Frame to stop at (exclusive). If None, iterates until the end of the video.
+        step (int): Yield every `step`-th frame.
+        video_dir (str): The directory where the videos are stored.
+        cache_dir (str): If given, the frames are views of the decoded frame cache in this directory.
+        grayscale (bool): Whether to yield single-channel grayscale frames instead of BGR.
+        batch_size (int): If given, yield arrays of `batch_size` stacked frames instead of single
+            frames. The last batch may be shorter.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`. The ffmpeg
+            backend decodes straight to grayscale with `grayscale`.
+
+    Returns:
+        generator: The frames (or batches) as numpy arrays, or None if the video could not be opened.
+    """
+    if step < 1:
+        raise ValueError(f"step must be at least 1, got {step}")
+
+    if cache_dir is not None:
+        cached = get_cached_frames(video_id, video_dir, cache_dir)
+        if cached is None:
+            return None
+        frames = (cached[i] for i in range(start, len(cached) if stop is None else min(stop, len(cached)), step))
+    else:
+        # Get the video path
+        video_path = get_video_path_from_id(video_id, video_dir)
+
+        # Load the video
+        cap = decoder.open(video_path, grayscale) if decoder is not None else cv.VideoCapture(video_path)
+
+        if not cap.isOpened():
+            logging.error(f"Error: Could not open video {video_path}.")
+            return None
+        if start > 0:
+            seek_to_frame(cap, start, decoder.seek_index(video_path) if decoder is not None else get_video_index(video_path))
+        frames = _iter_capture(cap, start, stop, step)
+
+    if grayscale:
+        frames = (to_grayscale(frame)[0] for frame in frames)
+    if batch_size is not None:
+        frames = _iter_batches(frames, batch_size)
     return frames
 
+def _iter_capture(cap, start, stop, step):
+    """
+    Read every `step`-th frame of a positioned capture, and release it when done.
+    """
+    try:
+        frame_idx = start
+        while stop is None or frame_idx < stop:
+            if (frame_idx - start) % step:
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                yield frame
+            frame_idx += 1
+    finally:
+        cap.release()
+
+def _iter_batches(frames, batch_size):
+    """
+    Stack consecutive frames into arrays of `batch_size` frames.
+    """
+    batch = None
+    count = 0
+    for frame in frames:
+        if batch is None:
+            # A new array for every batch, the consumer may keep the previous one
+            batch = np.empty((batch_size,) + frame.shape, dtype=frame.dtype)
+        batch[count] = frame
+        count += 1
+        if count == batch_size:
+            yield batch
+            batch, count = None, 0
+    if count:
+        yield batch[:count]
+
+def get_all_frames(video_id, video_dir='data/videos/', cache_dir=None, grayscale=False, decoder=None):
+    """
+    Get all frames from a video.
+
+    This keeps every frame in memory, prefer `iter_frames` for long videos.
+
+    Parameters:
+        video_id (str): The ID of the video.
+        video_dir (str): The directory where the videos are stored.
+        cache_dir (str): If given, the frames are views of the decoded frame cache in this directory.
+        grayscale (bool): Whether to return single-channel grayscale frames instead of BGR.
+        decoder (VideoDecoder): If given, the decoder used instead of `cv.VideoCapture`.
+
+    Returns:
+        frames (list): A list of frames as numpy arrays.
+    """
+    frames = iter_frames(video_id, video_dir=video_dir, cache_dir=cache_dir, grayscale=grayscale, decoder=decoder)
+    if frames is None:
+        return None
+    return list(frames)
+
 def save_frames_as_video(frames, output_path, fps=30):
     """
-    Save a list of frames as a video file.
+    Save frames as a video file, writing them as they arrive.
 
     Parameters:
-        frames (list): List of frames as numpy arrays.
+        frames (iterable): Frames as numpy arrays, in BGR or single-channel grayscale, e.g. a list
+            or the generator returned by `iter_frames`. Batches must be flattened first.
         output_path (str): Path to save the output video.
         fps (int): Frames per second for the video.
-    """
-    if not frames:
-        logging.error("No frames to save.")
-        return
-
-    height, width, layers = frames[0].shape
-    fourcc = cv.VideoWriter_fourcc(*'mp4v')  # Codec for mp4
-    video_writer = cv.VideoWriter(output_path, fourcc, fps, (width, height))
 
+    Returns:
+        int: The number of frames written.
+    """
+    video_writer = None
+    count = 0
     for frame in frames:
+        if video_writer is None:
+            height, width = frame.shape[:2]
+            fourcc = cv.VideoWriter_fourcc(*'mp4v')  # Codec for mp4
+            video_writer = cv.VideoWriter(output_path, fourcc, fps, (width, height), isColor=frame.ndim == 3)
         video_writer.write(frame)
+        count += 1
+
+    if video_writer is None:
+        logging.error("No frames to save.")
+        return 0
 
     video_writer.release()
-    logging.info(f"Video saved as {output_path}")
+    logging.info(f"Video saved as {output_path} ({count} frames)")
+    return count
 
 def convert_avi_to_mp4(input_path, output_path):
     """
@@ -0,0 +1,37 @@
+import argparse
+import logging
+import os
+from src.transcode import transcode_video_dir
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Convert the AVI videos of a directory to MP4 with ffmpeg, in parallel.")
+
+    parser.add_argument('--video-dir', type=str, default='data/videos/', help='Path to the video directory')
+    parser.add_argument('--output-dir', type=str, default=None, help='Directory of the MP4s (defaults to the video directory)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of concurrent conversions (defaults to the number of CPUs)')
+    parser.add_argument('--overwrite', action='store_true', help='Convert videos whose MP4 is already up to date')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.video_dir):
+        parser.error(f"Video directory {args.video_dir} does not exist.")
+
+    return args
+
+def main(argv=None, prog=None):
+    args = parse_args(argv, prog)
+
+    counts = transcode_video_dir(
+        video_dir = args.video_dir,
+        output_dir = args.output_dir,
+        workers = args.workers,
+        overwrite = args.overwrite
+    )
+    if counts['failed']:
+        exit(1)
+
+if __name__ == "__main__":
+    main()
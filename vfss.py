@@ -0,0 +1,34 @@
+import argparse
+import importlib
+
+# Script of every command, with its description. A script is only imported when its
+# command runs, so a command never loads the modules (pandas, PIL...) of the others.
+COMMANDS = {
+    'play': ('media_player', "Play a video, or several side by side in a grid"),
+    'extract': ('create-image-dataset-from-videos', "Create an image or clip dataset from the videos"),
+    'transcode': ('transcode-videos', "Convert the AVI videos to MP4"),
+    'probe': ('probe-videos', "Probe the videos and check the labels against them"),
+    'stats': ('show-dataset-stats', "Show the statistics saved by extract --stats"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="VFSS video tools.",
+        epilog="commands:\n" + "\n".join(f"  {command:<12}{description}" for command, (_, description) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('command', type=str, choices=list(COMMANDS), metavar='command', help='The command to run, see below')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the command, see `<command> --help`')
+
+    args = parser.parse_args(argv)
+    args.prog = f"{parser.prog} {args.command}"
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    script, _ = COMMANDS[args.command]
+    importlib.import_module(script).main(args.args, args.prog)
+
+if __name__ == "__main__":
+    main()